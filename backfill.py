@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Backfill ride rows from archived Bellhop responses.
+Re-derives CSV (and optionally BigQuery) rows from the raw JSON archive, either
+the json/data_* objects in Google Cloud Storage or local data/data_*.json files,
+using a process pool. Progress is checkpointed so an interrupted run resumes
+where it stopped.
+"""
+import os
+import re
+import time
+import uuid
+import logging
+import argparse
+from itertools import islice
+from datetime import datetime, timedelta
+from multiprocessing import Pool, cpu_count
+from src.backends import create_backend
+from src.quotes import CSV_FIELDNAMES, build_csv_rows, build_bigquery_rows
+from src.routes import load_routes
+from src.sinks import LocalCsvSink, ComposedCsvSink, BigQuerySink
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# json/data_Sample1_pair3_20250311_120000.json, written by the GCS collectors
+GCS_ARCHIVE_PATTERN = re.compile(r"data_(?P<sample_type>.+)_pair(?P<pair_id>\d+)_(?P<timestamp>\d{8}_\d{6})\.json$")
+
+# data/data_Times_Square_to_JFK_20250310_233753.json, written by manual_collect.py
+LOCAL_ARCHIVE_PATTERN = re.compile(r"data_(?P<route_name>.+)_(?P<timestamp>\d{8}_\d{6})\.json$")
+
+# Default object name prefix of the archive per --source
+ARCHIVE_PREFIXES = {"local": "data_", "gcs": "json/data_"}
+
+# Per-process state set up by init_worker
+_worker = {}
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Re-derive ride rows from archived API responses')
+    parser.add_argument('--source', choices=['local', 'gcs'], default='local', help='Where the archive lives')
+    parser.add_argument('--local-dir', default='data', help='Directory holding data_*.json files')
+    parser.add_argument('--bucket', default=os.environ.get("GCS_BUCKET_NAME"), help='GCS bucket name')
+    parser.add_argument('--prefix', help='Object name prefix of the archive (default: data_ locally, json/data_ in GCS)')
+    parser.add_argument('--csv-out', default='data/backfill_ride_prices.csv', help='Output CSV path, or object name with --gcs-out')
+    parser.add_argument('--gcs-out', action='store_true', help='Write the CSV to the GCS bucket')
+    parser.add_argument('--bigquery', action='store_true', help='Also insert rows into BigQuery')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='Worker processes')
+    parser.add_argument('--window', type=int, default=2000, help='Responses in flight per checkpoint')
+    parser.add_argument('--checkpoint', default='data/backfill.checkpoint', help='Checkpoint file path')
+    return parser.parse_args()
+
+def list_archive(backend, prefix):
+    """
+    List archived responses in lexicographic order
+
+    Args:
+        backend: Storage backend holding the archive (see src/backends.py)
+        prefix (str): Object name prefix of the archive
+
+    Returns:
+        iterator: Archive object names
+    """
+    return (name for name in backend.list(prefix) if name.endswith(".json"))
+
+def describe_archive(name, routes_by_id):
+    """
+    Recover collection time and route details from an archive name
+
+    Args:
+        name (str): Archive file path or object name
+        routes_by_id (dict): Route registry keyed by route_id
+
+    Returns:
+        dict: timestamp, sample_type, route_id, pickup and destination place dicts, or None
+    """
+    basename = os.path.basename(name)
+
+    match = GCS_ARCHIVE_PATTERN.search(basename)
+    if match:
+        route_id = f"{match['sample_type']}-{match['pair_id']}"
+        route = routes_by_id.get(route_id)
+        if route:
+            pickup, destination = route["origin"], route["destination"]
+        else:
+            pickup = destination = {"name": "", "lat": None, "lng": None}
+        return {
+            "timestamp": datetime.strptime(match["timestamp"], "%Y%m%d_%H%M%S"),
+            "sample_type": match["sample_type"],
+            "route_id": route_id,
+            "pickup": pickup,
+            "destination": destination,
+        }
+
+    match = LOCAL_ARCHIVE_PATTERN.search(basename)
+    if match:
+        pickup_name, _, dest_name = match["route_name"].partition("_to_")
+        return {
+            "timestamp": datetime.strptime(match["timestamp"], "%Y%m%d_%H%M%S"),
+            "sample_type": "",
+            "route_id": None,
+            "pickup": {"name": pickup_name.replace("_", " "), "lat": None, "lng": None},
+            "destination": {"name": dest_name.replace("_", " "), "lat": None, "lng": None},
+        }
+
+    return None
+
+def init_worker(source, bucket_name, local_dir, with_bigquery):
+    """Set up per-process storage backend and lookups"""
+    _worker["routes_by_id"] = {route["route_id"]: route for route in load_routes()}
+    _worker["with_bigquery"] = with_bigquery
+    _worker["backend"] = create_backend(source, bucket_name=bucket_name, root=local_dir)
+    # Archives in GCS are referenced from BigQuery instead of copied
+    _worker["reference_raw"] = source == "gcs"
+
+def load_archive_rows(name):
+    """
+    Download and parse one archived response (runs in a worker process)
+
+    Returns:
+        tuple: (name, csv_rows, bigquery_rows, raw_rows)
+    """
+    info = describe_archive(name, _worker["routes_by_id"])
+    if info is None:
+        logger.warning(f"Skipping unrecognised archive name: {name}")
+        return name, [], [], []
+
+    # Raw bytes are parsed incrementally and never re-serialized
+    try:
+        data = _worker["backend"].get(name)
+    except Exception as e:
+        logger.error(f"Error reading {name}: {e}")
+        return name, [], [], []
+
+    # A malformed archive is skipped so it can't abort the run and stall the checkpoint
+    pickup, destination = info["pickup"], info["destination"]
+    try:
+        csv_rows = build_csv_rows(data, info["sample_type"], pickup["name"], destination["name"], info["timestamp"])
+        bigquery_rows, raw_rows = [], []
+        if _worker["with_bigquery"] and csv_rows:
+            # request_id is derived from the archive name so re-written rows can be deduplicated
+            bigquery_rows, raw_row = build_bigquery_rows(
+                data, pickup["lat"], pickup["lng"], destination["lat"], destination["lng"], info["timestamp"],
+                route_id=info["route_id"], sample_type=info["sample_type"] or None,
+                request_id=uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+            )
+            if _worker["reference_raw"]:
+                raw_row["raw_response"] = None
+                raw_row["raw_uri"] = _worker["backend"].uri(name)
+            raw_rows.append(raw_row)
+    except Exception as e:
+        logger.error(f"Error parsing {name}: {e}")
+        return name, [], [], []
+    return name, csv_rows, bigquery_rows, raw_rows
+
+def read_checkpoint(path):
+    """Return the last fully written archive name, or None"""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+def write_checkpoint(path, name):
+    """Atomically record the last fully written archive name"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(name)
+    os.replace(tmp_path, path)
+
+def track_time_span(names, span):
+    """
+    Pass archive names through, keeping the earliest and latest collection time in span
+
+    Args:
+        names (iterator): Archive names
+        span (list): Filled with [earliest, latest] once a name has a timestamp
+
+    Returns:
+        iterator: The same names
+    """
+    routes_by_id = {route["route_id"]: route for route in load_routes()}
+    for name in names:
+        info = describe_archive(name, routes_by_id)
+        if info:
+            span[:] = [min(span[0], info["timestamp"]), max(span[1], info["timestamp"])] if span else [info["timestamp"]] * 2
+        yield name
+
+def run_backfill(names, sinks, checkpoint_path, workers, window, initargs):
+    """
+    Parse archives in a process pool and write their rows to the sinks
+
+    Archives are submitted one window at a time so memory stays bounded no
+    matter how large the archive is. After every window the sinks are flushed
+    and the checkpoint advances to the window's last name; a restarted run
+    skips everything up to the checkpoint. Rows of a window that was being
+    written when the run died may be written again.
+
+    Args:
+        names (iterator): Archive names in lexicographic order
+        sinks (dict): Sinks keyed by "csv" and optionally "bigquery" and "bigquery_raw"
+        checkpoint_path (str): Checkpoint file path
+        workers (int): Worker processes
+        window (int): Archives per window
+        initargs (tuple): Arguments for init_worker
+
+    Returns:
+        tuple: (archives processed, csv rows written)
+    """
+    resume_after = read_checkpoint(checkpoint_path)
+    if resume_after:
+        logger.info(f"Resuming after checkpoint {resume_after}")
+        names = (name for name in names if name > resume_after)
+
+    processed = 0
+    start = time.time()
+    chunksize = max(1, window // (workers * 4))
+    with Pool(processes=workers, initializer=init_worker, initargs=initargs) as pool:
+        while True:
+            batch = list(islice(names, window))
+            if not batch:
+                break
+            for _, csv_rows, bigquery_rows, raw_rows in pool.imap(load_archive_rows, batch, chunksize=chunksize):
+                sinks["csv"].write(csv_rows)
+                if "bigquery" in sinks:
+                    sinks["bigquery_raw"].write(raw_rows)
+                    sinks["bigquery"].write(bigquery_rows)
+            for sink in sinks.values():
+                sink.flush()
+            write_checkpoint(checkpoint_path, batch[-1])
+
+            processed += len(batch)
+            elapsed = time.time() - start
+            logger.info(f"Backfilled {processed} responses ({processed / elapsed:.1f}/s), checkpoint {batch[-1]}")
+
+    for sink in sinks.values():
+        sink.close()
+    return processed, sinks["csv"].rows_written
+
+def main():
+    """Main backfill function"""
+    args = parse_args()
+
+    if (args.source == "gcs" or args.gcs_out) and not args.bucket:
+        logger.error("Error: a GCS bucket is required (--bucket or GCS_BUCKET_NAME)")
+        return
+
+    archive = create_backend(args.source, bucket_name=args.bucket, root=args.local_dir)
+    names = list_archive(archive, args.prefix or ARCHIVE_PREFIXES[args.source])
+    span = []
+    if args.bigquery:
+        names = track_time_span(names, span)
+
+    if args.gcs_out:
+        sinks = {"csv": ComposedCsvSink(create_backend("gcs", bucket_name=args.bucket), args.csv_out, CSV_FIELDNAMES)}
+    else:
+        sinks = {"csv": LocalCsvSink(args.csv_out, CSV_FIELDNAMES)}
+    if args.bigquery:
+        from src.storage import BigQueryStorage
+        bigquery_storage = BigQueryStorage()
+        sinks["bigquery_raw"] = BigQuerySink(bigquery_storage.client, bigquery_storage.raw_table_ref)
+        sinks["bigquery"] = BigQuerySink(bigquery_storage.client, bigquery_storage.table_ref)
+
+    initargs = (args.source, args.bucket, args.local_dir, args.bigquery)
+    processed, rows = run_backfill(names, sinks, args.checkpoint, args.workers, args.window, initargs)
+    logger.info(f"Backfill complete: {processed} responses, {rows} CSV rows")
+
+    # One merge over the whole archive's time range, also covering windows written before a restart
+    if span:
+        changed = bigquery_storage.rebuild_aggregates(span[0], span[1] + timedelta(seconds=1))
+        logger.info(f"Aggregate rows changed: {changed}")
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,29 @@
 """
 Hourly Bellhop API Data Collection with Google Cloud Storage
 This script automatically collects ride pricing data for predefined routes every hour,
-storing results in Google Cloud Storage for persistence.
+storing results in Google Cloud Storage for persistence. Set STORAGE_BACKEND=local
+(or memory) to write to STORAGE_ROOT instead, see src/backends.py.
 """
 import os
 import json
-import csv
 import time
 import logging
-import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import requests
-from google.cloud import storage
+from src.archive import ContentAddressedArchive
+from src.backends import create_backend
+from src.changes import CHANGE_FIELDNAMES, ChangeDetector, QuoteState
+from src.columnar import ColumnarAppender
+from src.metrics import (
+    API_ATTEMPTS, API_RETRIES, CYCLE_LATENCY, STAGE_BYTES, STAGE_LATENCY,
+    export_metrics, record_api_call
+)
+from src.parsing import loads
+from src.quotes import CSV_FIELDNAMES, build_csv_rows
+from src.resilience import AdaptiveConcurrencyLimiter, CircuitBreaker, CircuitOpenError, report_outcome
+from src.routes import load_routes
+from src.sinks import csv_text, needs_csv_header
 
 # Configure logging
 logging.basicConfig(
@@ -27,122 +39,62 @@ logger = logging.getLogger(__name__)
 # Google Cloud Storage settings
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
 
-# Sample 1: Prestigious Origin-Destination Pairs (Luxury residences/hotels to corporate HQs)
-SAMPLE1_PAIRS = [
-    {"id": 1, "origin_id": 1, "destination_id": 2},
-    {"id": 2, "origin_id": 3, "destination_id": 4},
-    {"id": 3, "origin_id": 5, "destination_id": 6},
-    {"id": 4, "origin_id": 7, "destination_id": 8},
-    {"id": 5, "origin_id": 9, "destination_id": 10},
-    {"id": 6, "origin_id": 11, "destination_id": 12},
-    {"id": 7, "origin_id": 13, "destination_id": 14},
-    {"id": 8, "origin_id": 15, "destination_id": 16},
-    {"id": 9, "origin_id": 17, "destination_id": 18},
-    {"id": 10, "origin_id": 19, "destination_id": 20},
-]
+# Bellhop API endpoint (overridable to point at a local stand-in)
+BELLHOP_API_URL = os.environ.get("BELLHOP_API_URL", "https://api.bellhop.me/api/rich-intelligent-pricing")
+
+# Pacing between calls and samples, and the first rate-limit backoff, in seconds
+PAIR_DELAY_SECONDS = float(os.environ.get("PAIR_DELAY_SECONDS", "15"))
+SAMPLE_DELAY_SECONDS = float(os.environ.get("SAMPLE_DELAY_SECONDS", "60"))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "10"))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "30"))
 
-SAMPLE1_PLACES = [
-    {"id": 1, "name": "15 Central Park West", "lat": 40.769000, "lng": -73.981400},
-    {"id": 2, "name": "Goldman Sachs HQ", "lat": 40.714700, "lng": -74.013600},
-    {"id": 3, "name": "Central Park Tower", "lat": 40.765900, "lng": -73.982000},
-    {"id": 4, "name": "JP Morgan HQ", "lat": 40.755600, "lng": -73.977500},
-    {"id": 5, "name": "432 Park Avenue", "lat": 40.761600, "lng": -73.971800},
-    {"id": 6, "name": "CitiGroup HQ", "lat": 40.720600, "lng": -74.012800},
-    {"id": 7, "name": "15 Hudson Yards", "lat": 40.753600, "lng": -74.002200},
-    {"id": 8, "name": "McKinsey (WTC)", "lat": 40.712800, "lng": -74.011900},
-    {"id": 9, "name": "One57 (157 W 57th St)", "lat": 40.765300, "lng": -73.979000},
-    {"id": 10, "name": "BCG (Hudson Yards)", "lat": 40.753600, "lng": -74.002200},
-    {"id": 11, "name": "220 Central Park South", "lat": 40.766700, "lng": -73.980900},
-    {"id": 12, "name": "Google NYC", "lat": 40.740800, "lng": -74.003300},
-    {"id": 13, "name": "Four Seasons Hotel New York", "lat": 40.762600, "lng": -73.969700},
-    {"id": 14, "name": "Skadden Arps", "lat": 40.751700, "lng": -73.997200},
-    {"id": 15, "name": "The Beekman (Thompson Hotel)", "lat": 40.711200, "lng": -74.006600},
-    {"id": 16, "name": "Morgan Stanley HQ", "lat": 40.758300, "lng": -73.968600},
-    {"id": 17, "name": "The St. Regis New York", "lat": 40.761600, "lng": -73.974400},
-    {"id": 18, "name": "AIG", "lat": 40.705600, "lng": -74.009100},
-    {"id": 19, "name": "Four Seasons Hotel New York Downtown", "lat": 40.712600, "lng": -74.009700},
-    {"id": 20, "name": "Bain & Company", "lat": 40.756200, "lng": -73.981100},
-]
+# Adaptive concurrency: start with one call in flight and grow up to MAX_CONCURRENCY
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "4"))
 
-# Sample 2: Random Manhattan locations with nearly identical distances
-SAMPLE2_PAIRS = [
-    {"id": 1, "origin_id": 1, "destination_id": 2},
-    {"id": 2, "origin_id": 3, "destination_id": 4},
-    {"id": 3, "origin_id": 5, "destination_id": 6},
-    {"id": 4, "origin_id": 7, "destination_id": 8},
-    {"id": 5, "origin_id": 9, "destination_id": 10},
-    {"id": 6, "origin_id": 11, "destination_id": 12},
-    {"id": 7, "origin_id": 13, "destination_id": 14},
-    {"id": 8, "origin_id": 15, "destination_id": 16},
-    {"id": 9, "origin_id": 17, "destination_id": 18},
-    {"id": 10, "origin_id": 19, "destination_id": 20},
-]
+# Circuit breaker: after this many consecutive 429/5xx/timeouts, stop calling the API
+# and defer the remaining pairs until the breaker lets a trial call through
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "120"))
 
-SAMPLE2_PLACES = [
-    {"id": 1, "name": "Random Origin 1", "lat": 40.794705, "lng": -73.971795},
-    {"id": 2, "name": "Random Destination 1", "lat": 40.739203, "lng": -74.000226},
-    {"id": 3, "name": "Random Origin 2", "lat": 40.721926, "lng": -74.003187},
-    {"id": 4, "name": "Random Destination 2", "lat": 40.711705, "lng": -74.007952},
-    {"id": 5, "name": "Random Origin 3", "lat": 40.744180, "lng": -73.998954},
-    {"id": 6, "name": "Random Destination 3", "lat": 40.782621, "lng": -73.954126},
-    {"id": 7, "name": "Random Origin 4", "lat": 40.710470, "lng": -74.007748},
-    {"id": 8, "name": "Random Destination 4", "lat": 40.750068, "lng": -73.991665},
-    {"id": 9, "name": "Random Origin 5", "lat": 40.771169, "lng": -73.957614},
-    {"id": 10, "name": "Random Destination 5", "lat": 40.786449, "lng": -73.976858},
-    {"id": 11, "name": "Random Origin 6", "lat": 40.716300, "lng": -74.004792},
-    {"id": 12, "name": "Random Destination 6", "lat": 40.747133, "lng": -74.000472},
-    {"id": 13, "name": "Random Origin 7", "lat": 40.706267, "lng": -74.012561},
-    {"id": 14, "name": "Random Destination 7", "lat": 40.726520, "lng": -73.996706},
-    {"id": 15, "name": "Random Origin 8", "lat": 40.782064, "lng": -73.956258},
-    {"id": 16, "name": "Random Destination 8", "lat": 40.737330, "lng": -73.998871},
-    {"id": 17, "name": "Random Origin 9", "lat": 40.804611, "lng": -73.954223},
-    {"id": 18, "name": "Random Destination 9", "lat": 40.749035, "lng": -73.989995},
-    {"id": 19, "name": "Random Origin 10", "lat": 40.780999, "lng": -73.946376},
-    {"id": 20, "name": "Random Destination 10", "lat": 40.748841, "lng": -73.993437},
-]
+# Change detection: write only new/changed quotes plus a heartbeat every HEARTBEAT_HOURS
+# to CHANGES_CSV instead of every quote to ride_prices.csv
+CHANGE_DETECTION = os.environ.get("CHANGE_DETECTION", "").lower() in ("1", "true", "yes")
+HEARTBEAT_HOURS = float(os.environ.get("HEARTBEAT_HOURS", "6"))
+CHANGES_CSV = "ride_price_changes.csv"
+QUOTE_STATE_FILE = "quote_state.json"
 
-# Sample 3: NYC Residential to Airport Routes
-SAMPLE3_PAIRS = [
-    {"id": 1, "origin_id": 1, "destination_id": 2},    # Columbus Ave to JFK
-    {"id": 2, "origin_id": 1, "destination_id": 3},    # Columbus Ave to Newark
-    {"id": 3, "origin_id": 1, "destination_id": 4},    # Columbus Ave to LaGuardia
-    {"id": 4, "origin_id": 5, "destination_id": 2},    # Central Park West to JFK
-    {"id": 5, "origin_id": 5, "destination_id": 3},    # Central Park West to Newark
-    {"id": 6, "origin_id": 5, "destination_id": 4},    # Central Park West to LaGuardia
-    {"id": 7, "origin_id": 2, "destination_id": 1},    # JFK to Columbus Ave
-    {"id": 8, "origin_id": 3, "destination_id": 1},    # Newark to Columbus Ave
-    {"id": 9, "origin_id": 4, "destination_id": 1},    # LaGuardia to Columbus Ave
-    {"id": 10, "origin_id": 2, "destination_id": 5},   # JFK to Central Park West
-    {"id": 11, "origin_id": 3, "destination_id": 5},   # Newark to Central Park West
-    {"id": 12, "origin_id": 4, "destination_id": 5},   # LaGuardia to Central Park West
-]
+# Raw response archive: "raw" writes one JSON object per call, "dedup" stores each
+# distinct body once under its hash plus a pointer per call (see src/archive.py)
+ARCHIVE_MODE = os.environ.get("ARCHIVE_MODE", "raw").lower()
 
-SAMPLE3_PLACES = [
-    {"id": 1, "name": "795 Columbus Ave", "lat": 40.793682, "lng": -73.962427},
-    {"id": 2, "name": "JFK Airport", "lat": 40.641311, "lng": -73.778139},
-    {"id": 3, "name": "Newark Airport", "lat": 40.689531, "lng": -74.174462},
-    {"id": 4, "name": "LaGuardia Airport", "lat": 40.775997, "lng": -73.872457},
-    {"id": 5, "name": "15 Central Park West", "lat": 40.769000, "lng": -73.981400},
-]
+# Local backend directory unless STORAGE_ROOT is set; kept apart from manual_collect.py's data/,
+# whose ride_prices.csv has other columns
+LOCAL_STORAGE_ROOT = "collected/hourly"
 
-def initialize_gcs_client():
-    """Initialize Google Cloud Storage client"""
+# Optional local columnar history (see src/columnar.py) that every collected row is appended to
+HISTORY_DIR = os.environ.get("HISTORY_DIR")
+
+def initialize_storage():
+    """Create the storage backend: the GCS bucket unless STORAGE_BACKEND selects another"""
     try:
         # When running in GitHub Actions, the credentials will be injected from secrets
-        return storage.Client()
+        return create_backend(bucket_name=GCS_BUCKET_NAME, default="gcs", default_root=LOCAL_STORAGE_ROOT)
     except Exception as e:
-        logger.error(f"Failed to initialize GCS client: {e}")
+        logger.error(f"Failed to initialize storage: {e}")
         raise
 
-def get_place_by_id(sample_places, place_id):
-    """Get a place by its ID"""
-    for place in sample_places:
-        if place['id'] == place_id:
-            return place
-    return None
-
-def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng, max_retries=5):
-    """Make API call to Bellhop to get ride prices with retry logic for rate limiting"""
+def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng, max_retries=5, raw=False,
+               limiter=None, breaker=None):
+    """
+    Make API call to Bellhop to get ride prices with retry logic for rate limiting
+    
+    With raw=True the undecoded response body (bytes) is returned, so it can be
+    archived as-is and parsed incrementally. Every attempt holds a slot of the
+    optional limiter and reports its outcome to it and to the optional breaker.
+    
+    Raises:
+        CircuitOpenError: If the breaker is open, instead of waiting out the backoff
+    """
     headers = {
         "accept": "application/json",
         "X-API-KEY": api_key,
@@ -161,210 +113,157 @@ def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng,
         }
     }
     
-    url = "https://api.bellhop.me/api/rich-intelligent-pricing"
+    url = BELLHOP_API_URL
     
     # Exponential backoff parameters
-    base_delay = 10  # Start with a 10-second delay
+    base_delay = RETRY_BASE_DELAY_SECONDS
     
     for attempt in range(max_retries):
+        if breaker is not None:
+            breaker.check()
+        if limiter is not None:
+            limiter.acquire()
+        
+        status = "error"
+        response = None
+        started = time.perf_counter()
+        try:
+            response = requests.post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT_SECONDS)
+            status = response.status_code
+            record_api_call(time.perf_counter() - started, status, len(response.content))
+        except requests.exceptions.RequestException as e:
+            record_api_call(time.perf_counter() - started, status)
+            logger.error(f"Error fetching ride prices: {e}")
+        finally:
+            if limiter is not None:
+                limiter.release()
+            report_outcome(status, limiter, breaker)
+        
+        # If we get a rate limit error, wait and retry unless the breaker has tripped
+        if status == 429:
+            API_RETRIES.inc(reason="429")
+            if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+                raise CircuitOpenError("Circuit opened while retrying a rate-limited call")
+            retry_delay = base_delay * (2 ** attempt)  # Exponential backoff
+            logger.warning(f"Rate limit hit. Retrying in {retry_delay} seconds... (Attempt {attempt+1}/{max_retries})")
+            time.sleep(retry_delay)
+            continue
+        
+        API_ATTEMPTS.observe(attempt + 1)
+        if response is None:
+            return None
+        
         try:
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # If we get a rate limit error, wait and retry
-            if response.status_code == 429:
-                retry_delay = base_delay * (2 ** attempt)  # Exponential backoff
-                logger.warning(f"Rate limit hit. Retrying in {retry_delay} seconds... (Attempt {attempt+1}/{max_retries})")
-                time.sleep(retry_delay)
-                continue
-                
             response.raise_for_status()
-            return response.json()
-            
         except requests.exceptions.HTTPError as e:
-            if response.status_code == 429 and attempt < max_retries - 1:
-                # This case is handled above, just continue the loop
-                continue
             logger.error(f"HTTP error fetching ride prices: {e}")
             return None
+        
+        if raw:
+            return response.content
+        with STAGE_LATENCY.time(stage="decode"):
+            return loads(response.content)
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching ride prices: {e}")
-            return None
-            
+    API_ATTEMPTS.observe(max_retries)
     logger.error(f"Failed to get prices after {max_retries} attempts due to rate limiting")
     return None
 
-def save_results_to_gcs_json(client, data, sample_type, pair_id):
-    """Save API response to a JSON file in Google Cloud Storage"""
+def save_results_to_json(backend, data, sample_type, pair_id):
+    """Save API response to a JSON object in the storage backend"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"json/data_{sample_type}_pair{pair_id}_{timestamp}.json"
     
     try:
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(filename)
-        
-        # Convert to JSON string
-        json_string = json.dumps(data, indent=2)
+        # Raw responses are archived exactly as received
+        if isinstance(data, bytes):
+            json_string = data
+        else:
+            json_string = json.dumps(data, indent=2)
         
         # Upload
-        blob.upload_from_string(json_string, content_type="application/json")
+        with STAGE_LATENCY.time(stage="json_upload"):
+            backend.put(filename, json_string, content_type="application/json")
+        STAGE_BYTES.inc(len(json_string), stage="json_upload")
         
-        logger.info(f"JSON data saved to gs://{GCS_BUCKET_NAME}/{filename}")
-        return f"gs://{GCS_BUCKET_NAME}/{filename}"
+        logger.info(f"JSON data saved to {backend.uri(filename)}")
+        return backend.uri(filename)
     except Exception as e:
-        logger.error(f"Error saving JSON to GCS: {e}")
+        logger.error(f"Error saving JSON: {e}")
         return None
 
-def download_csv_from_gcs(client, csv_filename="ride_prices.csv"):
-    """Download existing CSV from GCS, or return empty data if it doesn't exist"""
+def save_rows_to_csv(backend, rows, csv_filename="ride_prices.csv", fieldnames=CSV_FIELDNAMES):
+    """
+    Append parsed rows to the CSV object with a single append
+    
+    The existing CSV is never downloaded; the header is written only when
+    the object is new or empty, and rows are refused if an existing object
+    has other columns.
+    
+    Returns:
+        bool: False if the append failed, True otherwise (including when there are no rows)
+    """
+    if not rows:
+        return True
+    
     try:
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(csv_filename)
+        csv_content = csv_text(rows, fieldnames, header=needs_csv_header(backend, csv_filename, fieldnames))
+        with STAGE_LATENCY.time(stage="csv_upload"):
+            backend.append(csv_filename, csv_content, content_type="text/csv")
+        STAGE_BYTES.inc(len(csv_content), stage="csv_upload")
         
-        if blob.exists():
-            content = blob.download_as_text()
-            return content
-        else:
-            logger.info(f"CSV file {csv_filename} does not exist in GCS yet. Will create a new one.")
-            return None
+        logger.info(f"CSV data appended to {backend.uri(csv_filename)}")
+        return True
     except Exception as e:
-        logger.error(f"Error downloading CSV from GCS: {e}")
-        return None
+        logger.error(f"Error appending to CSV: {e}")
+        return False
 
-def append_to_csv_and_upload(client, csv_data, data_rows, fieldnames, csv_filename="ride_prices.csv"):
-    """Append new rows to CSV data and upload to GCS"""
+def flush_archive(archive):
+    """Write the archive pointers buffered so far, so bodies uploaded before a crash stay referenced"""
+    if archive is None:
+        return
     try:
-        output = io.StringIO()
-        
-        if csv_data is None:
-            # Create new CSV with header
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data_rows)
-        else:
-            # Append to existing CSV data
-            # First, write the existing data
-            output.write(csv_data)
-            
-            # Check if we need to add a newline
-            if not csv_data.endswith('\n'):
-                output.write('\n')
-            
-            # Then append the new rows
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writerows(data_rows)
-        
-        # Upload back to GCS
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(csv_filename)
-        blob.upload_from_string(output.getvalue(), content_type="text/csv")
-        
-        logger.info(f"CSV data updated in gs://{GCS_BUCKET_NAME}/{csv_filename}")
-        return True
+        pointer_file = archive.flush()
+        if pointer_file:
+            logger.info(f"Archive pointers written to {pointer_file}")
     except Exception as e:
-        logger.error(f"Error appending to CSV and uploading to GCS: {e}")
-        return False
+        logger.error(f"Error writing archive pointers: {e}")
 
-def save_results_to_csv(client, data, sample_type, pickup_name, dest_name):
-    """Process API response and save to CSV in Google Cloud Storage"""
-    csv_filename = "ride_prices.csv"
-    
-    # Get the current time
-    timestamp = datetime.now()
-    date_str = timestamp.strftime("%Y-%m-%d")
-    time_str = timestamp.strftime("%H:%M:%S")
-    
-    # Extract search ID
-    search_id = data.get("search_id", "")
-    
-    # Parse the results
-    results = data.get("results", [])
-    if not results or not results[0].get("prices"):
-        logger.warning("No ride options to save")
-        return None
-    
-    # Prepare rows for CSV
-    rows = []
-    for price in results[0].get("prices", []):
-        provider = price.get("provider", "")
-        product = price.get("product", "")
-        service_level = price.get("service_level", "")
-        
-        # Price in dollars
-        price_min = price.get("price_min", 0) / 100 if price.get("price_min") is not None else 0
-        price_max = price.get("price_max", 0) / 100 if price.get("price_max") is not None else 0
+def load_quote_state(backend):
+    """Load the change detector state from storage, starting empty if there is none"""
+    try:
+        if backend.exists(QUOTE_STATE_FILE):
+            return QuoteState.from_json(backend.get(QUOTE_STATE_FILE))
+    except Exception as e:
+        logger.error(f"Error loading quote state, starting empty: {e}")
+    return QuoteState()
 
-        # Discounted Price in dollars
-        price_min_discounted = price.get("price_min_discounted", 0) / 100 if price.get("price_min_discounted") is not None else 0
-        price_max_discounted = price.get("price_max_discounted", 0) / 100 if price.get("price_max_discounted") is not None else 0
-        
-        # Wait time in seconds
-        wait_min = price.get("est_pickup_wait_time", {}).get("min", 0)
-        wait_max = price.get("est_pickup_wait_time", {}).get("max", 0)
-        
-        # Trip details
-        trip_seconds = price.get("est_time_after_pickup_till_dropoff", 0)
-        distance_meters = price.get("distance_meters", 0)
-        surge = price.get("surge_multiplier", 1.0)
-        
-        # Create a row
-        row = {
-            "date": date_str,
-            "time": time_str,
-            "search_id": search_id,
-            "sample_type": sample_type,
-            "pickup": pickup_name,
-            "destination": dest_name,
-            "provider": provider,
-            "product": product,
-            "service_level": service_level,
-            "price_min": f"{price_min:.2f}",
-            "price_max": f"{price_max:.2f}",
-            "price_min_discounted": f"{price_min_discounted:.2f}",
-            "price_max_discounted": f"{price_max_discounted:.2f}",
-            "wait_min_seconds": wait_min,
-            "wait_max_seconds": wait_max if wait_max else "",
-            "trip_seconds": trip_seconds,
-            "distance_meters": distance_meters,
-            "surge_multiplier": surge
-        }
-        rows.append(row)
-    
-    # Define fieldnames (columns)
-    fieldnames = [
-        "date", "time", "search_id", "sample_type", "pickup", "destination", 
-        "provider", "product", "service_level", 
-        "price_min", "price_max", "price_min_discounted", "price_max_discounted",
-        "wait_min_seconds", "wait_max_seconds", 
-        "trip_seconds", "distance_meters", "surge_multiplier"
-    ]
-    
-    # Download existing CSV
-    existing_csv_data = download_csv_from_gcs(client, csv_filename)
-    
-    # Append new data and upload
-    success = append_to_csv_and_upload(client, existing_csv_data, rows, fieldnames, csv_filename)
-    
-    if success:
-        return f"gs://{GCS_BUCKET_NAME}/{csv_filename}"
-    else:
-        return None
+def save_quote_state(backend, state):
+    """Write the change detector state to storage"""
+    try:
+        backend.put(QUOTE_STATE_FILE, state.to_json(), content_type="application/json")
+    except Exception as e:
+        logger.error(f"Error saving quote state: {e}")
 
-def process_pair(api_key, api_secret, gcs_client, sample_type, pair, places):
-    """Process a single origin-destination pair"""
-    origin_id = pair["origin_id"]
-    dest_id = pair["destination_id"]
+def process_route(api_key, api_secret, backend, route, limiter=None, breaker=None, archive=None):
+    """
+    Process a single origin-destination route
     
-    # Get origin and destination place details
-    origin = get_place_by_id(places, origin_id)
-    destination = get_place_by_id(places, dest_id)
+    The raw response is archived to storage right away, in the content-addressed
+    archive if one is given; the parsed CSV rows are returned so they can be
+    appended in bulk.
     
-    if not origin or not destination:
-        logger.error(f"Invalid place IDs: origin_id={origin_id}, dest_id={dest_id}")
-        return
+    Returns:
+        list: CSV rows, or None if the call failed
+    
+    Raises:
+        CircuitOpenError: If the breaker refused the call
+    """
+    origin = route["origin"]
+    destination = route["destination"]
+    sample_type = route["sample_type"]
     
     # Log collection attempt
-    logger.info(f"Collecting {sample_type} - Pair {pair['id']}: {origin['name']} to {destination['name']}")
+    logger.info(f"Collecting {sample_type} - Pair {route['pair_id']}: {origin['name']} to {destination['name']}")
     
     # Get price data with retry logic
     response = get_prices(
@@ -373,20 +272,79 @@ def process_pair(api_key, api_secret, gcs_client, sample_type, pair, places):
         origin["lat"],
         origin["lng"],
         destination["lat"],
-        destination["lng"]
+        destination["lng"],
+        raw=True,
+        limiter=limiter,
+        breaker=breaker
     )
     
     if not response:
-        logger.error(f"Failed to collect data for {sample_type} - Pair {pair['id']}")
-        return
+        logger.error(f"Failed to collect data for {sample_type} - Pair {route['pair_id']}")
+        return None
     
-    # Save results to both JSON and CSV in GCS
-    save_results_to_gcs_json(gcs_client, response, sample_type, pair['id'])
-    save_results_to_csv(gcs_client, response, sample_type, origin['name'], destination['name'])
+    # Archive the raw response and parse it for the CSV
+    if archive is not None:
+        try:
+            archive.put(response, sample_type, route['pair_id'], route['route_id'])
+        except Exception as e:
+            logger.error(f"Error archiving response: {e}")
+    else:
+        save_results_to_json(backend, response, sample_type, route['pair_id'])
+    with STAGE_LATENCY.time(stage="parse"):
+        rows = build_csv_rows(response, sample_type, origin['name'], destination['name'])
+    if not rows:
+        logger.warning("No ride options to save")
+    
+    # Keep a minimum spacing between this worker's API calls
+    logger.info(f"Waiting {PAIR_DELAY_SECONDS:g} seconds before next API call to avoid rate limiting...")
+    time.sleep(PAIR_DELAY_SECONDS)
+    return rows
+
+def collect_routes(api_key, api_secret, backend, routes, limiter, breaker, workers=None, detector=None,
+                   archive=None, history=None):
+    """
+    Collect routes concurrently under the adaptive limiter
+    
+    Up to `workers` (default MAX_CONCURRENCY) threads run, but only as many API
+    calls as the limiter currently allows are in flight. Routes refused by an
+    open breaker are returned for a later retry instead of waiting out backoffs.
+    Every collected row is appended to the columnar history, if given; with a
+    change detector, only the rows it passes on are returned.
     
-    # Add a longer delay between API calls to avoid rate limiting
-    logger.info(f"Waiting 15 seconds before next API call to avoid rate limiting...")
-    time.sleep(15)
+    Returns:
+        tuple: (CSV rows, deferred routes)
+    """
+    rows = []
+    deferred = []
+    with ThreadPoolExecutor(max_workers=max(1, workers or MAX_CONCURRENCY)) as executor:
+        futures = {
+            executor.submit(process_route, api_key, api_secret, backend, route, limiter, breaker, archive): route
+            for route in routes
+        }
+        for i, future in enumerate(as_completed(futures)):
+            route = futures[future]
+            label = f"{route['sample_type']} pair {route['pair_id']}"
+            try:
+                route_rows = future.result()
+            except CircuitOpenError as e:
+                logger.warning(f"Deferring {label}: {e}")
+                deferred.append(route)
+                continue
+            except Exception as e:
+                logger.error(f"Error processing {label}: {e}")
+                # Continue with next pair instead of exiting
+                continue
+            if history is not None and route_rows:
+                try:
+                    history.append(route_rows)
+                except OSError as e:
+                    logger.error(f"Error appending {label} to the columnar history: {e}")
+            if detector is not None and route_rows is not None:
+                route_rows = detector.filter(route, route_rows)
+            if route_rows:
+                rows.extend(route_rows)
+            logger.info(f"Successfully processed {label} ({i+1}/{len(routes)}, concurrency limit {limiter.limit})")
+    return rows, deferred
 
 def collect_all_samples():
     """Collect data for all sample pairs"""
@@ -401,68 +359,83 @@ def collect_all_samples():
         logger.error("Error: API credentials not found in environment variables")
         return
     
-    # Initialize GCS client
+    # Initialize storage
     try:
-        gcs_client = initialize_gcs_client()
+        backend = initialize_storage()
     except Exception as e:
-        logger.error(f"Failed to initialize GCS: {e}")
+        logger.error(f"Failed to initialize storage: {e}")
         return
     
-    # Process pairs with error handling and splits
+    limiter = AdaptiveConcurrencyLimiter(initial=1, maximum=max(1, MAX_CONCURRENCY))
+    breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+    
+    if CHANGE_DETECTION:
+        detector = ChangeDetector(load_quote_state(backend), HEARTBEAT_HOURS * 3600)
+        csv_filename, fieldnames = CHANGES_CSV, CHANGE_FIELDNAMES
+    else:
+        detector = None
+        csv_filename, fieldnames = "ride_prices.csv", CSV_FIELDNAMES
+    
+    archive = ContentAddressedArchive(backend) if ARCHIVE_MODE == "dedup" else None
+    history = ColumnarAppender(HISTORY_DIR) if HISTORY_DIR else None
+    
+    # Process each sample in registry order, appending its rows to the CSV in one write
     try:
-        # Process Sample 1 - Prestigious routes
-        logger.info("Starting Sample 1 collection...")
+        routes = load_routes()
+        sample_types = list(dict.fromkeys(route["sample_type"] for route in routes))
+        deferred = []
+        rows_saved = True
         
-        for i, pair in enumerate(SAMPLE1_PAIRS):
-            try:
-                process_pair(api_key, api_secret, gcs_client, "Sample1", pair, SAMPLE1_PLACES)
-                logger.info(f"Successfully processed Sample1 pair {pair['id']} ({i+1}/{len(SAMPLE1_PAIRS)})")
-            except Exception as e:
-                logger.error(f"Error processing Sample1 pair {pair['id']}: {e}")
-                # Continue with next pair instead of exiting
-                continue
+        for i, sample_type in enumerate(sample_types):
+            if i > 0:
+                # Add a longer delay between samples to recover from potential rate limiting
+                logger.info(f"Completed {sample_types[i-1]}. Waiting {SAMPLE_DELAY_SECONDS:g} seconds before starting {sample_type}...")
+                time.sleep(SAMPLE_DELAY_SECONDS)
+            
+            logger.info(f"Starting {sample_type} collection...")
+            sample_routes = [route for route in routes if route["sample_type"] == sample_type]
+            rows, sample_deferred = collect_routes(api_key, api_secret, backend, sample_routes, limiter, breaker,
+                                                   detector=detector, archive=archive, history=history)
+            deferred.extend(sample_deferred)
+            rows_saved &= save_rows_to_csv(backend, rows, csv_filename, fieldnames)
+            flush_archive(archive)
         
-        # Add a longer delay between Sample 1 and Sample 2 to recover from potential rate limiting
-        logger.info("Completed Sample 1. Waiting 60 seconds before starting Sample 2...")
-        time.sleep(60)
+        # Give deferred pairs one more pass once the breaker allows a trial call;
+        # run it sequentially so the half-open trial decides for the rest
+        if deferred:
+            wait_seconds = breaker.seconds_until_retry()
+            logger.info(f"Retrying {len(deferred)} deferred pairs in {wait_seconds:.0f} seconds...")
+            time.sleep(wait_seconds)
+            rows, deferred = collect_routes(api_key, api_secret, backend, deferred, limiter, breaker, workers=1,
+                                            detector=detector, archive=archive, history=history)
+            rows_saved &= save_rows_to_csv(backend, rows, csv_filename, fieldnames)
+            flush_archive(archive)
+            for route in deferred:
+                logger.error(f"Skipped {route['sample_type']} pair {route['pair_id']}: circuit breaker still open")
         
-        # Process Sample 2 - Random routes with similar distances
-        logger.info("Starting Sample 2 collection...")
+        if archive is not None:
+            logger.info(f"Archived responses: {archive.bytes_uploaded} bytes uploaded, "
+                        f"{archive.bytes_deduplicated} bytes deduplicated")
         
-        for i, pair in enumerate(SAMPLE2_PAIRS):
-            try:
-                process_pair(api_key, api_secret, gcs_client, "Sample2", pair, SAMPLE2_PLACES)
-                logger.info(f"Successfully processed Sample2 pair {pair['id']} ({i+1}/{len(SAMPLE2_PAIRS)})")
-            except Exception as e:
-                logger.error(f"Error processing Sample2 pair {pair['id']}: {e}")
-                # Continue with next pair instead of exiting
-                continue
-
-        # Add this after processing Sample 2
-        logger.info("Completed Sample 2. Waiting 60 seconds before starting Sample 3...")
-        time.sleep(60)
-
-        # Process Sample 3 - NYC Residential to Airport Routes
-        logger.info("Starting Sample 3 collection...")
-
-        for i, pair in enumerate(SAMPLE3_PAIRS):
-            try:
-                process_pair(api_key, api_secret, gcs_client, "Sample3", pair, SAMPLE3_PLACES)
-                logger.info(f"Successfully processed Sample3 pair {pair['id']} ({i+1}/{len(SAMPLE3_PAIRS)})")
-            except Exception as e:
-                logger.error(f"Error processing Sample3 pair {pair['id']}: {e}")
-                # Continue with next pair instead of exiting
-                continue
+        # Save the state only after the rows it describes are stored; after a failed
+        # append the stored state stays put, so the next cycle writes those changes again
+        if detector is not None and not rows_saved:
+            logger.error("Not saving the quote state because a CSV append failed")
+        elif detector is not None:
+            save_quote_state(backend, detector.state)
+            logger.info(f"Change detection wrote {detector.rows_written} rows for {detector.rows_seen} quotes")
                 
     except Exception as e:
         logger.error(f"Unexpected error in collection process: {e}")
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
+    CYCLE_LATENCY.observe(duration)
+    export_metrics()
     logger.info(f"Completed data collection cycle in {duration:.2f} seconds")
 
 if __name__ == "__main__":
     try:
         collect_all_samples()
     except Exception as e:
-        logger.exception(f"Unexpected error: {e}")
\ No newline at end of file
+        logger.exception(f"Unexpected error: {e}")
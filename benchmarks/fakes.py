@@ -0,0 +1,153 @@
+"""
+In-memory stand-ins for the Google Cloud clients
+
+Implement the subset of google.cloud.storage and google.cloud.bigquery used by
+the collectors, and count the bytes that would have been transferred.
+"""
+import json
+import threading
+
+from google.api_core.exceptions import NotFound
+
+class FakeBlob:
+    """In-memory blob"""
+
+    def __init__(self, client, bucket, name):
+        self.client = client
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    @property
+    def _key(self):
+        return (self.bucket.name, self.name)
+
+    def exists(self):
+        return self._key in self.client.objects
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.client.lock:
+            self.client.objects[self._key] = data
+            self.client.bytes_uploaded += len(data)
+            self.client.uploads += 1
+
+    def download_as_bytes(self, start=0, end=None):
+        with self.client.lock:
+            if self._key not in self.client.objects:
+                raise NotFound(f"{self.bucket.name}/{self.name}")
+            data = self.client.objects[self._key][start:None if end is None else end + 1]
+            self.client.bytes_downloaded += len(data)
+            self.client.downloads += 1
+        return data
+
+    def download_as_text(self):
+        return self.download_as_bytes().decode("utf-8")
+
+    def compose(self, sources):
+        with self.client.lock:
+            data = b"".join(self.client.objects[source._key] for source in sources)
+            self.client.objects[self._key] = data
+
+    def delete(self):
+        with self.client.lock:
+            del self.client.objects[self._key]
+
+    @property
+    def size(self):
+        data = self.client.objects.get(self._key)
+        return None if data is None else len(data)
+
+class FakeBucket:
+    """In-memory bucket"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.client, self, name)
+
+    def get_blob(self, name):
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+class FakeStorageClient:
+    """Stand-in for google.cloud.storage.Client"""
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.uploads = 0
+        self.downloads = 0
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_or_name, prefix=""):
+        bucket_name = getattr(bucket_or_name, "name", bucket_or_name)
+        bucket = self.bucket(bucket_name)
+        with self.lock:
+            names = sorted(name for bucket_key, name in self.objects if bucket_key == bucket_name)
+        return [bucket.blob(name) for name in names if name.startswith(prefix)]
+
+    def stored_bytes(self):
+        """Total size of all stored objects"""
+        with self.lock:
+            return sum(len(data) for data in self.objects.values())
+
+class FakeQueryJob:
+    """Stand-in for google.cloud.bigquery.QueryJob; queries return no rows"""
+
+    num_dml_affected_rows = 0
+    total_bytes_processed = 0
+
+    def result(self):
+        return []
+
+class FakeBigQueryClient:
+    """Stand-in for google.cloud.bigquery.Client"""
+
+    def __init__(self, project="benchmark"):
+        self.project = project
+        self.datasets = set()
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.bytes_inserted = 0
+        self.insert_requests = 0
+        self.queries = []
+
+    def get_dataset(self, dataset_id):
+        if dataset_id not in self.datasets:
+            raise LookupError(f"Dataset {dataset_id} not found")
+        return dataset_id
+
+    def create_dataset(self, dataset, exists_ok=False):
+        self.datasets.add(getattr(dataset, "dataset_id", dataset))
+        return dataset
+
+    def get_table(self, table_ref):
+        if table_ref not in self.tables:
+            raise LookupError(f"Table {table_ref} not found")
+        return table_ref
+
+    def create_table(self, table, exists_ok=False):
+        table_ref = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        self.tables.setdefault(table_ref, [])
+        return table
+
+    def query(self, sql, job_config=None):
+        with self.lock:
+            self.queries.append(sql)
+        return FakeQueryJob()
+
+    def insert_rows_json(self, table_ref, rows):
+        payload = json.dumps(rows)
+        with self.lock:
+            self.tables.setdefault(str(table_ref), []).extend(rows)
+            self.bytes_inserted += len(payload)
+            self.insert_requests += 1
+        return []
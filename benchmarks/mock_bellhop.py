@@ -0,0 +1,133 @@
+"""
+Local stand-in for the Bellhop pricing API
+
+Replays recorded responses (data/data_*.json) over HTTP with configurable
+latency, server errors and rate limiting, so collectors can be benchmarked
+without touching the real API.
+"""
+import glob
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def load_fixtures(pattern="data/data_*.json"):
+    """
+    Load recorded API responses
+
+    Args:
+        pattern (str): Glob of fixture files
+
+    Returns:
+        list: Decoded responses
+    """
+    fixtures = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            fixtures.append(json.load(f))
+    if not fixtures:
+        raise FileNotFoundError(f"No fixtures match {pattern}")
+    return fixtures
+
+class MockBellhopServer:
+    """Threaded HTTP server answering pricing requests from fixtures"""
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 slow_rate=0.0, slow_latency=0.0, host="127.0.0.1", port=0, seed=None):
+        """
+        Initialize the server
+
+        Args:
+            fixtures (list): Responses to replay round-robin
+            latency (float): Base response delay in seconds
+            jitter (float): Extra uniformly distributed delay, up to this many seconds
+            error_rate (float): Fraction of requests answered with HTTP 500
+            throttle_rate (float): Fraction of requests answered with HTTP 429
+            slow_rate (float): Fraction of requests delayed by an extra `slow_latency`
+            slow_latency (float): Extra delay in seconds for slow requests
+            host (str): Bind address
+            port (int): Bind port (0 picks a free port)
+            seed (int): Random seed for reproducible error patterns
+        """
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.status_counts = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """Pricing endpoint URL of the running server"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/rich-intelligent-pricing"
+
+    def _next_response(self):
+        """Pick the status and body for the next request"""
+        with self.lock:
+            index = self.requests
+            self.requests += 1
+            roll = self.random.random()
+            delay = self.latency + self.random.random() * self.jitter
+            if self.random.random() < self.slow_rate:
+                delay += self.slow_latency
+
+        if roll < self.throttle_rate:
+            status, body = 429, {"message": "Too Many Requests"}
+        elif roll < self.throttle_rate + self.error_rate:
+            status, body = 500, {"message": "Internal Server Error"}
+        else:
+            body = dict(self.fixtures[index % len(self.fixtures)])
+            body["search_id"] = str(uuid.uuid4())
+            status = 200
+
+        with self.lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return delay, status, json.dumps(body).encode("utf-8")
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay, status, body = server._next_response()
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
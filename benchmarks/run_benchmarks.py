@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmarks for the Bellhop collectors.
+Runs BellhopAPI, response parsing, collect_all_samples, collect_bellhop_data and
+the storage backends against a local mock Bellhop server, in-memory GCS/BigQuery
+fakes and a temporary directory, writes
+the results as JSON, and optionally compares them with a previous run.
+
+Usage: python -m benchmarks.run_benchmarks --output benchmarks/results/latest.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import datetime
+
+from benchmarks.fakes import FakeBigQueryClient, FakeStorageClient
+from benchmarks.mock_bellhop import MockBellhopServer, load_fixtures
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark the Bellhop collectors against a local API stand-in')
+    parser.add_argument('--fixtures', default='data/data_*.json', help='Glob of recorded responses to replay')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mock API base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Mock API extra random latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of HTTP 500 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of HTTP 429 responses')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction of responses delayed by --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=0.5, help='Extra delay in seconds for slow responses')
+    parser.add_argument('--hedge-percentile', type=float, default=0.95,
+                        help='Latency percentile after which the hedged API client variant sends a second request')
+    parser.add_argument('--requests', type=int, default=200, help='Calls made in the API client benchmark')
+    parser.add_argument('--parse-iterations', type=int, default=2000, help='Responses parsed in the parse benchmark')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the mock server')
+    parser.add_argument('--output', default='benchmarks/results/latest.json', help='Where to write results')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before failing')
+    return parser.parse_args()
+
+@contextmanager
+def patched(target, **attributes):
+    """Temporarily replace attributes on a module or object"""
+    originals = {name: getattr(target, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(target, name, value)
+    try:
+        yield target
+    finally:
+        for name, value in originals.items():
+            setattr(target, name, value)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def bench_api_client(server, requests_count, hedge_percentile=None):
+    """Sequential BellhopAPI.get_prices_raw calls against the mock server"""
+    from src.api import BellhopAPI
+
+    client = BellhopAPI("bench", "bench", endpoint=server.url, hedge_percentile=hedge_percentile)
+    requests_before = server.requests
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        call_start = time.perf_counter()
+        if client.get_prices_raw(40.7590, -73.9851, 40.6413, -73.7781) is None:
+            failures += 1
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    return {
+        "requests": requests_count,
+        "failures": failures,
+        "hedges": client.hedges,
+        "server_requests": server.requests - requests_before,
+        "seconds": elapsed,
+        "requests_per_second": requests_count / elapsed,
+        "latency_p50_seconds": percentile(latencies, 0.50),
+        "latency_p99_seconds": percentile(latencies, 0.99),
+    }
+
+def bench_parse(fixtures, iterations):
+    """
+    Build CSV and BigQuery rows from responses
+
+    "raw" streams the bytes, "decode" decodes them in full first, and
+    "decoded" starts from already decoded responses.
+    """
+    from src.parsing import loads
+    from src.quotes import build_bigquery_rows, build_csv_rows
+
+    raw_fixtures = [json.dumps(fixture).encode("utf-8") for fixture in fixtures]
+    variants = (
+        ("raw", raw_fixtures, lambda data: data),
+        ("decode", raw_fixtures, loads),
+        ("decoded", fixtures, lambda data: data),
+    )
+    results = {}
+    for label, inputs, prepare in variants:
+        rows = 0
+        start = time.perf_counter()
+        for i in range(iterations):
+            rows += len(build_csv_rows(prepare(inputs[i % len(inputs)]), "Bench", "Pickup", "Destination"))
+        elapsed = time.perf_counter() - start
+        results[f"csv_{label}_rows_per_second"] = rows / elapsed
+
+    options = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        options += len(build_bigquery_rows(raw_fixtures[i % len(raw_fixtures)], 0, 0, 0, 0)[0])
+    results["bigquery_raw_rows_per_second"] = options / (time.perf_counter() - start)
+    return results
+
+def bench_collect_all_samples(server, backend_kind="gcs"):
+    """End-to-end hourly collection cycle against in-memory GCS, or a temporary directory for the local backend"""
+    import bellhop_gcs_script as script
+    from src.backends import GcsBackend, LocalBackend
+
+    fake_gcs = FakeStorageClient()
+    with tempfile.TemporaryDirectory() as root:
+        backend = GcsBackend("bench", fake_gcs) if backend_kind == "gcs" else LocalBackend(root)
+        with patched(script, BELLHOP_API_URL=server.url, PAIR_DELAY_SECONDS=0,
+                     SAMPLE_DELAY_SECONDS=0, RETRY_BASE_DELAY_SECONDS=0.01,
+                     initialize_storage=lambda: backend):
+            requests_before = server.requests
+            start = time.perf_counter()
+            script.collect_all_samples()
+            elapsed = time.perf_counter() - start
+            requests_made = server.requests - requests_before
+
+        rows = backend.get("ride_prices.csv").decode("utf-8").count("\n") - 1 if backend.exists("ride_prices.csv") else 0
+    results = {
+        "cycle_seconds": elapsed,
+        "api_requests": requests_made,
+        "requests_per_second": requests_made / elapsed,
+        "csv_rows": rows,
+    }
+    if backend_kind == "gcs":
+        results.update({
+            "storage_bytes_uploaded": fake_gcs.bytes_uploaded,
+            "storage_bytes_downloaded": fake_gcs.bytes_downloaded,
+            "storage_bytes_stored": fake_gcs.stored_bytes(),
+        })
+    return results
+
+def bench_collect_bellhop_data(server):
+    """End-to-end Cloud Function invocation with in-memory GCS"""
+    import src.main as function
+
+    from src.backends import GcsBackend
+
+    fake_gcs = FakeStorageClient()
+    backend = GcsBackend("bench", fake_gcs)
+    with patched(function, BELLHOP_API_URL=server.url, PAIR_DELAY_SECONDS=0,
+                 get_storage_backend=lambda: backend):
+        requests_before = server.requests
+        start = time.perf_counter()
+        message, status = function.collect_bellhop_data(SimpleNamespace(args={}))
+        elapsed = time.perf_counter() - start
+        requests_made = server.requests - requests_before
+
+    return {
+        "status": status,
+        "cycle_seconds": elapsed,
+        "api_requests": requests_made,
+        "requests_per_second": requests_made / elapsed,
+        "storage_bytes_uploaded": fake_gcs.bytes_uploaded,
+        "storage_bytes_downloaded": fake_gcs.bytes_downloaded,
+        "storage_bytes_stored": fake_gcs.stored_bytes(),
+    }
+
+def bench_bigquery_storage(fixtures, iterations):
+    """BigQueryStorage.save throughput against an in-memory BigQuery"""
+    from src import storage
+
+    fake_bigquery = FakeBigQueryClient()
+    raw_fixtures = [json.dumps(fixture).encode("utf-8") for fixture in fixtures]
+    with patched(storage.bigquery, Client=lambda: fake_bigquery):
+        bigquery_storage = storage.BigQueryStorage()
+        start = time.perf_counter()
+        for i in range(iterations):
+            bigquery_storage.save(raw_fixtures[i % len(raw_fixtures)], 40.7590, -73.9851, 40.6413, -73.7781)
+        bigquery_storage.flush_aggregates()
+        elapsed = time.perf_counter() - start
+
+    return {
+        "saves_per_second": iterations / elapsed,
+        "storage_bytes_inserted": fake_bigquery.bytes_inserted,
+        "merge_jobs": len(fake_bigquery.queries),
+    }
+
+def bench_storage_backends(fixtures, iterations):
+    """
+    Storage operations of the collectors on each backend
+
+    Puts one JSON object per response, appends CSV rows in batches of ten
+    responses, then lists and reads back the JSON objects.
+    """
+    from src.backends import GcsBackend, LocalBackend, MemoryBackend
+    from src.quotes import CSV_FIELDNAMES, build_csv_rows
+    from src.sinks import csv_text
+
+    raw_fixtures = [json.dumps(fixture).encode("utf-8") for fixture in fixtures]
+    batches = [
+        csv_text([row for raw in raw_fixtures[:10] for row in build_csv_rows(raw, "Bench", "Pickup", "Destination")],
+                 CSV_FIELDNAMES)
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        backends = {
+            "memory": MemoryBackend(),
+            "local": LocalBackend(root),
+            "fake_gcs": GcsBackend("bench", FakeStorageClient()),
+        }
+        for label, backend in backends.items():
+            start = time.perf_counter()
+            for i in range(iterations):
+                backend.put(f"json/data_{i:08d}.json", raw_fixtures[i % len(raw_fixtures)], "application/json")
+            results[f"{label}_puts_per_second"] = iterations / (time.perf_counter() - start)
+
+            appends = max(1, iterations // 10)
+            start = time.perf_counter()
+            for _ in range(appends):
+                backend.append("ride_prices.csv", batches[0], "text/csv")
+            results[f"{label}_appends_per_second"] = appends / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            read = sum(len(backend.get(name)) for name in backend.list("json/"))
+            results[f"{label}_read_bytes_per_second"] = read / (time.perf_counter() - start)
+    return results
+
+def git_revision():
+    """Current git commit, if available"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(current, baseline, tolerance):
+    """
+    Compare two result sets metric by metric
+
+    Metrics named *_per_second are better when higher; *_seconds and *_bytes*
+    metrics are better when lower. Other metrics are informational.
+
+    Returns:
+        list: Descriptions of metrics that regressed beyond the tolerance
+    """
+    regressions = []
+    for scenario, metrics in current["results"].items():
+        previous = baseline.get("results", {}).get(scenario, {})
+        for name, value in metrics.items():
+            old = previous.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            if name.endswith("_per_second"):
+                regressed = change < -tolerance
+            elif name.endswith("_seconds") or "_bytes" in name:
+                regressed = change > tolerance
+            else:
+                continue
+            print(f"{scenario}.{name}: {old:.6g} -> {value:.6g} ({change:+.1%})")
+            if regressed:
+                regressions.append(f"{scenario}.{name} {change:+.1%}")
+    return regressions
+
+def main():
+    """Run all benchmarks"""
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("BELLHOP_API_KEY", "bench")
+    os.environ.setdefault("BELLHOP_API_SECRET", "bench")
+
+    fixtures = load_fixtures(args.fixtures)
+    config = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "slow_rate": args.slow_rate,
+        "slow_latency": args.slow_latency,
+        "hedge_percentile": args.hedge_percentile,
+        "requests": args.requests,
+        "parse_iterations": args.parse_iterations,
+        "fixtures": len(fixtures),
+    }
+
+    results = {}
+    with MockBellhopServer(fixtures, args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                           args.slow_rate, args.slow_latency, seed=args.seed) as server:
+        results["api_client"] = bench_api_client(server, args.requests)
+        results["api_client_hedged"] = bench_api_client(server, args.requests, args.hedge_percentile)
+        results["collect_all_samples"] = bench_collect_all_samples(server)
+        results["collect_all_samples_local"] = bench_collect_all_samples(server, "local")
+        results["collect_bellhop_data"] = bench_collect_bellhop_data(server)
+    results["parse"] = bench_parse(fixtures, args.parse_iterations)
+    results["bigquery_storage"] = bench_bigquery_storage(fixtures, args.parse_iterations)
+    results["storage_backends"] = bench_storage_backends(fixtures, args.parse_iterations)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": git_revision(),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.tolerance)
+        if regressions:
+            print("Performance regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,29 @@
 def save_results_to_json(data, route_name):
-    """Save API response to a JSON file"""
+    """Save API response to a JSON object in the storage backend"""
+    from src.backends import create_backend
+    
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"data_{route_name.replace(' ', '_')}_{timestamp}.json"
     
-    os.makedirs("data", exist_ok=True)
-    filepath = os.path.join("data", filename)
-    
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2)
+    backend = create_backend(default="local")
+    backend.put(filename, json.dumps(data, indent=2), content_type="application/json")
     
-    print(f"Data saved to {filepath}")
-    return filepath#!/usr/bin/env python3
+    print(f"Data saved to {backend.uri(filename)}")
+    return backend.uri(filename)#!/usr/bin/env python3
 """
 Simplified manual collection script to avoid import issues.
 This script directly uses the API client without complex imports.
+
+Run without arguments for the interactive tool, or collect many routes at once:
+    python manual_collect.py --routes-file routes.txt --workers 8
+    python manual_collect.py --all-pairs --places 1,7,12 --output both
 """
 import os
+import sys
 import json
-import csv
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 import requests
@@ -52,6 +57,15 @@ POPULAR_PLACES = [
     {"id": 18, "name": "Skadden Arps", "lat": 40.7515, "lng": -73.9974}
 ]
 
+# Columns of data/ride_prices.csv written by this tool
+CSV_FIELDNAMES = [
+    "date", "time", "search_id", "pickup", "destination", 
+    "provider", "product", "service_level", 
+    "price_min_dollars", "price_max_dollars", 
+    "wait_min_seconds", "wait_max_seconds", 
+    "trip_seconds", "distance_meters", "surge_multiplier"
+]
+
 def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng):
     """
     Direct API call to Bellhop without using the API client class
@@ -84,17 +98,10 @@ def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng):
         print(f"Error fetching ride prices: {e}")
         return None
 
-def save_results_to_csv(data, pickup_name, dest_name):
-    """Save API response to CSV file, appending to existing file if it exists"""
-    # Create data directory if it doesn't exist
-    os.makedirs("data", exist_ok=True)
-    
-    # CSV filename - single file for all results
-    filepath = os.path.join("data", "ride_prices.csv")
-    file_exists = os.path.isfile(filepath)
-    
+def build_csv_rows(data, pickup_name, dest_name, timestamp=None):
+    """Build data/ride_prices.csv rows from an API response (empty if it has no options)"""
     # Get the current time
-    timestamp = datetime.now()
+    timestamp = timestamp or datetime.now()
     date_str = timestamp.strftime("%Y-%m-%d")
     time_str = timestamp.strftime("%H:%M:%S")
     
@@ -104,8 +111,7 @@ def save_results_to_csv(data, pickup_name, dest_name):
     # Parse the results
     results = data.get("results", [])
     if not results or not results[0].get("prices"):
-        print("No ride options to save")
-        return None
+        return []
     
     # Prepare rows for CSV
     rows = []
@@ -146,30 +152,26 @@ def save_results_to_csv(data, pickup_name, dest_name):
             "surge_multiplier": surge
         }
         rows.append(row)
+    return rows
+
+def save_results_to_csv(data, pickup_name, dest_name):
+    """Save API response to the CSV object, appending to it if it exists"""
+    from src.backends import create_backend
+    from src.sinks import StorageCsvSink
     
-    # Define fieldnames (columns)
-    fieldnames = [
-        "date", "time", "search_id", "pickup", "destination", 
-        "provider", "product", "service_level", 
-        "price_min_dollars", "price_max_dollars", 
-        "wait_min_seconds", "wait_max_seconds", 
-        "trip_seconds", "distance_meters", "surge_multiplier"
-    ]
+    rows = build_csv_rows(data, pickup_name, dest_name)
+    if not rows:
+        print("No ride options to save")
+        return None
     
-    # Write to CSV file
+    # Write to the single CSV for all results
     try:
-        with open(filepath, mode='a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            
-            # Write header only if file doesn't exist
-            if not file_exists:
-                writer.writeheader()
-            
-            # Write all rows
-            writer.writerows(rows)
+        sink = StorageCsvSink(create_backend(default="local"), "ride_prices.csv", CSV_FIELDNAMES)
+        sink.write(rows)
+        sink.close()
         
-        print(f"Data appended to {filepath}")
-        return filepath
+        print(f"Data appended to {sink.backend.uri(sink.name)}")
+        return sink.backend.uri(sink.name)
     except Exception as e:
         print(f"Error saving to CSV: {e}")
         return None
@@ -246,6 +248,140 @@ def get_place_by_id(place_id):
             return place
     return None
 
+def parse_routes_file(path):
+    """
+    Read routes for batch mode
+    
+    Each non-empty line not starting with '#' is either two popular place IDs
+    ("pickup_id,destination_id") or four coordinates
+    ("pickup_lat,pickup_lng,dest_lat,dest_lng").
+    
+    Returns:
+        list: (pickup, destination) tuples of place dicts
+    
+    Raises:
+        ValueError: On a malformed line or unknown place ID
+    """
+    routes = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            values = [value.strip() for value in line.split(",")]
+            try:
+                if len(values) == 2:
+                    pickup, destination = (get_place_by_id(int(value)) for value in values)
+                    if not pickup or not destination:
+                        raise ValueError("unknown place ID")
+                elif len(values) == 4:
+                    pickup_lat, pickup_lng, dest_lat, dest_lng = map(float, values)
+                    pickup = {"lat": pickup_lat, "lng": pickup_lng, "name": f"Custom ({pickup_lat}, {pickup_lng})"}
+                    destination = {"lat": dest_lat, "lng": dest_lng, "name": f"Custom ({dest_lat}, {dest_lng})"}
+                else:
+                    raise ValueError("expected 2 place IDs or 4 coordinates")
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: {e}: {line!r}")
+            routes.append((pickup, destination))
+    return routes
+
+def all_pairs(place_ids=None):
+    """
+    Every ordered pair of distinct popular places
+    
+    Args:
+        place_ids (list): Only these place IDs (default: all POPULAR_PLACES)
+    
+    Returns:
+        list: (pickup, destination) tuples of place dicts
+    """
+    places = POPULAR_PLACES if place_ids is None else [get_place_by_id(place_id) for place_id in place_ids]
+    if any(place is None for place in places):
+        raise ValueError("Unknown place ID")
+    return [(pickup, destination) for pickup in places for destination in places if pickup is not destination]
+
+def run_batch(api_key, api_secret, routes, workers=8, output="csv", progress_every=10):
+    """
+    Collect many routes concurrently and write the results in bulk
+    
+    All requests go through one shared client whose concurrency limit backs
+    off when the API throttles. Rows are buffered and written with one bulk
+    write per sink once every request has finished.
+    
+    Args:
+        api_key (str): Bellhop API key
+        api_secret (str): Bellhop API secret
+        routes (list): (pickup, destination) tuples of place dicts
+        workers (int): Most concurrent requests
+        output (str): "csv", "json", "both" or "none"
+        progress_every (int): Print progress after this many completed requests
+    
+    Returns:
+        tuple: (successful routes, failed routes)
+    """
+    from src.api import BellhopAPI
+    from src.resilience import AdaptiveConcurrencyLimiter
+    from src.backends import create_backend
+    from src.sinks import StorageCsvSink
+    
+    limiter = AdaptiveConcurrencyLimiter(initial=workers, maximum=workers)
+    client = BellhopAPI(api_key=api_key, api_secret=api_secret, limiter=limiter)
+    
+    def fetch(route):
+        pickup, destination = route
+        return client.get_prices(pickup["lat"], pickup["lng"], destination["lat"], destination["lng"])
+    
+    print(f"Collecting {len(routes)} routes with up to {workers} concurrent requests...")
+    started = time.perf_counter()
+    results = []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(fetch, route): route for route in routes}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"Error fetching ride prices: {e}")
+                response = None
+            if response:
+                results.append((futures[future], response))
+            else:
+                failed += 1
+            if done % progress_every == 0 or done == len(routes):
+                elapsed = time.perf_counter() - started
+                print(f"  {done}/{len(routes)} done, {failed} failed, {done / elapsed:.1f} requests/s")
+    
+    elapsed = time.perf_counter() - started
+    print(f"Collected {len(results)} routes in {elapsed:.2f} seconds ({len(routes) / elapsed:.1f} requests/s)")
+    
+    if output in ("csv", "both"):
+        backend = create_backend(default="local")
+        sink = StorageCsvSink(backend, "ride_prices.csv", CSV_FIELDNAMES, batch_size=float("inf"))
+        for (pickup, destination), response in results:
+            sink.write(build_csv_rows(response, pickup["name"], destination["name"]))
+        sink.close()
+        print(f"Appended {sink.rows_written} rows to {backend.uri(sink.name)}")
+    if output in ("json", "both") and results:
+        # One file per route, named like the interactive tool's, so backfill and sql.py read them
+        for (pickup, destination), response in results:
+            save_results_to_json(response, f"{pickup['name']}_to_{destination['name']}")
+    
+    client.close()
+    return len(results), failed
+
+def parse_args(argv=None):
+    """Parse command-line arguments; without a batch option the interactive tool runs"""
+    parser = argparse.ArgumentParser(description="Manual Bellhop ride price collection")
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument("--routes-file", help="Batch mode: routes as place ID pairs or coordinates, one per line")
+    batch.add_argument("--all-pairs", action="store_true", help="Batch mode: every pair of popular places")
+    parser.add_argument("--places", help="Comma-separated place IDs used by --all-pairs")
+    parser.add_argument("--workers", type=int, default=8, help="Most concurrent requests in batch mode")
+    parser.add_argument("--output", choices=["csv", "json", "both", "none"], default="csv",
+                        help="Where batch results are written")
+    parser.add_argument("--progress-every", type=int, default=10, help="Report progress every N requests")
+    return parser.parse_args(argv)
+
 def main():
     """Main function for manual data collection"""
     # Load environment variables
@@ -259,6 +395,20 @@ def main():
         print("Error: API credentials not found in .env file")
         return
     
+    args = parse_args()
+    if args.routes_file or args.all_pairs:
+        try:
+            if args.routes_file:
+                routes = parse_routes_file(args.routes_file)
+            else:
+                place_ids = [int(value) for value in args.places.split(",")] if args.places else None
+                routes = all_pairs(place_ids)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        _, failed = run_batch(api_key, api_secret, routes, args.workers, args.output, args.progress_every)
+        sys.exit(1 if failed else 0)
+    
     # Welcome message
     print("\n===== Bellhop Ride Price Manual Collection Tool =====")
     
@@ -1,17 +1,114 @@
 #!/usr/bin/env python3
 """
 Simple script to check ride prices between common locations
+
+Run without arguments for an interactive check, or compare many pairs at once:
+    python simple_price_check.py compare times_square:jfk_airport "40.7527,-73.9772:laguardia"
+    python simple_price_check.py compare --pairs-file pairs.txt --json
 """
 import os
+import sys
+import json
+import time
+import argparse
 from dotenv import load_dotenv
 from src.api import BellhopAPI
+from src.compare import DEFAULT_MAX_AGE, DEFAULT_WORKERS, QuoteCache, compare_pairs, parse_location
 from src.utils.coordinates import get_location, print_available_locations
 
+# Where the compare subcommand keeps quotes between runs
+CACHE_FILE = os.environ.get("QUOTE_CACHE_FILE", os.path.join("data", "quote_cache.json"))
+
+def parse_pair(text):
+    """Parse "PICKUP:DESTINATION", each a location name or 'lat,lng'"""
+    pickup, separator, destination = text.partition(":")
+    if not separator:
+        raise ValueError(f"Invalid pair {text!r}; use PICKUP:DESTINATION")
+    return parse_location(pickup), parse_location(destination)
+
+def print_comparison(comparison):
+    """Print the ranked options of one pair"""
+    age = comparison["age_seconds"]
+    source = f"cached {age:.0f}s ago" if comparison["source"] == "cache" else comparison["source"]
+    print(f"\n{comparison['pickup']['name']} to {comparison['destination']['name']} ({source})")
+    print("-" * 70)
+    if not comparison["options"]:
+        print("No ride options available")
+        return
+    print(f"{'#':<4} {'PROVIDER':<10} {'PRODUCT':<20} {'PRICE':<12} {'WAIT':<10} {'SURGE':<6}")
+    for option in comparison["options"]:
+        price = f"${option['price_min']:.2f}" if option["price_min"] is not None else "n/a"
+        wait = f"{option['wait_min_seconds']}s" if option["wait_min_seconds"] is not None else "n/a"
+        surge = option["surge_multiplier"] if option["surge_multiplier"] is not None else ""
+        print(f"{option['rank']:<4} {option['provider']:<10} {option['product']:<20} {price:<12} {wait:<10} {surge}")
+
+def compare(args):
+    """Compare ride options for the pairs given on the command line or in a file"""
+    api_key = os.environ.get("BELLHOP_API_KEY")
+    api_secret = os.environ.get("BELLHOP_API_SECRET")
+    if not api_key or not api_secret:
+        print("Error: API credentials not found in .env file")
+        return 1
+
+    texts = list(args.pairs)
+    if args.pairs_file:
+        with open(args.pairs_file) as f:
+            texts.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    try:
+        pairs = [parse_pair(text) for text in texts]
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if not pairs:
+        print("Error: no pairs given")
+        return 1
+
+    cache = QuoteCache()
+    if not args.no_cache:
+        cache.load(args.cache_file, args.max_age)
+    api_client = BellhopAPI(api_key=api_key, api_secret=api_secret)
+    started = time.perf_counter()
+    comparisons = compare_pairs(api_client, pairs, cache, args.max_age, args.workers)
+    elapsed = time.perf_counter() - started
+    if not args.no_cache:
+        directory = os.path.dirname(args.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        cache.save(args.cache_file)
+
+    if args.json:
+        print(json.dumps(comparisons, indent=2))
+    else:
+        for comparison in comparisons:
+            print_comparison(comparison)
+        cached = sum(comparison["source"] == "cache" for comparison in comparisons)
+        print(f"\nCompared {len(pairs)} pairs in {elapsed:.2f} seconds ({cached} from cache)")
+    return 0 if all(comparison["source"] != "error" for comparison in comparisons) else 1
+
+def parse_args(argv=None):
+    """Parse command-line arguments; no subcommand means an interactive check"""
+    parser = argparse.ArgumentParser(description="Check ride prices between locations")
+    subcommands = parser.add_subparsers(dest="command")
+    compare_parser = subcommands.add_parser("compare", help="Compare ride options for many pairs at once")
+    compare_parser.add_argument("pairs", nargs="*", help="PICKUP:DESTINATION, each a location name or 'lat,lng'")
+    compare_parser.add_argument("--pairs-file", help="File with one PICKUP:DESTINATION per line")
+    compare_parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE,
+                                help="Serve cached quotes up to this many seconds old")
+    compare_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent API calls")
+    compare_parser.add_argument("--cache-file", default=CACHE_FILE, help="Quote cache kept between runs")
+    compare_parser.add_argument("--no-cache", action="store_true", help="Always fetch live quotes")
+    compare_parser.add_argument("--json", action="store_true", help="Print comparisons as JSON")
+    return parser.parse_args(argv)
+
 def main():
     """Main function"""
     # Load environment variables
     load_dotenv()
     
+    args = parse_args()
+    if args.command == "compare":
+        sys.exit(compare(args))
+    
     # Get API credentials
     api_key = os.environ.get("BELLHOP_API_KEY")
     api_secret = os.environ.get("BELLHOP_API_SECRET")
@@ -141,6 +238,7 @@ def main():
                 dest_lat=dest["lat"],
                 dest_lng=dest["lng"]
             )
+            storage.flush_aggregates()
             print("Results saved to BigQuery successfully!")
         except Exception as e:
             print(f"Error saving to BigQuery: {e}")
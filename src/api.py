@@ -1,22 +1,60 @@
 """
 Bellhop API client module
 """
+import math
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from src.metrics import API_HEDGES, record_api_call
+from src.parsing import loads
+from src.resilience import CircuitBreaker, LatencyTracker, report_outcome
+
+# Pricing endpoint, overridable to point at a local stand-in
+DEFAULT_ENDPOINT = os.environ.get("BELLHOP_API_URL", "https://api.bellhop.me/api/rich-intelligent-pricing")
+
+# Hedge threads of a client without a limiter; with one, there is a thread per slot the limiter can grow to
+HEDGE_THREADS = 16
 
 class BellhopAPI:
     """Bellhop API client for fetching ride pricing"""
     
-    def __init__(self, api_key, api_secret):
+    def __init__(self, api_key, api_secret, endpoint=DEFAULT_ENDPOINT, limiter=None, breaker=None, timeout=30,
+                 hedge_percentile=None, hedge_budget=0.1, hedge_min_samples=20, latency_window=200):
         """
         Initialize the Bellhop API client
         
         Args:
             api_key (str): Bellhop API key
             api_secret (str): Bellhop API secret
+            endpoint (str): Pricing endpoint URL
+            limiter (AdaptiveConcurrencyLimiter): Optional limit on concurrent calls,
+                shrunk on 429/5xx/timeouts and grown on success
+            breaker (CircuitBreaker): Optional breaker; calls raise CircuitOpenError
+                while it is open
+            timeout (float): Request timeout in seconds
+            hedge_percentile (float): Enables hedging: a call still running after
+                this percentile of recent latency (e.g. 0.95) gets a second,
+                identical request, used if the first one fails
+            hedge_budget (float): Most hedges allowed, as a fraction of calls
+            hedge_min_samples (int): Latencies needed before hedging starts
+            latency_window (int): Recent latencies the percentile is taken over
         """
         self.api_key = api_key
         self.api_secret = api_secret
-        self.endpoint = "https://api.bellhop.me/api/rich-intelligent-pricing"
+        self.endpoint = endpoint
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyTracker(latency_window)
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = None
     
     def get_prices(self, pickup_lat, pickup_lng, dest_lat, dest_lng):
         """
@@ -31,6 +69,30 @@ class BellhopAPI:
         Returns:
             dict: API response containing ride pricing data
         """
+        raw = self.get_prices_raw(pickup_lat, pickup_lng, dest_lat, dest_lng)
+        if raw is None:
+            return None
+        return loads(raw)
+    
+    def get_prices_raw(self, pickup_lat, pickup_lng, dest_lat, dest_lng):
+        """
+        Fetch ride prices from Bellhop API without decoding the response
+        
+        The raw bytes can be archived as-is and parsed incrementally with
+        src.parsing.PriceStream.
+        
+        Args:
+            pickup_lat (float): Pickup latitude
+            pickup_lng (float): Pickup longitude
+            dest_lat (float): Destination latitude
+            dest_lng (float): Destination longitude
+        
+        Returns:
+            bytes: Raw JSON response body
+        
+        Raises:
+            CircuitOpenError: If the client's circuit breaker is open
+        """
         headers = {
             "accept": "application/json",
             "X-API-KEY": self.api_key,
@@ -49,10 +111,128 @@ class BellhopAPI:
             }
         }
         
+        if self.breaker is not None:
+            self.breaker.check()
+        if self.limiter is not None:
+            self.limiter.acquire()
+        with self._lock:
+            self.calls += 1
+        
+        if self.hedge_percentile is None:
+            return self._attempt(headers, payload)
+        return self._hedged(headers, payload)
+    
+    def _attempt(self, headers, payload):
+        """
+        Make one HTTP request, releasing the limiter slot acquired for it
+        
+        Returns:
+            bytes: Response body, or None on failure
+        """
+        status = "error"
+        started = time.perf_counter()
         try:
-            response = requests.post(self.endpoint, headers=headers, json=payload)
+            response = requests.post(self.endpoint, headers=headers, json=payload, timeout=self.timeout)
+            status = response.status_code
+            elapsed = time.perf_counter() - started
+            record_api_call(elapsed, status, len(response.content))
             response.raise_for_status()
-            return response.json()
+            self.latencies.record(elapsed)
+            return response.content
+        except requests.exceptions.HTTPError as e:
+            print(f"Error fetching ride prices: {e}")
+            return None
         except requests.exceptions.RequestException as e:
+            record_api_call(time.perf_counter() - started, status)
             print(f"Error fetching ride prices: {e}")
-            return None
\ No newline at end of file
+            return None
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+            report_outcome(status, self.limiter, self.breaker)
+    
+    def _hedged(self, headers, payload):
+        """
+        Make a request, with a second one sent from the pool if it runs long
+        
+        The request runs on the caller's thread, so it never waits for a
+        pool thread. A hedge still running when the request succeeds is left
+        to finish in the background; its outcome still feeds the limiter,
+        breaker and latency window.
+        
+        Returns:
+            bytes: Response body, the hedge's if the request failed, or None if both failed
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._attempt(headers, payload)
+        finished = threading.Event()
+        hedge = self._get_executor().submit(self._hedge_after, delay, finished, headers, payload)
+        try:
+            content = self._attempt(headers, payload)
+        finally:
+            finished.set()
+        if content is not None:
+            return content
+        content = hedge.result()
+        if content is not None:
+            API_HEDGES.inc(outcome="won")
+        return content
+    
+    def _hedge_after(self, delay, finished, headers, payload):
+        """
+        Send a hedge unless the caller's request finishes within delay seconds
+        
+        Returns:
+            bytes: Hedge response body, or None if no hedge was sent or it failed
+        """
+        if finished.wait(delay) or not self._reserve_hedge():
+            return None
+        API_HEDGES.inc(outcome="issued")
+        return self._attempt(headers, payload)
+    
+    def _hedge_delay(self):
+        """Seconds to wait before hedging, or None until enough latencies are known"""
+        if len(self.latencies) < self.hedge_min_samples:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+    
+    def _reserve_hedge(self):
+        """
+        Check the hedge budget and take a limiter slot for the hedge
+        
+        Hedges never wait for a slot and are not sent unless the breaker is
+        closed, so they only use capacity the limiter has spare.
+        
+        Returns:
+            bool: True if a hedge may be sent
+        """
+        if self.breaker is not None and self.breaker.state != CircuitBreaker.CLOSED:
+            return False
+        with self._lock:
+            if self.hedges + 1 > self.hedge_budget * self.calls:
+                return False
+            if self.limiter is not None and not self.limiter.acquire(timeout=0):
+                return False
+            self.hedges += 1
+            return True
+    
+    def _get_executor(self):
+        """
+        Thread pool running hedges, created on first use
+        
+        Every request in flight holds a limiter slot, so a thread per slot
+        the limiter can grow to means a hedge never queues.
+        """
+        with self._lock:
+            if self._executor is None:
+                threads = math.ceil(self.limiter.maximum) if self.limiter is not None else HEDGE_THREADS
+                self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="bellhop-hedge")
+            return self._executor
+    
+    def close(self):
+        """Stop the hedging thread pool without waiting for stragglers"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,163 @@
+"""
+Content-addressed archive of raw Bellhop responses
+
+Responses are normalized (search_id and the response timestamp removed,
+keys sorted) and hashed. Each distinct body is stored once under its hash,
+and every request gets a small pointer record instead of a full copy.
+
+Layout in the storage backend (see src/backends.py):
+    json/objects/ab/ab12...ef.json            normalized response bodies
+    json/pointers/pointers_<ts>_<id>.jsonl    pointers written by one flush
+"""
+import json
+import hashlib
+import threading
+import uuid
+from datetime import datetime
+from src.metrics import STAGE_BYTES, STAGE_LATENCY
+from src.parsing import dumps, loads
+
+# Top-level fields that differ on every call and are kept in the pointer instead
+VOLATILE_FIELDS = ("search_id", "timestamp")
+
+def normalize_response(raw):
+    """
+    Split a response into its canonical body and per-request fields
+
+    Args:
+        raw (bytes, str or dict): Raw or decoded API response
+
+    Returns:
+        tuple: (canonical body bytes, dict of volatile fields)
+    """
+    data = dict(raw) if isinstance(raw, dict) else loads(raw)
+    volatile = {field: data.pop(field, None) for field in VOLATILE_FIELDS}
+    body = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return body, volatile
+
+def content_hash(body):
+    """SHA-256 hex digest of a canonical body"""
+    return hashlib.sha256(body).hexdigest()
+
+class ContentAddressedArchive:
+    """Stores each distinct response body once and records a pointer per request"""
+
+    def __init__(self, backend, prefix="json/"):
+        """
+        Initialize the archive
+
+        Args:
+            backend: Storage backend holding the archive
+            prefix (str): Object name prefix
+        """
+        self.backend = backend
+        self.prefix = prefix
+        self.pointers = []
+        self.bytes_uploaded = 0
+        self.bytes_deduplicated = 0
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def object_name(self, digest):
+        """Object name of a stored body"""
+        return f"{self.prefix}objects/{digest[:2]}/{digest}.json"
+
+    def put(self, raw, sample_type, pair_id, route_id=None, timestamp=None):
+        """
+        Archive one response
+
+        The body is uploaded only if no object with its hash exists yet; the
+        pointer is buffered until flush(). Collectors flush after every sample,
+        so a run that dies leaves at most one sample's bodies unreferenced.
+
+        Args:
+            raw (bytes, str or dict): Raw or decoded API response
+            sample_type (str): Sample label
+            pair_id (int): Pair number within the sample
+            route_id (str): Route registry id (default: "<sample_type>-<pair_id>")
+            timestamp (datetime): Collection time (default: now)
+
+        Returns:
+            dict: Pointer record
+        """
+        body, volatile = normalize_response(raw)
+        digest = content_hash(body)
+
+        with self._lock:
+            known = digest in self._known
+            self._known.add(digest)
+        if known or self.backend.exists(self.object_name(digest)):
+            with self._lock:
+                self.bytes_deduplicated += len(body)
+        else:
+            try:
+                with STAGE_LATENCY.time(stage="json_upload"):
+                    self.backend.put(self.object_name(digest), body, content_type="application/json")
+            except Exception:
+                with self._lock:
+                    self._known.discard(digest)
+                raise
+            STAGE_BYTES.inc(len(body), stage="json_upload")
+            with self._lock:
+                self.bytes_uploaded += len(body)
+
+        pointer = {
+            "timestamp": (timestamp or datetime.now()).isoformat(),
+            "route_id": route_id or f"{sample_type}-{pair_id}",
+            "sample_type": sample_type,
+            "pair_id": pair_id,
+            "search_id": volatile["search_id"],
+            "response_timestamp": volatile["timestamp"],
+            "hash": digest,
+        }
+        with self._lock:
+            self.pointers.append(pointer)
+        return pointer
+
+    def flush(self, timestamp=None):
+        """
+        Write buffered pointers as one JSON lines object
+
+        A random suffix keeps names unique when several collectors, e.g.
+        shards, flush in the same second.
+
+        Args:
+            timestamp (datetime): Used in the object name (default: now)
+
+        Returns:
+            str: Object name written, or None if there was nothing to write
+        """
+        with self._lock:
+            pointers, self.pointers = self.pointers, []
+        if not pointers:
+            return None
+        stamp = (timestamp or datetime.now()).strftime("%Y%m%d_%H%M%S")
+        name = f"{self.prefix}pointers/pointers_{stamp}_{uuid.uuid4().hex[:8]}.jsonl"
+        content = "\n".join(dumps(pointer) for pointer in pointers) + "\n"
+        self.backend.put(name, content, content_type="application/x-ndjson")
+        STAGE_BYTES.inc(len(content), stage="json_upload")
+        return name
+
+    def get(self, pointer):
+        """
+        Rebuild the response a pointer refers to
+
+        Returns:
+            dict: Decoded response with search_id and timestamp restored
+        """
+        data = loads(self.backend.get(self.object_name(pointer["hash"])))
+        data["search_id"] = pointer["search_id"]
+        data["timestamp"] = pointer["response_timestamp"]
+        return data
+
+    def iter_pointers(self):
+        """
+        Read every stored pointer in collection order
+
+        Returns:
+            generator: Pointer dicts
+        """
+        for name in self.backend.list(f"{self.prefix}pointers/"):
+            for line in self.backend.get(name).decode("utf-8").splitlines():
+                if line:
+                    yield loads(line)
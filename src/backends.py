@@ -0,0 +1,342 @@
+"""
+Pluggable object storage for the collectors
+
+Collectors read and write named objects ("ride_prices.csv",
+"json/data_Sample1_pair3_20250311_120000.json") through a backend instead
+of calling a GCS bucket directly, so the same code runs against a GCS
+bucket, a local directory, or process memory. Every backend offers:
+
+    put(name, data)           write a whole object
+    get(name, start=0, end=None)  read an object, optionally a byte range
+    exists(name), size(name), delete(name)
+    list(prefix)              object names under a prefix, in lexicographic order
+    append(name, data)        add bytes to the end of an object, creating it if missing
+    compose(name, sources)    concatenate objects into one
+
+The backend is chosen by STORAGE_BACKEND ("gcs", "local" or "memory"):
+GCS uses GCS_BUCKET_NAME, the local backend keeps objects as files under
+STORAGE_ROOT (default: a directory chosen by each tool), and all memory
+backends of a process share one store.
+"""
+import os
+import threading
+import uuid
+
+try:
+    from google.api_core.exceptions import NotFound
+    from google.cloud import storage
+except ImportError:
+    storage = None
+    NotFound = ()  # catches nothing
+
+# Backend used when a collector is not told otherwise; unset keeps each collector's default
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND")
+
+# Directory holding the objects of the local backend; unset keeps each tool's own directory
+STORAGE_ROOT = os.environ.get("STORAGE_ROOT")
+
+# Local backend directory of tools that don't choose one
+DEFAULT_STORAGE_ROOT = "data"
+
+# GCS compose accepts at most this many source objects per call
+GCS_COMPOSE_LIMIT = 32
+
+def _as_bytes(data):
+    """Encode text as UTF-8; bytes pass through"""
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+class GcsBackend:
+    """Objects in a Google Cloud Storage bucket"""
+
+    def __init__(self, bucket_name, client=None):
+        """
+        Initialize the backend
+
+        Args:
+            bucket_name (str): Bucket name
+            client (storage.Client): GCS client (default: a new one)
+
+        Raises:
+            ImportError: If google-cloud-storage is missing and no client is given
+        """
+        if client is None:
+            if storage is None:
+                raise ImportError("The GCS storage backend requires google-cloud-storage")
+            client = storage.Client()
+        self.client = client
+        self.bucket_name = bucket_name
+        self.bucket = client.bucket(bucket_name)
+
+    def uri(self, name):
+        """gs:// URI of an object"""
+        return f"gs://{self.bucket_name}/{name}"
+
+    def put(self, name, data, content_type=None):
+        """Write a whole object, replacing any previous content"""
+        self.bucket.blob(name).upload_from_string(data, content_type=content_type)
+
+    def get(self, name, start=0, end=None):
+        """
+        Read an object, or the bytes from start up to (excluding) end
+
+        Raises:
+            FileNotFoundError: If the object doesn't exist
+        """
+        blob = self.bucket.blob(name)
+        if end is not None and end <= start:
+            return b""
+        try:
+            if not start and end is None:
+                return blob.download_as_bytes()
+            # GCS byte ranges include their end
+            return blob.download_as_bytes(start=start, end=None if end is None else end - 1)
+        except NotFound as e:
+            raise FileNotFoundError(self.uri(name)) from e
+
+    def exists(self, name):
+        """Whether the object exists"""
+        return self.bucket.blob(name).exists()
+
+    def size(self, name):
+        """Object size in bytes, or None if it doesn't exist"""
+        blob = self.bucket.get_blob(name)
+        return None if blob is None else blob.size or 0
+
+    def delete(self, name):
+        """Delete an object"""
+        self.bucket.blob(name).delete()
+
+    def list(self, prefix=""):
+        """Names of the objects under prefix, in lexicographic order"""
+        return (blob.name for blob in self.client.list_blobs(self.bucket_name, prefix=prefix))
+
+    def append(self, name, data, content_type=None):
+        """
+        Add data to the end of an object
+
+        The data is uploaded as a temporary object and composed onto the
+        target, so the existing content is never downloaded. Appends to one
+        object must not run concurrently.
+        """
+        target = self.bucket.blob(name)
+        if not target.exists():
+            self.put(name, data, content_type)
+            return
+        part = self.bucket.blob(f"{name}.append-{uuid.uuid4().hex}")
+        part.upload_from_string(data, content_type=content_type)
+        try:
+            if content_type:
+                target.content_type = content_type
+            target.compose([target, part])
+        finally:
+            part.delete()
+
+    def compose(self, name, sources, content_type=None):
+        """
+        Concatenate source objects into name
+
+        More than GCS_COMPOSE_LIMIT sources are composed in groups, folding
+        each group into the target. name may itself be the first source.
+        """
+        target = self.bucket.blob(name)
+        if content_type:
+            target.content_type = content_type
+        sources = [self.bucket.blob(source) for source in sources]
+        while sources:
+            group, sources = sources[:GCS_COMPOSE_LIMIT], sources[GCS_COMPOSE_LIMIT:]
+            if sources:
+                sources.insert(0, target)
+            target.compose(group)
+
+class LocalBackend:
+    """Objects as files under a local directory; "/" in names becomes subdirectories"""
+
+    def __init__(self, root=DEFAULT_STORAGE_ROOT):
+        """
+        Initialize the backend
+
+        Args:
+            root (str): Directory holding the objects, created on first write
+        """
+        self.root = root
+
+    def path(self, name):
+        """File path of an object"""
+        return os.path.join(self.root, *name.split("/"))
+
+    def uri(self, name):
+        """File path of an object, for log messages"""
+        return self.path(name)
+
+    def _parent(self, name):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return path
+
+    def put(self, name, data, content_type=None):
+        """Write a whole object atomically, replacing any previous content"""
+        path = self._parent(name)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(tmp_path, 'wb') as f:
+            f.write(_as_bytes(data))
+        os.replace(tmp_path, path)
+
+    def get(self, name, start=0, end=None):
+        """
+        Read an object, or the bytes from start up to (excluding) end
+
+        Raises:
+            FileNotFoundError: If the object doesn't exist
+        """
+        with open(self.path(name), 'rb') as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(max(end - start, 0))
+
+    def exists(self, name):
+        """Whether the object exists"""
+        return os.path.isfile(self.path(name))
+
+    def size(self, name):
+        """Object size in bytes, or None if it doesn't exist"""
+        path = self.path(name)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    def delete(self, name):
+        """Delete an object"""
+        os.remove(self.path(name))
+
+    def list(self, prefix=""):
+        """Names of the objects under prefix, in lexicographic order"""
+        names = []
+        for directory, _, files in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            base = "" if relative == "." else relative.replace(os.sep, "/") + "/"
+            names.extend(base + file for file in files if (base + file).startswith(prefix))
+        return iter(sorted(names))
+
+    def append(self, name, data, content_type=None):
+        """Add data to the end of an object, creating it if missing"""
+        with open(self._parent(name), 'ab') as f:
+            f.write(_as_bytes(data))
+
+    def compose(self, name, sources, content_type=None):
+        """Concatenate source objects into name; name may itself be a source"""
+        path = self._parent(name)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(tmp_path, 'wb') as output:
+            for source in sources:
+                with open(self.path(source), 'rb') as f:
+                    while True:
+                        chunk = f.read(1 << 20)
+                        if not chunk:
+                            break
+                        output.write(chunk)
+        os.replace(tmp_path, path)
+
+class MemoryBackend:
+    """Objects in a dict; for tests, benchmarks and single-process runs"""
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def uri(self, name):
+        """memory:// URI of an object, for log messages"""
+        return f"memory://{name}"
+
+    def put(self, name, data, content_type=None):
+        """Write a whole object, replacing any previous content"""
+        with self._lock:
+            self.objects[name] = bytes(_as_bytes(data))
+
+    def get(self, name, start=0, end=None):
+        """
+        Read an object, or the bytes from start up to (excluding) end
+
+        Raises:
+            FileNotFoundError: If the object doesn't exist
+        """
+        with self._lock:
+            if name not in self.objects:
+                raise FileNotFoundError(self.uri(name))
+            return self.objects[name][start:end]
+
+    def exists(self, name):
+        """Whether the object exists"""
+        with self._lock:
+            return name in self.objects
+
+    def size(self, name):
+        """Object size in bytes, or None if it doesn't exist"""
+        with self._lock:
+            data = self.objects.get(name)
+        return None if data is None else len(data)
+
+    def delete(self, name):
+        """Delete an object"""
+        with self._lock:
+            del self.objects[name]
+
+    def list(self, prefix=""):
+        """Names of the objects under prefix, in lexicographic order"""
+        with self._lock:
+            return iter(sorted(name for name in self.objects if name.startswith(prefix)))
+
+    def append(self, name, data, content_type=None):
+        """Add data to the end of an object, creating it if missing"""
+        with self._lock:
+            self.objects[name] = self.objects.get(name, b"") + _as_bytes(data)
+
+    def compose(self, name, sources, content_type=None):
+        """Concatenate source objects into name; name may itself be a source"""
+        with self._lock:
+            self.objects[name] = b"".join(self.objects[source] for source in sources)
+
+# Shared by every memory backend of the process, so separate components see the same objects
+_memory_backend = MemoryBackend()
+
+def create_backend(kind=None, bucket_name=None, root=None, client=None, default="gcs",
+                   default_root=DEFAULT_STORAGE_ROOT):
+    """
+    Create the configured storage backend
+
+    Args:
+        kind (str): "gcs", "local" or "memory" (default: STORAGE_BACKEND, then default)
+        bucket_name (str): GCS bucket (default: GCS_BUCKET_NAME)
+        root (str): Local backend directory (default: STORAGE_ROOT, then default_root)
+        client (storage.Client): GCS client (default: a new one)
+        default (str): Backend used when neither kind nor STORAGE_BACKEND is set
+        default_root (str): Local backend directory when neither root nor STORAGE_ROOT is set
+
+    Returns:
+        GcsBackend, LocalBackend or MemoryBackend
+
+    Raises:
+        ValueError: On an unknown backend or a GCS backend without a bucket
+    """
+    kind = (kind or STORAGE_BACKEND or default).lower()
+    if kind == "gcs":
+        bucket_name = bucket_name or os.environ.get("GCS_BUCKET_NAME")
+        if not bucket_name:
+            raise ValueError("The GCS storage backend requires a bucket (GCS_BUCKET_NAME)")
+        return GcsBackend(bucket_name, client)
+    if kind == "local":
+        return LocalBackend(root or STORAGE_ROOT or default_root)
+    if kind == "memory":
+        return _memory_backend
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+def backend_for_uri(uri, client=None):
+    """
+    Split a gs://bucket/object, memory://object or local path into backend and object name
+
+    Returns:
+        tuple: (backend, object name)
+    """
+    if uri.startswith("gs://"):
+        bucket_name, _, name = uri[len("gs://"):].partition("/")
+        return GcsBackend(bucket_name, client), name
+    if uri.startswith("memory://"):
+        return _memory_backend, uri[len("memory://"):]
+    directory, name = os.path.split(uri)
+    return LocalBackend(directory or "."), name
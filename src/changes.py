@@ -0,0 +1,192 @@
+"""
+Price-change detection for collected quotes
+
+Keeps the last written quote per (route, provider, product) and passes on
+only rows whose price, wait or surge changed, plus a periodic heartbeat.
+Each collected route also gets a "collected" marker row, so
+reconstruct_rows can rebuild the full ride_prices.csv series.
+"""
+from datetime import datetime
+from src.parsing import dumps, loads
+from src.quotes import CSV_FIELDNAMES
+
+# Fields compared between cycles. Trip time and distance are not compared;
+# reconstructed rows carry them over from the last written row.
+TRACKED_FIELDS = [
+    "price_min", "price_max", "price_min_discounted", "price_max_discounted",
+    "wait_min_seconds", "wait_max_seconds", "surge_multiplier"
+]
+
+# Columns of ride_price_changes.csv. A response can list the same provider and
+# product more than once; occurrence numbers the repeats from 1.
+CHANGE_FIELDNAMES = CSV_FIELDNAMES + ["route_id", "occurrence", "change_type"]
+
+# Values of the change_type column
+COLLECTED = "collected"
+NEW = "new"
+CHANGED = "changed"
+HEARTBEAT = "heartbeat"
+REMOVED = "removed"
+
+def _row_time(row):
+    """Collection time of a CSV row"""
+    return datetime.strptime(f"{row['date']} {row['time']}", "%Y-%m-%d %H:%M:%S")
+
+def _fingerprint(row):
+    """Compact string of the tracked fields of a row"""
+    return "|".join(str(row.get(field, "")) for field in TRACKED_FIELDS)
+
+class QuoteState:
+    """
+    Last written quote per (route, provider, product)
+
+    Stored as {"route|occurrence|provider|product": [fingerprint, last_written_epoch]},
+    which is all the detector needs and serializes to a small JSON document.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+
+    @staticmethod
+    def key(route_id, occurrence, provider, product):
+        """State key of a quote"""
+        return f"{route_id}|{occurrence}|{provider}|{product}"
+
+    def keys_for_route(self, route_id):
+        """State keys belonging to a route"""
+        prefix = f"{route_id}|"
+        return [key for key in self.entries if key.startswith(prefix)]
+
+    @classmethod
+    def from_json(cls, text):
+        """Load state from JSON text (empty or None gives an empty state)"""
+        if not text:
+            return cls()
+        return cls(loads(text))
+
+    def to_json(self):
+        """Serialize state as compact JSON text"""
+        return dumps(self.entries)
+
+class ChangeDetector:
+    """Filters collected rows down to changes and heartbeats"""
+
+    def __init__(self, state=None, heartbeat_seconds=6 * 3600):
+        """
+        Initialize the detector
+
+        Args:
+            state (QuoteState): State from the previous cycle (default: empty)
+            heartbeat_seconds (float): Write an unchanged quote again once its
+                last written row is this old
+        """
+        self.state = state or QuoteState()
+        self.heartbeat_seconds = heartbeat_seconds
+        self.rows_seen = 0
+        self.rows_written = 0
+
+    def filter(self, route, rows, timestamp=None):
+        """
+        Reduce one route's rows for a cycle to what must be stored
+
+        Args:
+            route (dict): Route from src.routes
+            rows (list): ride_prices.csv rows collected for the route
+            timestamp (datetime): Collection time if there are no rows (default: now)
+
+        Returns:
+            list: Rows keyed by CHANGE_FIELDNAMES: a "collected" marker, then
+                new, changed, heartbeat and removed quotes
+        """
+        route_id = route["route_id"]
+        if rows:
+            first = rows[0]
+            timestamp = _row_time(first)
+            search_id = first.get("search_id", "")
+        else:
+            timestamp = timestamp or datetime.now()
+            search_id = ""
+
+        marker = dict.fromkeys(CHANGE_FIELDNAMES, "")
+        marker.update({
+            "date": timestamp.strftime("%Y-%m-%d"),
+            "time": timestamp.strftime("%H:%M:%S"),
+            "search_id": search_id,
+            "sample_type": route["sample_type"],
+            "pickup": route["origin"]["name"],
+            "destination": route["destination"]["name"],
+            "route_id": route_id,
+            "change_type": COLLECTED,
+        })
+        output = [marker]
+
+        epoch = timestamp.timestamp()
+        seen = set()
+        occurrences = {}
+        for row in rows:
+            provider, product = row.get("provider", ""), row.get("product", "")
+            occurrence = occurrences[provider, product] = occurrences.get((provider, product), 0) + 1
+            key = QuoteState.key(route_id, occurrence, provider, product)
+            seen.add(key)
+            fingerprint = _fingerprint(row)
+            previous = self.state.entries.get(key)
+            if previous is None:
+                change_type = NEW
+            elif previous[0] != fingerprint:
+                change_type = CHANGED
+            elif epoch - previous[1] >= self.heartbeat_seconds:
+                change_type = HEARTBEAT
+            else:
+                continue
+            self.state.entries[key] = [fingerprint, epoch]
+            output.append(dict(row, route_id=route_id, occurrence=occurrence, change_type=change_type))
+
+        for key in self.state.keys_for_route(route_id):
+            if key in seen:
+                continue
+            _, occurrence, provider, product = key.split("|", 3)
+            del self.state.entries[key]
+            output.append(dict(marker, provider=provider, product=product, occurrence=occurrence, change_type=REMOVED))
+
+        self.rows_seen += len(rows)
+        self.rows_written += len(output)
+        return output
+
+def reconstruct_rows(change_rows):
+    """
+    Rebuild the full ride_prices.csv series from change rows
+
+    Every "collected" marker expands to one row per quote active on its
+    route, using the latest values written for that quote.
+
+    Args:
+        change_rows (iterable): Rows keyed by CHANGE_FIELDNAMES, in file order
+
+    Returns:
+        generator: Rows keyed by CSV_FIELDNAMES
+    """
+    active = {}
+    pending = None
+
+    def snapshot(marker):
+        for row in active.get(marker["route_id"], {}).values():
+            full = {field: row.get(field, "") for field in CSV_FIELDNAMES}
+            full.update(date=marker["date"], time=marker["time"], search_id=marker["search_id"])
+            yield full
+
+    for row in change_rows:
+        change_type = row["change_type"]
+        if pending is not None and (change_type == COLLECTED or row["route_id"] != pending["route_id"]):
+            yield from snapshot(pending)
+            pending = None
+        if change_type == COLLECTED:
+            pending = row
+            continue
+        quotes = active.setdefault(row["route_id"], {})
+        quote_key = (str(row["occurrence"]), row["provider"], row["product"])
+        if change_type == REMOVED:
+            quotes.pop(quote_key, None)
+        else:
+            quotes[quote_key] = row
+    if pending is not None:
+        yield from snapshot(pending)
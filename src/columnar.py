@@ -0,0 +1,344 @@
+"""
+Memory-mapped columnar history files
+
+A history is a directory with one file per column: fixed-width
+little-endian numeric columns, and for string columns an offsets table
+(end offset of every value) plus the concatenated UTF-8 bytes. meta.json
+records the committed row count, so opening a history only reads that file
+and scanning one column only touches that column's pages.
+
+ColumnarAppender has no NumPy dependency so collectors can use it;
+ColumnarHistory maps columns as zero-copy NumPy views. Appenders serialize
+on an exclusive lock file in the directory, so several processes may append
+to the same history.
+
+Usage: python -m src.columnar ride_prices.csv data/history.cols
+"""
+import os
+import sys
+import csv
+import json
+import calendar
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Column name -> type: "int64", "int32", "float64" or "string"
+SCHEMA = {
+    "timestamp": "int64",
+    "search_id": "string",
+    "sample_type": "string",
+    "pickup": "string",
+    "destination": "string",
+    "provider": "string",
+    "product": "string",
+    "service_level": "string",
+    "price_min": "int32",
+    "price_max": "int32",
+    "price_min_discounted": "int32",
+    "price_max_discounted": "int32",
+    "wait_min_seconds": "int32",
+    "wait_max_seconds": "int32",
+    "trip_seconds": "int32",
+    "distance_meters": "int32",
+    "surge_multiplier": "float64",
+}
+
+# Prices are stored in integer cents
+PRICE_COLUMNS = ["price_min", "price_max", "price_min_discounted", "price_max_discounted"]
+
+# Placeholder for empty integer values
+MISSING = -1
+
+# Column names used by older ride_prices.csv files
+COLUMN_ALIASES = {"price_min_dollars": "price_min", "price_max_dollars": "price_max"}
+
+# array typecodes and NumPy dtypes of the numeric types
+_TYPECODES = {"int64": "q", "int32": "i", "float64": "d"}
+_DTYPES = {"int64": "<i8", "int32": "<i4", "float64": "<f8"}
+_ITEMSIZE = {"int64": 8, "int32": 4, "float64": 8}
+
+META_FILE = "meta.json"
+LOCK_FILE = "append.lock"
+FORMAT_VERSION = 1
+
+def _data_path(path, name):
+    return os.path.join(path, f"{name}.bin")
+
+def _offsets_path(path, name):
+    return os.path.join(path, f"{name}.offsets")
+
+def read_meta(path):
+    """Read meta.json, or None if the history does not exist yet"""
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+def _write_meta(path, rows):
+    """Atomically commit the row count"""
+    meta_path = os.path.join(path, META_FILE)
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": FORMAT_VERSION, "rows": rows, "schema": SCHEMA}, f)
+    os.replace(tmp_path, meta_path)
+
+def _epoch_seconds(row):
+    return calendar.timegm(datetime.strptime(f"{row['date']} {row['time']}", "%Y-%m-%d %H:%M:%S").timetuple())
+
+def _cents(value):
+    return int(round(float(value) * 100)) if value not in ("", None) else 0
+
+def _integer(value):
+    return int(float(value)) if value not in ("", None) else MISSING
+
+def row_values(row):
+    """
+    Convert a ride_prices.csv row to stored column values
+
+    Args:
+        row (dict): Row with string or numeric values; older column names are accepted
+
+    Returns:
+        dict: Values keyed by SCHEMA column
+    """
+    row = {COLUMN_ALIASES.get(name, name): value for name, value in row.items()}
+    values = {"timestamp": _epoch_seconds(row)}
+    for name, kind in SCHEMA.items():
+        if name == "timestamp":
+            continue
+        value = row.get(name, "")
+        if kind == "string":
+            values[name] = "" if value is None else str(value)
+        elif name in PRICE_COLUMNS:
+            values[name] = _cents(value)
+        elif kind == "float64":
+            values[name] = float(value) if value not in ("", None) else 1.0
+        else:
+            values[name] = _integer(value)
+    return values
+
+class ColumnarAppender:
+    """
+    Appends rows to a columnar history
+
+    Opening and every append hold an exclusive lock on the directory's lock
+    file, re-read the committed row count, and truncate every column file
+    to it. Another appender's batch is never in flight while the lock is
+    held, so only a batch that was interrupted before its commit is
+    discarded. Without fcntl (Windows) there is no lock, and a history must
+    have a single appender.
+    """
+
+    def __init__(self, path):
+        """
+        Open or create a history
+
+        Args:
+            path (str): History directory
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        with self._locked():
+            self.rows = self._recover()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the history's exclusive append lock"""
+        with open(os.path.join(self.path, LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _recover(self):
+        """Truncate every column to the committed row count, with the lock held, and return that count"""
+        meta = read_meta(self.path)
+        rows = meta["rows"] if meta else 0
+        for name, kind in SCHEMA.items():
+            if kind == "string":
+                offsets = self._truncate(_offsets_path(self.path, name), rows * 8)
+                end = 0
+                if rows:
+                    with open(offsets, 'rb') as f:
+                        f.seek((rows - 1) * 8)
+                        end = int.from_bytes(f.read(8), "little")
+                self._truncate(_data_path(self.path, name), end)
+            else:
+                self._truncate(_data_path(self.path, name), rows * _ITEMSIZE[kind])
+        if meta is None:
+            _write_meta(self.path, 0)
+        return rows
+
+    @staticmethod
+    def _truncate(file_path, size):
+        with open(file_path, 'ab') as f:
+            f.truncate(size)
+        return file_path
+
+    def append(self, rows):
+        """
+        Append ride_prices.csv rows and commit them
+
+        Args:
+            rows (list): Row dicts
+
+        Returns:
+            int: Total committed rows
+        """
+        converted = [row_values(row) for row in rows]
+        if not converted:
+            return self.rows
+
+        with self._locked():
+            # Other appenders may have committed since this one last held the lock
+            self.rows = self._recover()
+            self._write_columns(converted)
+            self.rows += len(converted)
+            _write_meta(self.path, self.rows)
+        return self.rows
+
+    def _write_columns(self, converted):
+        """Append converted rows to every column file"""
+        for name, kind in SCHEMA.items():
+            if kind == "string":
+                with open(_offsets_path(self.path, name), 'rb') as f:
+                    f.seek(0, os.SEEK_END)
+                    end = 0
+                    if f.tell():
+                        f.seek(-8, os.SEEK_END)
+                        end = int.from_bytes(f.read(8), "little")
+                ends = array("q")
+                chunks = []
+                for values in converted:
+                    encoded = values[name].encode("utf-8")
+                    chunks.append(encoded)
+                    end += len(encoded)
+                    ends.append(end)
+                with open(_data_path(self.path, name), 'ab') as f:
+                    f.write(b"".join(chunks))
+                self._write_array(_offsets_path(self.path, name), ends)
+            else:
+                self._write_array(_data_path(self.path, name), array(_TYPECODES[kind], (values[name] for values in converted)))
+
+    @staticmethod
+    def _write_array(file_path, values):
+        if sys.byteorder != "little":
+            values.byteswap()
+        with open(file_path, 'ab') as f:
+            values.tofile(f)
+
+class ColumnarHistory:
+    """
+    Read-only view of a columnar history
+
+    Columns are memory-mapped on first access; only the committed rows are
+    visible, even while an appender is writing.
+    """
+
+    def __init__(self, path):
+        """
+        Open a history
+
+        Args:
+            path (str): History directory
+
+        Raises:
+            FileNotFoundError: If the directory holds no history
+            ImportError: If NumPy is not installed
+        """
+        if np is None:
+            raise ImportError("Reading a columnar history requires numpy")
+        meta = read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(f"No columnar history at {path}")
+        self.path = path
+        self.rows = meta["rows"]
+        self.schema = meta["schema"]
+        self._views = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self, file_path, dtype, count):
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode='r', shape=(count,))
+
+    def column(self, name):
+        """
+        Zero-copy NumPy view of a numeric column
+
+        Prices are integer cents and empty integers are MISSING.
+        """
+        kind = self.schema[name]
+        if kind == "string":
+            raise TypeError(f"{name} is a string column; use strings() or string_column()")
+        if name not in self._views:
+            self._views[name] = self._map(_data_path(self.path, name), _DTYPES[kind], self.rows)
+        return self._views[name]
+
+    def strings(self, name):
+        """
+        Zero-copy views of a string column
+
+        Returns:
+            tuple: (end offsets as int64, UTF-8 bytes as uint8); value i is
+                data[ends[i-1]:ends[i]], with ends[-1] taken as 0
+        """
+        if self.schema[name] != "string":
+            raise TypeError(f"{name} is not a string column")
+        if name not in self._views:
+            ends = self._map(_offsets_path(self.path, name), "<i8", self.rows)
+            size = int(ends[-1]) if self.rows else 0
+            self._views[name] = (ends, self._map(_data_path(self.path, name), "u1", size))
+        return self._views[name]
+
+    def string_column(self, name):
+        """Decode a string column into a NumPy array of str"""
+        ends, data = self.strings(name)
+        raw = data.tobytes()
+        starts = [0] + ends[:-1].tolist()
+        return np.array([raw[start:end].decode("utf-8") for start, end in zip(starts, ends.tolist())], dtype=str)
+
+def convert_csv(csv_path, output_path, batch_size=10000):
+    """
+    Append every row of a ride_prices.csv file to a columnar history
+
+    Returns:
+        int: Total committed rows
+    """
+    appender = ColumnarAppender(output_path)
+    batch = []
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                appender.append(batch)
+                batch = []
+    return appender.append(batch)
+
+def main():
+    """Convert a CSV history given on the command line"""
+    if len(sys.argv) != 3:
+        print("Usage: python -m src.columnar <ride_prices.csv> <history directory>")
+        sys.exit(1)
+    rows = convert_csv(sys.argv[1], sys.argv[2])
+    print(f"{sys.argv[2]} now holds {rows} rows")
+
+if __name__ == "__main__":
+    main()
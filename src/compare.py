@@ -0,0 +1,290 @@
+"""
+Bulk price comparison with a quote cache
+
+compare_pairs answers many origin/destination pairs at once: pairs with a
+cached quote younger than max_age are answered from the cache, the rest are
+fetched concurrently through a shared BellhopAPI client (each distinct pair
+once), and every pair gets its ride options ranked by price.
+register_compare_route exposes the same as POST /quotes/compare.
+"""
+import json
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify, request
+from src.quotes import get_price_options
+from src.utils.coordinates import get_location
+
+# Default age in seconds up to which a cached quote is served
+DEFAULT_MAX_AGE = 300
+
+# Default concurrent API calls for cache misses
+DEFAULT_WORKERS = 8
+
+# Most pairs accepted by one comparison request
+MAX_PAIRS = 500
+
+# Coordinates are rounded to this many decimals (about a meter) for cache keys
+KEY_DECIMALS = 5
+
+def parse_location(value):
+    """
+    Parse a location given as a LOCATIONS name, "lat,lng" or a dict
+
+    Args:
+        value (str or dict): e.g. "times_square", "40.75,-73.98" or {"lat": .., "lng": .., "name": ..}
+
+    Returns:
+        dict: Location with lat, lng and name
+
+    Raises:
+        ValueError: If the location is unknown or malformed
+    """
+    if isinstance(value, dict):
+        try:
+            lat, lng = float(value["lat"]), float(value["lng"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Location needs numeric lat and lng: {value}")
+        return {"lat": lat, "lng": lng, "name": value.get("name") or f"Custom ({lat}, {lng})"}
+    value = str(value).strip()
+    if "," in value:
+        try:
+            lat, lng = map(float, value.split(","))
+        except ValueError:
+            raise ValueError(f"Invalid coordinates {value!r}; use 'latitude,longitude'")
+        return {"lat": lat, "lng": lng, "name": f"Custom ({lat}, {lng})"}
+    location = get_location(value)
+    if location is None:
+        raise ValueError(f"Unknown location {value!r}")
+    return location
+
+def pair_key(pickup, destination):
+    """Cache key of an origin/destination pair"""
+    return tuple(round(value, KEY_DECIMALS) for value in (pickup["lat"], pickup["lng"], destination["lat"], destination["lng"]))
+
+class QuoteCache:
+    """
+    Thread-safe cache of API responses per origin/destination pair
+
+    Entries record the wall-clock time they were fetched, so a cache saved
+    to a file stays valid across runs of a command-line tool.
+    """
+
+    def __init__(self, max_entries=10000):
+        """
+        Initialize an empty cache
+
+        Args:
+            max_entries (int): Entries kept; the oldest are evicted first
+        """
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, max_age):
+        """
+        Look up a response
+
+        Args:
+            key (tuple): From pair_key()
+            max_age (float): Oldest acceptable entry in seconds
+
+        Returns:
+            tuple: (response, age in seconds), or None if missing or too old
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age > max_age:
+            return None
+        return entry[1], age
+
+    def put(self, key, response, fetched_at=None):
+        """Store a response fetched at `fetched_at` (default: now)"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (fetched_at or time.time(), response)
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def entries(self):
+        """
+        Snapshot of the cache
+
+        Returns:
+            list: (key, fetched_at, response) tuples, oldest first
+        """
+        with self._lock:
+            return [(key, fetched_at, response) for key, (fetched_at, response) in self._entries.items()]
+
+    def load(self, path, max_age=None):
+        """
+        Read entries saved by save(), skipping those older than max_age
+
+        Returns:
+            int: Entries loaded
+        """
+        if not os.path.isfile(path):
+            return 0
+        with open(path) as f:
+            entries = json.load(f)
+        now = time.time()
+        loaded = 0
+        for entry in sorted(entries, key=lambda entry: entry["fetched_at"]):
+            if max_age is not None and now - entry["fetched_at"] > max_age:
+                continue
+            self.put(tuple(entry["key"]), entry["response"], entry["fetched_at"])
+            loaded += 1
+        return loaded
+
+    def save(self, path):
+        """Write all entries to a JSON file"""
+        entries = [
+            {"key": list(key), "fetched_at": fetched_at, "response": response}
+            for key, fetched_at, response in self.entries()
+        ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+def rank_options(response):
+    """
+    Rank the ride options of a response by price
+
+    Options without a price are listed last; ties are broken by pickup wait.
+
+    Returns:
+        list: Option dicts in dollars and seconds, cheapest first
+    """
+    options = []
+    for price in get_price_options(response):
+        wait = price.get("est_pickup_wait_time") or {}
+        options.append({
+            "provider": price.get("provider", ""),
+            "product": price.get("product", ""),
+            "service_level": price.get("service_level", ""),
+            "price_min": price["price_min"] / 100 if price.get("price_min") else None,
+            "price_max": price["price_max"] / 100 if price.get("price_max") else None,
+            "wait_min_seconds": wait.get("min"),
+            "trip_seconds": price.get("est_time_after_pickup_till_dropoff"),
+            "surge_multiplier": price.get("surge_multiplier"),
+        })
+    options.sort(key=lambda option: (
+        option["price_min"] is None,
+        option["price_min"] or 0,
+        option["wait_min_seconds"] if option["wait_min_seconds"] is not None else float("inf"),
+    ))
+    for rank, option in enumerate(options, 1):
+        option["rank"] = rank
+    return options
+
+def _comparison(pickup, destination, response, source, age):
+    """Build the comparison of one pair"""
+    comparison = {
+        "pickup": pickup,
+        "destination": destination,
+        "source": source,
+        "age_seconds": round(age, 1) if age is not None else None,
+        "options": [],
+        "cheapest": None,
+        "cheapest_by_provider": {},
+    }
+    if response is None:
+        return comparison
+    options = rank_options(response)
+    comparison["options"] = options
+    priced = [option for option in options if option["price_min"] is not None]
+    if priced:
+        comparison["cheapest"] = priced[0]
+        for option in priced:
+            comparison["cheapest_by_provider"].setdefault(option["provider"], option)
+    return comparison
+
+def compare_pairs(client, pairs, cache=None, max_age=DEFAULT_MAX_AGE, workers=DEFAULT_WORKERS):
+    """
+    Compare ride options for many origin/destination pairs
+
+    Args:
+        client (BellhopAPI): Client used for cache misses
+        pairs (list): (pickup, destination) tuples of location dicts
+        cache (QuoteCache): Responses to serve and fill (default: no caching)
+        max_age (float): Oldest cached quote served, in seconds
+        workers (int): Concurrent API calls
+
+    Returns:
+        list: One comparison dict per pair, in input order; "source" is
+            "cache", "live" or "error"
+    """
+    results = [None] * len(pairs)
+    misses = {}
+    for i, (pickup, destination) in enumerate(pairs):
+        key = pair_key(pickup, destination)
+        cached = cache.get(key, max_age) if cache is not None else None
+        if cached is not None:
+            results[i] = _comparison(pickup, destination, cached[0], "cache", cached[1])
+        else:
+            misses.setdefault(key, []).append(i)
+
+    def fetch(key):
+        pickup, destination = pairs[misses[key][0]]
+        try:
+            return client.get_prices(pickup["lat"], pickup["lng"], destination["lat"], destination["lng"])
+        except Exception as e:
+            print(f"Error fetching ride prices: {e}")
+            return None
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(misses)))) as executor:
+            responses = dict(zip(misses, executor.map(fetch, misses)))
+        for key, indexes in misses.items():
+            response = responses[key]
+            if response is not None and cache is not None:
+                cache.put(key, response)
+            for i in indexes:
+                pickup, destination = pairs[i]
+                source = "live" if response is not None else "error"
+                results[i] = _comparison(pickup, destination, response, source, 0.0 if response is not None else None)
+    return results
+
+def register_compare_route(app, client, cache, max_age=DEFAULT_MAX_AGE, workers=DEFAULT_WORKERS):
+    """
+    Add POST /quotes/compare to a Flask app
+
+    The JSON body is {"pairs": [{"pickup": .., "destination": ..}, ...],
+    "max_age": seconds}; locations are LOCATIONS names, "lat,lng" strings or
+    {"lat", "lng", "name"} objects.
+
+    Args:
+        app (flask.Flask): Application
+        client (BellhopAPI): Client used for cache misses
+        cache (QuoteCache): Shared cache
+        max_age (float): Default oldest cached quote served, in seconds
+        workers (int): Concurrent API calls per request
+    """
+    @app.route("/quotes/compare", methods=["POST"])
+    def compare_quotes():
+        body = request.get_json(silent=True) or {}
+        try:
+            raw_pairs = body.get("pairs")
+            if not isinstance(raw_pairs, list) or not raw_pairs:
+                raise ValueError("pairs must be a non-empty list")
+            if len(raw_pairs) > MAX_PAIRS:
+                raise ValueError(f"At most {MAX_PAIRS} pairs per request")
+            pairs = [(parse_location(pair["pickup"]), parse_location(pair["destination"])) for pair in raw_pairs]
+            request_max_age = float(body.get("max_age", max_age))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        started = time.perf_counter()
+        comparisons = compare_pairs(client, pairs, cache, request_max_age, workers)
+        return jsonify({
+            "comparisons": comparisons,
+            "cached": sum(comparison["source"] == "cache" for comparison in comparisons),
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+        })
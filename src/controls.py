@@ -0,0 +1,347 @@
+"""
+Distance-matched control route generator
+
+For each treatment route (e.g. Sample1) this finds control routes between
+candidate points whose straight-line length and bearing are within a
+tolerance of the treatment route, like the hand-picked Sample2 pairs. A
+uniform grid index over the candidates limits every search to points near
+the ideal destination of a sampled origin, and all filtering is vectorized.
+
+Usage:
+    python -m src.controls --treatment Sample1 --points candidates.csv --sample-type Control1
+    python -m src.controls --treatment Sample1 --polygon manhattan.json --samples 20000
+"""
+import argparse
+import csv
+import json
+import sys
+import numpy as np
+from src.routes import ROUTES_FILE, load_routes, save_routes
+from src.utils.geo import (
+    EARTH_RADIUS_METERS, as_coordinates, bearing, bearing_difference, destination_point, equirectangular,
+    route_bearings, route_distances,
+)
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = np.radians(1.0) * EARTH_RADIUS_METERS
+
+# Queries gathered per vectorized block
+QUERY_BLOCK = 2048
+
+# Search radius around an ideal destination, in mean candidate spacings
+SEARCH_SPACINGS = 3.0
+
+class GridIndex:
+    """
+    Uniform grid over points, stored as point indexes sorted by cell
+
+    Points are projected onto a plane at their mean latitude, so the index
+    is meant for a city or region.
+    """
+
+    def __init__(self, lat, lng, cell_meters):
+        """
+        Build the index
+
+        Args:
+            lat (numpy.ndarray): Latitudes in degrees
+            lng (numpy.ndarray): Longitudes in degrees
+            cell_meters (float): Cell edge length
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.cell_meters = float(cell_meters)
+        self._scale = np.cos(np.radians(self.lat.mean())) if len(self.lat) else 1.0
+        self._lat0 = self.lat.min() if len(self.lat) else 0.0
+        self._lng0 = self.lng.min() if len(self.lng) else 0.0
+        rows, cols = self._cells(self.lat, self.lng)
+        self.rows = int(rows.max()) + 1 if len(rows) else 1
+        self.cols = int(cols.max()) + 1 if len(cols) else 1
+        keys = rows * self.cols + cols
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cells(self, lat, lng):
+        """Grid row and column of points (may fall outside the grid)"""
+        rows = np.floor((lat - self._lat0) * METERS_PER_DEGREE / self.cell_meters).astype(np.int64)
+        cols = np.floor((lng - self._lng0) * METERS_PER_DEGREE * self._scale / self.cell_meters).astype(np.int64)
+        return rows, cols
+
+    def query(self, lat, lng, radius):
+        """
+        Find points within a radius of every query point
+
+        Args:
+            lat (numpy.ndarray): Query latitudes
+            lng (numpy.ndarray): Query longitudes
+            radius (numpy.ndarray or float): Search radius in meters per query
+
+        Returns:
+            tuple: (query indexes, point indexes) of every match
+        """
+        lat, lng = np.atleast_1d(lat), np.atleast_1d(lng)
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), lat.shape)
+        rows, cols = self._cells(lat, lng)
+        rings = np.ceil(radius / self.cell_meters).astype(np.int64)
+
+        query_parts, point_parts = [], []
+        for ring in np.unique(rings):
+            selected = np.flatnonzero(rings == ring)
+            offsets = np.arange(-ring, ring + 1)
+            row_offsets, col_offsets = (grid.ravel() for grid in np.meshgrid(offsets, offsets, indexing="ij"))
+            cell_rows = rows[selected, None] + row_offsets[None, :]
+            cell_cols = cols[selected, None] + col_offsets[None, :]
+            valid = (cell_rows >= 0) & (cell_rows < self.rows) & (cell_cols >= 0) & (cell_cols < self.cols)
+            keys = np.where(valid, cell_rows * self.cols + cell_cols, -1)
+            starts = np.searchsorted(self.keys, keys, side="left")
+            counts = np.where(valid, np.searchsorted(self.keys, keys, side="right") - starts, 0)
+
+            # Expand every (query, cell) into the run of points stored in that cell
+            counts, starts = counts.ravel(), starts.ravel()
+            total = int(counts.sum())
+            if not total:
+                continue
+            queries = np.repeat(np.repeat(selected, len(row_offsets)), counts)
+            run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+            points = self.order[np.repeat(starts, counts) + np.arange(total) - run_starts]
+
+            close = equirectangular(lat[queries], lng[queries], self.lat[points], self.lng[points]) <= radius[queries]
+            query_parts.append(queries[close])
+            point_parts.append(points[close])
+
+        if not query_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(query_parts), np.concatenate(point_parts)
+
+def points_in_polygon(lat, lng, polygon):
+    """
+    Vectorized ray-casting point-in-polygon test
+
+    Args:
+        lat, lng (numpy.ndarray): Points in degrees
+        polygon (list): (lat, lng) vertices; the ring is closed automatically
+
+    Returns:
+        numpy.ndarray: Boolean mask
+    """
+    vertices = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(len(lat), dtype=bool)
+    for (lat1, lng1), (lat2, lng2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (lat1 > lat) != (lat2 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            edge_lng = lng1 + (lat - lat1) * (lng2 - lng1) / (lat2 - lat1)
+        inside ^= crosses & (lng < edge_lng)
+    return inside
+
+def sample_polygon(polygon, count, seed=None):
+    """
+    Draw uniformly distributed candidate points inside a polygon
+
+    Returns:
+        numpy.ndarray: (count, 2) array of (lat, lng)
+    """
+    rng = np.random.default_rng(seed)
+    vertices = np.asarray(polygon, dtype=np.float64)
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    points = np.empty((0, 2))
+    while len(points) < count:
+        draws = rng.uniform(low, high, size=(max(count, 1024) * 2, 2))
+        points = np.concatenate([points, draws[points_in_polygon(draws[:, 0], draws[:, 1], vertices)]])
+    return points[:count]
+
+def match_controls(treatment_routes, candidates, controls_per_route=1, distance_tolerance=0.05,
+                   bearing_tolerance=15.0, min_separation=500.0, origins_per_route=16, reuse_points=False, seed=None):
+    """
+    Find control routes matching treatment routes in length and bearing
+
+    For each treatment route, origins_per_route candidate origins are
+    sampled; for each origin the candidates near the point at the treatment
+    length and bearing (within SEARCH_SPACINGS mean candidate spacings, or
+    the tolerance window if smaller) are scored by their relative length
+    and bearing error, and the best-scoring distinct controls are kept.
+
+    Args:
+        treatment_routes (list): Registry routes to match
+        candidates: Candidate points accepted by as_coordinates()
+        controls_per_route (int): Controls wanted per treatment route
+        distance_tolerance (float): Largest relative length difference, e.g. 0.05 for 5%
+        bearing_tolerance (float): Largest bearing difference in degrees
+        min_separation (float): Control endpoints must be at least this many
+            meters from both treatment endpoints
+        origins_per_route (int): Candidate origins tried per treatment route
+        reuse_points (bool): Allow a candidate point in more than one control
+        seed (int): Random seed
+
+    Returns:
+        list: One list per treatment route of dicts with origin and
+            destination (lat, lng), distance_meters, bearing and the
+            treatment's values; shorter than controls_per_route when not
+            enough matches exist
+    """
+    rng = np.random.default_rng(seed)
+    lat, lng = as_coordinates(candidates)
+    if not len(treatment_routes) or not len(lat):
+        return [[] for _ in treatment_routes]
+
+    lengths = np.maximum(route_distances(treatment_routes), 1.0)
+    headings = route_bearings(treatment_routes)
+    treatment_lat, treatment_lng = as_coordinates(
+        [route[end] for route in treatment_routes for end in ("origin", "destination")]
+    )
+    treatment_lat, treatment_lng = treatment_lat.reshape(-1, 2), treatment_lng.reshape(-1, 2)
+
+    # The length/bearing window around the ideal destination fits in this radius, but
+    # the best matches lie close to it, so only a few candidate spacings are searched
+    tolerance = lengths * distance_tolerance
+    radius = tolerance + (lengths + tolerance) * 2 * np.sin(np.radians(min(bearing_tolerance, 90.0)) / 2)
+    area = np.ptp(lat) * np.ptp(lng) * METERS_PER_DEGREE ** 2 * np.cos(np.radians(lat.mean()))
+    radius = np.minimum(radius, SEARCH_SPACINGS * max(np.sqrt(area / len(lat)), 1.0))
+    index = GridIndex(lat, lng, max(float(np.median(radius)), 50.0))
+
+    origins_per_route = min(origins_per_route, len(lat))
+    routes = np.repeat(np.arange(len(treatment_routes)), origins_per_route)
+    origins = rng.integers(len(lat), size=len(routes))
+    target_lat, target_lng = destination_point(lat[origins], lng[origins], headings[routes], lengths[routes])
+
+    best_query, best_point, best_score = [], [], []
+    for start in range(0, len(origins), QUERY_BLOCK):
+        block = slice(start, start + QUERY_BLOCK)
+        queries, points = index.query(target_lat[block], target_lng[block], radius[routes[block]])
+        queries += start
+        route, origin = routes[queries], origins[queries]
+
+        # Cheapest tests first, each on what survived the previous ones
+        distance = equirectangular(lat[origin], lng[origin], lat[points], lng[points])
+        distance_error = np.abs(distance - lengths[route]) / lengths[route]
+        keep = np.flatnonzero((distance_error <= distance_tolerance) & (points != origin))
+        bearing_error = bearing_difference(
+            bearing(lat[origin[keep]], lng[origin[keep]], lat[points[keep]], lng[points[keep]]), headings[route[keep]]
+        )
+        keep, bearing_error = keep[bearing_error <= bearing_tolerance], bearing_error[bearing_error <= bearing_tolerance]
+        separated = np.ones(len(keep), dtype=bool)
+        for end in (origin[keep], points[keep]):
+            for side in range(2):
+                treatment_end = (treatment_lat[route[keep], side], treatment_lng[route[keep], side])
+                separated &= equirectangular(lat[end], lng[end], *treatment_end) >= min_separation
+        keep, bearing_error = keep[separated], bearing_error[separated]
+        queries, points = queries[keep], points[keep]
+        score = distance_error[keep] / max(distance_tolerance, 1e-9) + bearing_error / max(bearing_tolerance, 1e-9)
+
+        # Best destination per sampled origin
+        order = np.lexsort([score, queries])
+        first = np.flatnonzero(np.diff(queries[order], prepend=-1) != 0)
+        best_query.append(queries[order][first])
+        best_point.append(points[order][first])
+        best_score.append(score[order][first])
+
+    best_query = np.concatenate(best_query)
+    best_point = np.concatenate(best_point)
+    best_score = np.concatenate(best_score)
+
+    matches = [[] for _ in treatment_routes]
+    used = set()
+    for i in np.lexsort([best_score, routes[best_query]]):
+        route_index, origin, destination = int(routes[best_query[i]]), int(origins[best_query[i]]), int(best_point[i])
+        if len(matches[route_index]) >= controls_per_route:
+            continue
+        if not reuse_points and (origin in used or destination in used):
+            continue
+        used.update((origin, destination))
+        matches[route_index].append({
+            "origin": {"lat": float(lat[origin]), "lng": float(lng[origin])},
+            "destination": {"lat": float(lat[destination]), "lng": float(lng[destination])},
+            "distance_meters": float(equirectangular(lat[origin], lng[origin], lat[destination], lng[destination])),
+            "bearing": float(bearing(lat[origin], lng[origin], lat[destination], lng[destination])),
+            "treatment_distance_meters": float(lengths[route_index]),
+            "treatment_bearing": float(headings[route_index]),
+        })
+    return matches
+
+def build_control_routes(treatment_routes, matches, sample_type):
+    """
+    Turn matches into registry routes
+
+    Control routes are numbered in treatment order and record the route
+    they were matched to in matched_route_id.
+
+    Returns:
+        list: Route dicts
+    """
+    routes = []
+    for treatment, controls in zip(treatment_routes, matches):
+        for control in controls:
+            pair_id = len(routes) + 1
+            routes.append({
+                "route_id": f"{sample_type}-{pair_id}",
+                "sample_type": sample_type,
+                "pair_id": pair_id,
+                "origin": {"name": f"{sample_type} Origin {pair_id}", **control["origin"]},
+                "destination": {"name": f"{sample_type} Destination {pair_id}", **control["destination"]},
+                "matched_route_id": treatment["route_id"],
+            })
+    return routes
+
+def add_to_registry(routes, path):
+    """
+    Write routes into the registry file, replacing earlier routes of their sample types
+
+    Args:
+        routes (list): New route dicts
+        path (str): Registry file, seeded from the built-in samples if missing
+
+    Returns:
+        list: The full registry written
+    """
+    sample_types = {route["sample_type"] for route in routes}
+    registry = [route for route in load_routes(path=path) if route["sample_type"] not in sample_types]
+    registry.extend(routes)
+    save_routes(registry, path)
+    return registry
+
+def read_points(path):
+    """Read candidate points from a CSV file with lat and lng columns"""
+    with open(path, newline='') as f:
+        return np.array([(float(row["lat"]), float(row["lng"])) for row in csv.DictReader(f)])
+
+def main():
+    """Generate matched control routes from the command line"""
+    parser = argparse.ArgumentParser(description="Generate distance-matched control routes")
+    parser.add_argument("--treatment", nargs="+", default=["Sample1"], help="Sample types to match")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--points", help="CSV of candidate points with lat and lng columns")
+    source.add_argument("--polygon", help="JSON list of [lat, lng] vertices to sample candidates in")
+    parser.add_argument("--samples", type=int, default=20000, help="Candidates drawn inside --polygon")
+    parser.add_argument("--sample-type", default="Control", help="Sample type of the generated routes")
+    parser.add_argument("--controls", type=int, default=1, help="Controls per treatment route")
+    parser.add_argument("--distance-tolerance", type=float, default=0.05, help="Relative length tolerance")
+    parser.add_argument("--bearing-tolerance", type=float, default=15.0, help="Bearing tolerance in degrees")
+    parser.add_argument("--min-separation", type=float, default=500.0,
+                        help="Meters between control and treatment endpoints")
+    parser.add_argument("--seed", type=int, help="Random seed")
+    parser.add_argument("--output", default=ROUTES_FILE or "data/routes.json", help="Registry file to update")
+    args = parser.parse_args()
+
+    treatment_routes = load_routes(args.treatment, path=args.output)
+    if not treatment_routes:
+        print(f"No routes of sample types {args.treatment} in the registry")
+        sys.exit(1)
+    if args.points:
+        candidates = read_points(args.points)
+    else:
+        with open(args.polygon) as f:
+            candidates = sample_polygon(json.load(f), args.samples, args.seed)
+
+    matches = match_controls(
+        treatment_routes, candidates, args.controls, args.distance_tolerance, args.bearing_tolerance,
+        args.min_separation, seed=args.seed
+    )
+    routes = build_control_routes(treatment_routes, matches, args.sample_type)
+    add_to_registry(routes, args.output)
+    unmatched = sum(len(controls) < args.controls for controls in matches)
+    print(f"Wrote {len(routes)} {args.sample_type} routes to {args.output} ({unmatched} treatment routes short of matches)")
+
+if __name__ == "__main__":
+    main()
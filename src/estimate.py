@@ -0,0 +1,379 @@
+"""
+Price estimates for unsampled routes from nearby recent quotes
+
+QuoteEstimator indexes past quotes by the grid cells of their pickup and
+destination, with cells SEARCH_RADII radii wide, so a query only scans the
+81 cell pairs around its own route and keeps the quotes whose pickup and
+destination are both within SEARCH_RADII radii. Each quote is weighted
+by a Gaussian of its pickup and destination offsets and an exponential
+decay in its age. Per provider and product, the estimate is the weighted
+mean of price, wait, trip time and surge. Confidence grows with the total
+weight and shrinks as the neighbours disagree on price.
+
+Answers are memoized per route rounded to MEMO_DECIMALS and per
+MEMO_SECONDS of time until the next quote is indexed, so repeated queries
+return in about a microsecond.
+
+get_prices() has the signature of BellhopAPI.get_prices and returns a
+response of the same shape. Below min_confidence it makes a live call
+through the wrapped client instead and indexes the response.
+"""
+import csv
+import math
+import threading
+import time
+from datetime import datetime
+from src.quotes import get_price_options
+from src.query import route_names, to_quotes
+from src.routes import load_routes
+from src.utils.coordinates import LOCATIONS
+from src.utils.geo import EARTH_RADIUS_METERS
+
+# Pickup/destination offset in meters at which a neighbour's weight falls to exp(-1/2)
+DEFAULT_RADIUS = 500.0
+
+# Age in seconds at which a neighbour's weight falls to 1/e
+DEFAULT_HALF_LIFE = 1800.0
+
+# Quotes older than this many seconds are ignored
+DEFAULT_MAX_AGE = 6 * 3600
+
+# Estimates below this confidence fall back to a live call
+DEFAULT_MIN_CONFIDENCE = 0.6
+
+# Neighbours are searched up to this many radii away
+SEARCH_RADII = 3.0
+
+# Query coordinates are rounded to this many decimals (about 10 m) for memoized answers
+MEMO_DECIMALS = 4
+
+# Memoized answers are reused within windows of this many seconds
+MEMO_SECONDS = 60
+
+# Most memoized answers kept
+MEMO_SIZE = 100000
+
+# Option fields averaged across neighbours
+ESTIMATED_FIELDS = ("price_min", "price_max", "wait_min", "wait_max", "trip_seconds", "distance_meters", "surge_multiplier")
+
+def _option_values(price):
+    """Numeric fields of a price option, in ESTIMATED_FIELDS order (None if missing)"""
+    wait = price.get("est_pickup_wait_time") or {}
+    return (
+        price.get("price_min"), price.get("price_max"), wait.get("min"), wait.get("max"),
+        price.get("est_time_after_pickup_till_dropoff"), price.get("distance_meters"), price.get("surge_multiplier"),
+    )
+
+def _row_values(quote):
+    """Numeric fields of a to_quote() dict, prices in cents"""
+    cents = lambda value: round(value * 100) if value else None
+    return (
+        cents(quote["price_min"]), cents(quote["price_max"]), quote["wait_min_seconds"], quote["wait_max_seconds"],
+        quote["trip_seconds"], quote["distance_meters"], quote["surge_multiplier"],
+    )
+
+def place_coordinates(routes=None):
+    """
+    Map place names to (lat, lng) from LOCATIONS and the route registry
+
+    Args:
+        routes (list): Route registry (default: load_routes())
+    """
+    places = {place["name"]: (place["lat"], place["lng"]) for place in LOCATIONS.values()}
+    for route in load_routes() if routes is None else routes:
+        for place in (route["origin"], route["destination"]):
+            places[place["name"]] = (place["lat"], place["lng"])
+    return places
+
+class QuoteEstimator:
+    """Thread-safe spatial and temporal index of quotes that answers get_prices() calls"""
+
+    def __init__(self, client=None, radius=DEFAULT_RADIUS, half_life=DEFAULT_HALF_LIFE, max_age=DEFAULT_MAX_AGE,
+                 min_confidence=DEFAULT_MIN_CONFIDENCE):
+        """
+        Initialize an empty estimator
+
+        Args:
+            client (BellhopAPI): Client for live fallbacks (default: never fall back)
+            radius (float): Spatial scale of the neighbour weights, in meters
+            half_life (float): Temporal scale of the neighbour weights, in seconds
+            max_age (float): Oldest quote used, in seconds
+            min_confidence (float): Estimates below this confidence fall back to a live call
+        """
+        self.client = client
+        self.radius = radius
+        self.half_life = half_life
+        self.max_age = max_age
+        self.min_confidence = min_confidence
+        self.estimates = 0
+        self.live_calls = 0
+        # Cells are SEARCH_RADII radii in latitude; longitude is scaled per cell row (see _column_scale)
+        self._cell_degrees = math.degrees(SEARCH_RADII * radius / EARTH_RADIUS_METERS)
+        # Quotes store coordinates in radii per degree, so offsets need no trigonometry
+        self._per_degree = math.radians(EARTH_RADIUS_METERS) / radius
+        self._cells = {}
+        self._memo = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _column_scale(self, row):
+        """
+        Longitude scale of a cell row
+
+        Uses the cosine of the most poleward latitude of the row and its two
+        neighbours. Every point of a row shares its column boundaries, and
+        the columns are wide enough that a neighbour within SEARCH_RADII of a
+        query in an adjacent row is at most one column away.
+        """
+        edge = max(abs(row - 1), abs(row + 2)) * self._cell_degrees
+        return math.cos(math.radians(min(edge, 89.0)))
+
+    def _column(self, row, lng):
+        return math.floor(lng * self._column_scale(row) / self._cell_degrees)
+
+    def _cell(self, lat, lng):
+        row = math.floor(lat / self._cell_degrees)
+        return (row, self._column(row, lng))
+
+    def _nearby_cells(self, lat, lng):
+        """The 9 cells that can hold points within SEARCH_RADII of (lat, lng)"""
+        row = math.floor(lat / self._cell_degrees)
+        cells = []
+        for i in (row - 1, row, row + 1):
+            j = self._column(i, lng)
+            cells.extend(((i, j - 1), (i, j), (i, j + 1)))
+        return cells
+
+    def _add(self, pickup_lat, pickup_lng, dest_lat, dest_lng, fetched_at, options):
+        """Index one quote; options are (provider, product, service_level, values) tuples"""
+        if not options:
+            return
+        per_degree = self._per_degree
+        quote = (
+            pickup_lat * per_degree, pickup_lng * per_degree, dest_lat * per_degree, dest_lng * per_degree,
+            fetched_at, options,
+        )
+        key = self._cell(pickup_lat, pickup_lng) + self._cell(dest_lat, dest_lng)
+        with self._lock:
+            self._cells.setdefault(key, []).append(quote)
+            self._size += 1
+            self._memo.clear()
+
+    def add_response(self, pickup_lat, pickup_lng, dest_lat, dest_lng, response, fetched_at=None):
+        """
+        Index an API response
+
+        Args:
+            pickup_lat, pickup_lng, dest_lat, dest_lng (float): Route of the response
+            response (dict): Decoded API response
+            fetched_at (float): Epoch seconds of the quote (default: now)
+        """
+        options = [
+            (price.get("provider", ""), price.get("product", ""), price.get("service_level", ""), _option_values(price))
+            for price in get_price_options(response or {})
+        ]
+        self._add(pickup_lat, pickup_lng, dest_lat, dest_lng, fetched_at or time.time(), options)
+
+    def add_rows(self, rows, places=None, routes=None):
+        """
+        Index ride_prices.csv rows of either schema
+
+        Rows are grouped into one quote per collection time and route. Rows
+        whose places have no known coordinates are skipped.
+
+        Args:
+            rows (iterable): CSV rows
+            places (dict): Place name to (lat, lng) (default: place_coordinates(routes))
+            routes (list): Route registry (default: load_routes())
+
+        Returns:
+            int: Quotes indexed
+        """
+        routes = load_routes() if routes is None else routes
+        places = place_coordinates(routes) if places is None else places
+        route_ids = route_names(routes)
+        grouped = {}
+        for quote in to_quotes(rows, route_ids):
+            if quote["pickup"] not in places or quote["destination"] not in places:
+                continue
+            option = (quote["provider"], quote["product"], quote["service_level"], _row_values(quote))
+            grouped.setdefault((quote["timestamp"], quote["pickup"], quote["destination"]), []).append(option)
+        for (timestamp, pickup, destination), options in grouped.items():
+            fetched_at = datetime.fromisoformat(timestamp).timestamp()
+            self._add(*places[pickup], *places[destination], fetched_at, options)
+        return len(grouped)
+
+    def load_csv(self, path, places=None, routes=None):
+        """Index a ride_prices.csv file; returns the quotes indexed"""
+        with open(path, newline='') as f:
+            return self.add_rows(csv.DictReader(f), places, routes)
+
+    def add_cache(self, cache):
+        """Index every entry of a src.compare.QuoteCache; returns the entries indexed"""
+        entries = cache.entries()
+        for key, fetched_at, response in entries:
+            self.add_response(*key, response, fetched_at)
+        return len(entries)
+
+    def prune(self, now=None):
+        """
+        Drop quotes older than max_age
+
+        Returns:
+            int: Quotes dropped
+        """
+        cutoff = (now or time.time()) - self.max_age
+        with self._lock:
+            before = self._size
+            for cell in list(self._cells):
+                kept = [quote for quote in self._cells[cell] if quote[4] >= cutoff]
+                if kept:
+                    self._cells[cell] = kept
+                else:
+                    del self._cells[cell]
+            self._size = sum(len(quotes) for quotes in self._cells.values())
+            self._memo.clear()
+            return before - self._size
+
+    def estimate(self, pickup_lat, pickup_lng, dest_lat, dest_lng, at=None):
+        """
+        Estimate the ride options of a route from nearby quotes
+
+        Args:
+            pickup_lat, pickup_lng, dest_lat, dest_lng (float): Route
+            at (float): Epoch seconds the estimate is for (default: now)
+
+        Returns:
+            tuple: (response dict shaped like the API's, confidence in [0, 1]);
+                the response is None when no quote is close enough
+        """
+        at = at or time.time()
+        memo_key = (
+            round(pickup_lat, MEMO_DECIMALS), round(pickup_lng, MEMO_DECIMALS),
+            round(dest_lat, MEMO_DECIMALS), round(dest_lng, MEMO_DECIMALS), int(at // MEMO_SECONDS),
+        )
+        memoized = self._memo.get(memo_key)
+        if memoized is not None:
+            return memoized
+        pickup_cells = self._nearby_cells(pickup_lat, pickup_lng)
+        dest_cells = self._nearby_cells(dest_lat, dest_lng)
+        pickup_scale, dest_scale = math.cos(math.radians(pickup_lat)), math.cos(math.radians(dest_lat))
+        per_degree = self._per_degree
+        pickup_y, pickup_x, dest_y, dest_x = (value * per_degree for value in (pickup_lat, pickup_lng, dest_lat, dest_lng))
+        limit = SEARCH_RADII ** 2
+        max_age, half_life = self.max_age, self.half_life
+
+        totals = {}
+        total_weight = 0.0
+        neighbours = 0
+        with self._lock:
+            candidates = [
+                quote
+                for pickup_cell in pickup_cells
+                for dest_cell in dest_cells
+                for quote in self._cells.get(pickup_cell + dest_cell, ())
+            ]
+        for quote_pickup_y, quote_pickup_x, quote_dest_y, quote_dest_x, fetched_at, options in candidates:
+            age = abs(at - fetched_at)
+            if age > max_age:
+                continue
+            # Squared offsets in radii on planes scaled at the query's pickup and destination latitudes
+            offset_x, offset_y = (quote_pickup_x - pickup_x) * pickup_scale, quote_pickup_y - pickup_y
+            pickup_offset = offset_x * offset_x + offset_y * offset_y
+            if pickup_offset > limit:
+                continue
+            offset_x, offset_y = (quote_dest_x - dest_x) * dest_scale, quote_dest_y - dest_y
+            dest_offset = offset_x * offset_x + offset_y * offset_y
+            if dest_offset > limit:
+                continue
+            weight = math.exp(-0.5 * (pickup_offset + dest_offset) - age / half_life)
+            total_weight += weight
+            neighbours += 1
+            for provider, product, service_level, values in options:
+                entry = totals.get((provider, product))
+                if entry is None:
+                    entry = totals[(provider, product)] = [service_level, [0.0] * len(values), [0.0] * len(values), 0.0]
+                _, sums, weights, price_squares = entry
+                for index, value in enumerate(values):
+                    if value is not None:
+                        sums[index] += weight * value
+                        weights[index] += weight
+                if values[0] is not None:
+                    price_squares += weight * values[0] * values[0]
+                entry[3] = price_squares
+
+        if not totals:
+            return self._remember(memo_key, (None, 0.0))
+
+        prices = []
+        spreads = []
+        for (provider, product), (service_level, sums, weights, price_squares) in totals.items():
+            means = [total / weight if weight else None for total, weight in zip(sums, weights)]
+            price_min, price_max, wait_min, wait_max, trip_seconds, distance_meters, surge = means
+            if price_min:
+                variance = max(price_squares / weights[0] - price_min * price_min, 0.0)
+                spreads.append(math.sqrt(variance) / price_min)
+            prices.append({
+                "provider": provider,
+                "product": product,
+                "service_level": service_level,
+                "price_min": round(price_min) if price_min is not None else None,
+                "price_max": round(price_max) if price_max is not None else None,
+                "est_pickup_wait_time": {
+                    "min": round(wait_min) if wait_min is not None else None,
+                    "max": round(wait_max) if wait_max is not None else None,
+                },
+                "est_time_after_pickup_till_dropoff": round(trip_seconds) if trip_seconds is not None else None,
+                "distance_meters": round(distance_meters) if distance_meters is not None else None,
+                "surge_multiplier": round(surge, 2) if surge is not None else None,
+            })
+        prices.sort(key=lambda price: (price["price_min"] is None, price["price_min"] or 0))
+
+        # Saturates with the weight of close, fresh neighbours; halved by a 50% price spread
+        spread = sum(spreads) / len(spreads) if spreads else 0.0
+        confidence = (1.0 - math.exp(-total_weight)) / (1.0 + 2.0 * spread)
+        response = {
+            "search_id": "",
+            "results": [{"prices": prices}],
+            "estimate": {"confidence": round(confidence, 3), "neighbours": neighbours, "weight": round(total_weight, 3)},
+        }
+        return self._remember(memo_key, (response, confidence))
+
+    def _remember(self, key, answer):
+        with self._lock:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = answer
+        return answer
+
+    def get_prices(self, pickup_lat, pickup_lng, dest_lat, dest_lng):
+        """
+        Estimate ride prices, or fetch them live when the estimate is not confident
+
+        Same interface as BellhopAPI.get_prices. Estimated responses carry an
+        "estimate" entry with the confidence and the neighbours used.
+
+        Returns:
+            dict: Estimated or live API response
+        """
+        response, confidence = self.estimate(pickup_lat, pickup_lng, dest_lat, dest_lng)
+        if response is not None and (confidence >= self.min_confidence or self.client is None):
+            with self._lock:
+                self.estimates += 1
+            return response
+        if self.client is None:
+            return None
+        live = self.client.get_prices(pickup_lat, pickup_lng, dest_lat, dest_lng)
+        with self._lock:
+            self.live_calls += 1
+        if live is not None:
+            self.add_response(pickup_lat, pickup_lng, dest_lat, dest_lng, live)
+        return live
+
+    def close(self):
+        """Close the wrapped client"""
+        if self.client is not None:
+            self.client.close()
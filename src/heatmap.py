@@ -0,0 +1,313 @@
+"""
+Adaptive surge heatmap sampling
+
+A city's bounding box (around its LOCATIONS seeds) is covered by a coarse
+lattice of pickup points, each quoted to a fixed reference destination.
+Cells whose corner surge multipliers differ by more than a threshold are
+split into four, most varying first, until the call budget is spent or the
+finest level is reached. Points live on one integer lattice at the finest
+level, so cells share corners and no point is quoted twice.
+
+The result is stored as the quoted lattice points and the leaf cells,
+which is enough to rasterize the map at full resolution.
+
+Usage: python -m src.heatmap nyc --budget 200 --output data/heatmaps/nyc.npz
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from src.quotes import get_price_options
+from src.utils.coordinates import LOCATIONS
+from src.utils.geo import EARTH_RADIUS_METERS
+
+# LOCATIONS keys around which each city's grid is laid out
+CITY_SEEDS = {
+    "nyc": ["times_square", "empire_state", "grand_central", "jfk_airport", "laguardia", "central_park"],
+    "sf": ["sf_ferry_building", "golden_gate", "sfo_airport"],
+    "la": ["lax_airport", "hollywood_sign", "santa_monica_pier"],
+}
+
+# Fixed destination every pickup point of a city is quoted to
+CITY_REFERENCES = {"nyc": "times_square", "sf": "sf_ferry_building", "la": "lax_airport"}
+
+# Margin added around the seeds, in meters
+CITY_PADDING_METERS = 2000.0
+
+# Providers whose surge is recorded per point
+PROVIDERS = ("UBER", "LYFT")
+
+def city_bounds(city, padding=CITY_PADDING_METERS):
+    """
+    Bounding box around a city's seeds
+
+    Returns:
+        tuple: (south, west, north, east) in degrees
+    """
+    seeds = [LOCATIONS[key] for key in CITY_SEEDS[city]]
+    lats, lngs = [seed["lat"] for seed in seeds], [seed["lng"] for seed in seeds]
+    pad_lat = np.degrees(padding / EARTH_RADIUS_METERS)
+    pad_lng = pad_lat / np.cos(np.radians(sum(lats) / len(lats)))
+    return (min(lats) - pad_lat, min(lngs) - pad_lng, max(lats) + pad_lat, max(lngs) + pad_lng)
+
+def response_surge(response):
+    """
+    Highest surge multiplier per provider in a response
+
+    Returns:
+        list: One value per PROVIDERS entry, NaN if the provider has no option
+    """
+    surge = [float("nan")] * len(PROVIDERS)
+    for price in get_price_options(response or {}):
+        if price.get("provider") in PROVIDERS and price.get("surge_multiplier") is not None:
+            index = PROVIDERS.index(price["provider"])
+            surge[index] = max(float(price["surge_multiplier"]), np.nan_to_num(surge[index], nan=0.0))
+    return surge
+
+class SurgeGrid:
+    """
+    Quadtree of surge samples on an integer lattice
+
+    Lattice point (i, j) lies at row i (south to north) and column j (west to
+    east) of a (size + 1) x (size + 1) lattice, size = initial_cells * 2**max_depth.
+    A leaf cell (i, j, span) has its corners at i, i + span, j and j + span.
+    """
+
+    def __init__(self, city, bounds, reference, initial_cells=4, max_depth=4):
+        self.city = city
+        self.bounds = bounds
+        self.reference = reference
+        self.initial_cells = initial_cells
+        self.max_depth = max_depth
+        self.size = initial_cells * 2 ** max_depth
+        self.values = {}
+        span = 2 ** max_depth
+        self.leaves = {(i * span, j * span, span) for i in range(initial_cells) for j in range(initial_cells)}
+
+    @property
+    def calls(self):
+        """Lattice points quoted"""
+        return len(self.values)
+
+    @property
+    def uniform_calls(self):
+        """Points a uniform grid at the finest level would need"""
+        return (self.size + 1) ** 2
+
+    def location(self, point):
+        """Latitude and longitude of a lattice point"""
+        south, west, north, east = self.bounds
+        return south + point[0] / self.size * (north - south), west + point[1] / self.size * (east - west)
+
+    @staticmethod
+    def corners(cell):
+        i, j, span = cell
+        return [(i, j), (i + span, j), (i, j + span), (i + span, j + span)]
+
+    @staticmethod
+    def refinement_points(cell):
+        """Lattice points a split of the cell adds (edge midpoints and center)"""
+        i, j, span = cell
+        half = span // 2
+        return [(i + half, j), (i, j + half), (i + half, j + half), (i + half, j + span), (i + span, j + half)]
+
+    @staticmethod
+    def children(cell):
+        i, j, span = cell
+        half = span // 2
+        return [(i, j, half), (i + half, j, half), (i, j + half, half), (i + half, j + half, half)]
+
+    def highest(self, point, provider=None):
+        """Surge at a lattice point: one provider's, or the highest of all (None if unknown)"""
+        values = self.values.get(point, ())
+        if provider is not None:
+            values = values[PROVIDERS.index(provider):][:1]
+        return max((value for value in values if value == value), default=None)
+
+    def variation(self, cell):
+        """Spread of the surge over the cell's quoted corners (NaN if fewer than two)"""
+        surge = [value for value in (self.highest(corner) for corner in self.corners(cell)) if value is not None]
+        return max(surge) - min(surge) if len(surge) >= 2 else float("nan")
+
+    def split(self, cell):
+        """Replace a leaf with its four children"""
+        self.leaves.remove(cell)
+        self.leaves.update(self.children(cell))
+
+    def rasterize(self, provider=None):
+        """
+        Dense surge map at the finest lattice resolution
+
+        Each leaf is filled by bilinear interpolation of its corners.
+
+        Args:
+            provider (str): Only this provider (default: highest of all providers)
+
+        Returns:
+            numpy.ndarray: (size + 1, size + 1) array, row 0 south, NaN where unknown
+        """
+        raster = np.full((self.size + 1, self.size + 1), np.nan)
+        for cell in self.leaves:
+            i, j, span = cell
+            surge = [self.highest(corner, provider) for corner in self.corners(cell)]
+            south_west, north_west, south_east, north_east = (np.nan if value is None else value for value in surge)
+            t = np.linspace(0.0, 1.0, span + 1)
+            rows, cols = t[:, None], t[None, :]
+            raster[i:i + span + 1, j:j + span + 1] = (
+                south_west * (1 - rows) * (1 - cols) + north_west * rows * (1 - cols)
+                + south_east * (1 - rows) * cols + north_east * rows * cols
+            )
+        return raster
+
+    def save(self, path):
+        """Write the grid as a compact .npz file (uint16 lattice indexes, float16 surge)"""
+        points = sorted(self.values)
+        meta = {
+            "city": self.city, "bounds": self.bounds, "reference": self.reference,
+            "initial_cells": self.initial_cells, "max_depth": self.max_depth, "providers": list(PROVIDERS),
+            "created": datetime.now().isoformat(),
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(
+            path,
+            meta=np.array(json.dumps(meta)),
+            points=np.array(points, dtype=np.uint16).reshape(-1, 2),
+            surge=np.array([self.values[point] for point in points], dtype=np.float16).reshape(-1, len(PROVIDERS)),
+            leaves=np.array(sorted(self.leaves), dtype=np.uint16).reshape(-1, 3),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a grid written by save()"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            grid = cls(meta["city"], tuple(meta["bounds"]), meta["reference"], meta["initial_cells"], meta["max_depth"])
+            grid.values = {
+                (int(i), int(j)): tuple(float(value) for value in surge)
+                for (i, j), surge in zip(data["points"], data["surge"])
+            }
+            grid.leaves = {tuple(int(value) for value in leaf) for leaf in data["leaves"]}
+        return grid
+
+def sample_city(client, city, budget, initial_cells=4, max_depth=4, threshold=0.1, workers=8, bounds=None):
+    """
+    Build a surge map of a city within a call budget
+
+    Args:
+        client (BellhopAPI): Client used for quotes
+        city (str): Key of CITY_SEEDS
+        budget (int): Most API calls made
+        initial_cells (int): Cells per side of the starting grid
+        max_depth (int): Most times a cell is split
+        threshold (float): Surge spread over a cell's corners that triggers a split
+        workers (int): Concurrent API calls; also the cells split per round
+        bounds (tuple): (south, west, north, east) instead of the seed box
+
+    Returns:
+        SurgeGrid: The sampled grid
+
+    Raises:
+        ValueError: If the budget does not cover the starting grid
+    """
+    reference = LOCATIONS[CITY_REFERENCES[city]]
+    grid = SurgeGrid(city, bounds or city_bounds(city), reference, initial_cells, max_depth)
+    span = 2 ** max_depth
+    initial = [(i * span, j * span) for i in range(initial_cells + 1) for j in range(initial_cells + 1)]
+    if len(initial) > budget:
+        raise ValueError(f"A budget of {budget} calls cannot cover the {len(initial)} points of the starting grid")
+
+    def fetch(points):
+        def quote(point):
+            lat, lng = grid.location(point)
+            try:
+                return response_surge(client.get_prices(lat, lng, reference["lat"], reference["lng"]))
+            except Exception as e:
+                print(f"Error fetching ride prices: {e}")
+                return [float("nan")] * len(PROVIDERS)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for point, surge in zip(points, executor.map(quote, points)):
+                grid.values[point] = tuple(surge)
+
+    def push(heap, cell):
+        variation = grid.variation(cell)
+        if cell[2] > 1 and variation > threshold:
+            heapq.heappush(heap, (-variation, cell))
+
+    fetch(initial)
+    heap = []
+    for cell in grid.leaves:
+        push(heap, cell)
+
+    while heap:
+        # Split the most varying cells whose new points still fit the budget
+        cells, new_points, skipped = [], [], []
+        while heap and len(cells) < workers:
+            entry = heapq.heappop(heap)
+            needed = [
+                point for point in grid.refinement_points(entry[1])
+                if point not in grid.values and point not in new_points
+            ]
+            if grid.calls + len(new_points) + len(needed) > budget:
+                skipped.append(entry)
+                continue
+            cells.append(entry[1])
+            new_points.extend(needed)
+        if not cells:
+            break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        fetch(new_points)
+        for cell in cells:
+            grid.split(cell)
+            for child in grid.children(cell):
+                push(heap, child)
+    return grid
+
+def main():
+    """Sample a city surge map from the command line"""
+    parser = argparse.ArgumentParser(description="Adaptive surge heatmap sampling")
+    parser.add_argument("city", choices=sorted(CITY_SEEDS), help="City to map")
+    parser.add_argument("--budget", type=int, default=200, help="Most API calls")
+    parser.add_argument("--initial-cells", type=int, default=4, help="Cells per side of the starting grid")
+    parser.add_argument("--max-depth", type=int, default=4, help="Most splits of a cell")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Surge spread that triggers a split")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent API calls")
+    parser.add_argument("--output", help="Output .npz (default: data/heatmaps/<city>_<timestamp>.npz)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from src.api import BellhopAPI
+    from src.resilience import AdaptiveConcurrencyLimiter
+    load_dotenv()
+    api_key, api_secret = os.environ.get("BELLHOP_API_KEY"), os.environ.get("BELLHOP_API_SECRET")
+    if not api_key or not api_secret:
+        print("Error: API credentials not found in .env file")
+        sys.exit(1)
+
+    limiter = AdaptiveConcurrencyLimiter(initial=args.workers, maximum=args.workers)
+    client = BellhopAPI(api_key=api_key, api_secret=api_secret, limiter=limiter)
+    try:
+        grid = sample_city(
+            client, args.city, args.budget, args.initial_cells, args.max_depth, args.threshold, args.workers
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        client.close()
+
+    output = args.output or os.path.join("data", "heatmaps", f"{args.city}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.npz")
+    grid.save(output)
+    print(
+        f"Sampled {grid.calls} points into {len(grid.leaves)} cells "
+        f"(a uniform grid at this resolution needs {grid.uniform_calls}); saved to {output}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Compact encoding of the ride-option history
+
+Categorical columns are dictionary-encoded, and rows are grouped into
+series (one per route and provider/product/service level). Timestamps and
+integer-cent prices are delta-encoded within each series. The result is a
+handful of small NumPy arrays, so long histories fit in memory for
+analysis and compress well on disk.
+
+Usage: python -m src.history ride_prices.csv data/history.npz
+"""
+import csv
+import sys
+import numpy as np
+
+# Dictionary-encoded string columns
+CATEGORICAL_COLUMNS = ["sample_type", "pickup", "destination", "provider", "product", "service_level", "search_id"]
+
+# Columns identifying a series; rows are sorted by these, then by time
+SERIES_COLUMNS = ["sample_type", "pickup", "destination", "provider", "product", "service_level"]
+
+# Dollar columns stored as delta-encoded integer cents
+PRICE_COLUMNS = ["price_min", "price_max", "price_min_discounted", "price_max_discounted"]
+
+# Integer columns stored as-is, with MISSING for empty values
+INTEGER_COLUMNS = ["wait_min_seconds", "wait_max_seconds", "trip_seconds", "distance_meters"]
+
+# Placeholder for empty integer values
+MISSING = -1
+
+# Column names used by older ride_prices.csv files
+COLUMN_ALIASES = {"price_min_dollars": "price_min", "price_max_dollars": "price_max"}
+
+def delta_encode(values, starts):
+    """
+    Delta-encode values, restarting at every series start
+
+    Args:
+        values (numpy.ndarray): Integer values
+        starts (numpy.ndarray): Index of the first row of every series
+
+    Returns:
+        numpy.ndarray: First value of each series, then differences
+    """
+    deltas = np.empty_like(values)
+    if len(values):
+        deltas[0] = values[0]
+        deltas[1:] = values[1:] - values[:-1]
+        deltas[starts] = values[starts]
+    return deltas
+
+def delta_decode(deltas, starts):
+    """Invert delta_encode with a cumulative sum per series"""
+    if not len(deltas):
+        return deltas.copy()
+    totals = np.cumsum(deltas)
+    lengths = np.diff(np.append(starts, len(deltas)))
+    offsets = totals[starts] - deltas[starts]
+    return totals - np.repeat(offsets, lengths)
+
+def _dictionary_encode(values):
+    """Return (dictionary, codes) for an array of strings"""
+    dictionary, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    dtype = np.uint16 if len(dictionary) <= np.iinfo(np.uint16).max else np.uint32
+    return dictionary, codes.astype(dtype)
+
+def _to_int(values):
+    """Parse integer strings, mapping empty strings to MISSING"""
+    return np.array([int(float(value)) if value not in ("", None) else MISSING for value in values], dtype=np.int32)
+
+def _to_cents(values):
+    """Parse dollar strings to integer cents, treating empty strings as 0"""
+    dollars = np.array([float(value) if value not in ("", None) else 0.0 for value in values])
+    return np.round(dollars * 100).astype(np.int64)
+
+class EncodedHistory:
+    """
+    Encoded ride-option history
+
+    Attributes:
+        dictionaries (dict): Sorted distinct strings per categorical column
+        codes (dict): Dictionary codes per categorical column
+        starts (numpy.ndarray): Index of the first row of every series
+        timestamp_deltas (numpy.ndarray): Delta-encoded epoch seconds
+        price_deltas (dict): Delta-encoded cents per price column
+        integers (dict): Integer columns
+        surge (numpy.ndarray): Surge multipliers
+    """
+
+    def __init__(self, dictionaries, codes, starts, timestamp_deltas, price_deltas, integers, surge):
+        self.dictionaries = dictionaries
+        self.codes = codes
+        self.starts = starts
+        self.timestamp_deltas = timestamp_deltas
+        self.price_deltas = price_deltas
+        self.integers = integers
+        self.surge = surge
+
+    def __len__(self):
+        return len(self.surge)
+
+    @property
+    def nbytes(self):
+        """Size of all arrays in bytes"""
+        arrays = (
+            list(self.dictionaries.values()) + list(self.codes.values()) + list(self.price_deltas.values())
+            + list(self.integers.values()) + [self.starts, self.timestamp_deltas, self.surge]
+        )
+        return sum(array.nbytes for array in arrays)
+
+    def save(self, path):
+        """Write the encoded history to a compressed .npz file"""
+        arrays = {"starts": self.starts, "timestamp_deltas": self.timestamp_deltas, "surge": self.surge}
+        for column in CATEGORICAL_COLUMNS:
+            arrays[f"dictionary_{column}"] = self.dictionaries[column]
+            arrays[f"codes_{column}"] = self.codes[column]
+        for column in PRICE_COLUMNS:
+            arrays[f"price_{column}"] = self.price_deltas[column]
+        for column in INTEGER_COLUMNS:
+            arrays[f"int_{column}"] = self.integers[column]
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read an encoded history written by save()"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                {column: data[f"dictionary_{column}"] for column in CATEGORICAL_COLUMNS},
+                {column: data[f"codes_{column}"] for column in CATEGORICAL_COLUMNS},
+                data["starts"],
+                data["timestamp_deltas"],
+                {column: data[f"price_{column}"] for column in PRICE_COLUMNS},
+                {column: data[f"int_{column}"] for column in INTEGER_COLUMNS},
+                data["surge"],
+            )
+
+def encode_columns(columns):
+    """
+    Encode a history given as columns of CSV strings
+
+    Args:
+        columns (dict): Lists of strings keyed by CSV_FIELDNAMES (missing
+            columns are treated as empty)
+
+    Returns:
+        EncodedHistory: Rows grouped by series and sorted by time
+    """
+    size = len(columns["date"])
+
+    def column(name):
+        return columns.get(name) or [""] * size
+
+    stamps = [f"{date}T{time}" for date, time in zip(columns["date"], columns["time"])]
+    timestamps = np.array(stamps, dtype="datetime64[s]").astype(np.int64)
+
+    dictionaries, codes = {}, {}
+    for name in CATEGORICAL_COLUMNS:
+        dictionaries[name], codes[name] = _dictionary_encode(column(name))
+
+    # Group rows by series, ordered by time within each (stable, so ties keep file order)
+    order = np.lexsort([timestamps] + [codes[name] for name in reversed(SERIES_COLUMNS)])
+    timestamps = timestamps[order]
+    codes = {name: values[order] for name, values in codes.items()}
+    if size:
+        series = np.stack([codes[name].astype(np.int64) for name in SERIES_COLUMNS])
+        changed = np.any(series[:, 1:] != series[:, :-1], axis=0)
+        starts = np.concatenate([[0], np.flatnonzero(changed) + 1]).astype(np.int64)
+    else:
+        starts = np.empty(0, dtype=np.int64)
+
+    price_deltas = {name: delta_encode(_to_cents(column(name))[order], starts).astype(np.int32) for name in PRICE_COLUMNS}
+    integers = {name: _to_int(column(name))[order] for name in INTEGER_COLUMNS}
+    surge = np.array([float(value) if value else 1.0 for value in column("surge_multiplier")])[order]
+
+    return EncodedHistory(dictionaries, codes, starts, delta_encode(timestamps, starts), price_deltas, integers, surge)
+
+def decode_columns(encoded):
+    """
+    Decode to NumPy columns
+
+    Returns:
+        dict: "timestamp" (datetime64[s]), categorical columns as string
+            arrays, price columns in integer cents, integer columns with
+            MISSING for empty values, and "surge_multiplier"
+    """
+    columns = {"timestamp": delta_decode(encoded.timestamp_deltas, encoded.starts).astype("datetime64[s]")}
+    for name in CATEGORICAL_COLUMNS:
+        columns[name] = encoded.dictionaries[name][encoded.codes[name]]
+    for name in PRICE_COLUMNS:
+        columns[name] = delta_decode(encoded.price_deltas[name].astype(np.int64), encoded.starts)
+    columns.update(encoded.integers)
+    columns["surge_multiplier"] = encoded.surge
+    return columns
+
+def iter_rows(encoded):
+    """
+    Decode to ride_prices.csv rows, grouped by series
+
+    Returns:
+        generator: Row dicts keyed by CSV_FIELDNAMES
+    """
+    columns = decode_columns(encoded)
+    timestamps = columns["timestamp"].astype(str)
+    for i in range(len(encoded)):
+        date, time = timestamps[i].split("T")
+        row = {"date": date, "time": time}
+        for name in CATEGORICAL_COLUMNS:
+            row[name] = str(columns[name][i])
+        for name in PRICE_COLUMNS:
+            row[name] = f"{columns[name][i] / 100:.2f}"
+        for name in INTEGER_COLUMNS:
+            value = int(columns[name][i])
+            row[name] = "" if value == MISSING else value
+        row["surge_multiplier"] = float(columns["surge_multiplier"][i])
+        yield row
+
+def read_csv_columns(path):
+    """
+    Read a ride_prices.csv file into columns of strings
+
+    Older files using price_min_dollars/price_max_dollars are accepted.
+
+    Returns:
+        dict: Lists of strings keyed by column name
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = [COLUMN_ALIASES.get(name, name) for name in next(reader, [])]
+        columns = {name: [] for name in header}
+        for values in reader:
+            for name, value in zip(header, values):
+                columns[name].append(value)
+    return columns
+
+def convert_csv(csv_path, output_path):
+    """
+    Encode a ride_prices.csv file and save it as .npz
+
+    Returns:
+        EncodedHistory: The encoded history
+    """
+    encoded = encode_columns(read_csv_columns(csv_path))
+    encoded.save(output_path)
+    return encoded
+
+def main():
+    """Convert a CSV history given on the command line"""
+    if len(sys.argv) != 3:
+        print("Usage: python -m src.history <ride_prices.csv> <output.npz>")
+        sys.exit(1)
+    encoded = convert_csv(sys.argv[1], sys.argv[2])
+    print(f"Encoded {len(encoded)} rows in {len(encoded.starts)} series ({encoded.nbytes} bytes in memory)")
+
+if __name__ == "__main__":
+    main()
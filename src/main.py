@@ -5,101 +5,77 @@ import csv
 import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 import requests
-from google.cloud import storage
 import functions_framework  # Import the functions_framework package
+from src.archive import ContentAddressedArchive
+from src.backends import backend_for_uri, create_backend
+from src.columnar import ColumnarAppender
+from src.metrics import (
+    CYCLE_LATENCY, REGISTRY, STAGE_BYTES, STAGE_LATENCY, PrometheusExporter,
+    export_metrics, record_api_call
+)
+from src.parsing import loads
+from src.quotes import build_csv_rows
+from src.routes import load_routes, parse_shard_spec, partition_routes
+from src.sinks import needs_csv_header
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Sample 1: Prestigious Origin-Destination Pairs
-SAMPLE1_PAIRS = [
-    {"id": 1, "origin_id": 1, "destination_id": 2},
-    {"id": 2, "origin_id": 3, "destination_id": 4},
-    {"id": 3, "origin_id": 5, "destination_id": 6},
-    {"id": 4, "origin_id": 7, "destination_id": 8},
-    {"id": 5, "origin_id": 9, "destination_id": 10},
-    {"id": 6, "origin_id": 11, "destination_id": 12},
-    {"id": 7, "origin_id": 13, "destination_id": 14},
-    {"id": 8, "origin_id": 15, "destination_id": 16},
-    {"id": 9, "origin_id": 17, "destination_id": 18},
-    {"id": 10, "origin_id": 19, "destination_id": 20},
-]
-
-SAMPLE1_PLACES = [
-    {"id": 1, "name": "15 Central Park West", "lat": 40.769000, "lng": -73.981400},
-    {"id": 2, "name": "Goldman Sachs HQ", "lat": 40.714700, "lng": -74.013600},
-    {"id": 3, "name": "Central Park Tower", "lat": 40.765900, "lng": -73.982000},
-    {"id": 4, "name": "JP Morgan HQ", "lat": 40.755600, "lng": -73.977500},
-    {"id": 5, "name": "432 Park Avenue", "lat": 40.761600, "lng": -73.971800},
-    {"id": 6, "name": "CitiGroup HQ", "lat": 40.720600, "lng": -74.012800},
-    {"id": 7, "name": "15 Hudson Yards", "lat": 40.753600, "lng": -74.002200},
-    {"id": 8, "name": "McKinsey (WTC)", "lat": 40.712800, "lng": -74.011900},
-    {"id": 9, "name": "One57 (157 W 57th St)", "lat": 40.765300, "lng": -73.979000},
-    {"id": 10, "name": "BCG (Hudson Yards)", "lat": 40.753600, "lng": -74.002200},
-    {"id": 11, "name": "220 Central Park South", "lat": 40.766700, "lng": -73.980900},
-    {"id": 12, "name": "Google NYC", "lat": 40.740800, "lng": -74.003300},
-    {"id": 13, "name": "Four Seasons Hotel New York", "lat": 40.762600, "lng": -73.969700},
-    {"id": 14, "name": "Skadden Arps", "lat": 40.751700, "lng": -73.997200},
-    {"id": 15, "name": "The Beekman (Thompson Hotel)", "lat": 40.711200, "lng": -74.006600},
-    {"id": 16, "name": "Morgan Stanley HQ", "lat": 40.758300, "lng": -73.968600},
-    {"id": 17, "name": "The St. Regis New York", "lat": 40.761600, "lng": -73.974400},
-    {"id": 18, "name": "AIG", "lat": 40.705600, "lng": -74.009100},
-    {"id": 19, "name": "Four Seasons Hotel New York Downtown", "lat": 40.712600, "lng": -74.009700},
-    {"id": 20, "name": "Bain & Company", "lat": 40.756200, "lng": -73.981100},
-]
-
-# Sample 2: Random Manhattan locations with nearly identical distances
-SAMPLE2_PAIRS = [
-    {"id": 1, "origin_id": 1, "destination_id": 2},
-    {"id": 2, "origin_id": 3, "destination_id": 4},
-    {"id": 3, "origin_id": 5, "destination_id": 6},
-    {"id": 4, "origin_id": 7, "destination_id": 8},
-    {"id": 5, "origin_id": 9, "destination_id": 10},
-    {"id": 6, "origin_id": 11, "destination_id": 12},
-    {"id": 7, "origin_id": 13, "destination_id": 14},
-    {"id": 8, "origin_id": 15, "destination_id": 16},
-    {"id": 9, "origin_id": 17, "destination_id": 18},
-    {"id": 10, "origin_id": 19, "destination_id": 20},
-]
-
-SAMPLE2_PLACES = [
-    {"id": 1, "name": "Random Origin 1", "lat": 40.794705, "lng": -73.971795},
-    {"id": 2, "name": "Random Destination 1", "lat": 40.739203, "lng": -74.000226},
-    {"id": 3, "name": "Random Origin 2", "lat": 40.721926, "lng": -74.003187},
-    {"id": 4, "name": "Random Destination 2", "lat": 40.711705, "lng": -74.007952},
-    {"id": 5, "name": "Random Origin 3", "lat": 40.744180, "lng": -73.998954},
-    {"id": 6, "name": "Random Destination 3", "lat": 40.782621, "lng": -73.954126},
-    {"id": 7, "name": "Random Origin 4", "lat": 40.710470, "lng": -74.007748},
-    {"id": 8, "name": "Random Destination 4", "lat": 40.750068, "lng": -73.991665},
-    {"id": 9, "name": "Random Origin 5", "lat": 40.771169, "lng": -73.957614},
-    {"id": 10, "name": "Random Destination 5", "lat": 40.786449, "lng": -73.976858},
-    {"id": 11, "name": "Random Origin 6", "lat": 40.716300, "lng": -74.004792},
-    {"id": 12, "name": "Random Destination 6", "lat": 40.747133, "lng": -74.000472},
-    {"id": 13, "name": "Random Origin 7", "lat": 40.706267, "lng": -74.012561},
-    {"id": 14, "name": "Random Destination 7", "lat": 40.726520, "lng": -73.996706},
-    {"id": 15, "name": "Random Origin 8", "lat": 40.782064, "lng": -73.956258},
-    {"id": 16, "name": "Random Destination 8", "lat": 40.737330, "lng": -73.998871},
-    {"id": 17, "name": "Random Origin 9", "lat": 40.804611, "lng": -73.954223},
-    {"id": 18, "name": "Random Destination 9", "lat": 40.749035, "lng": -73.989995},
-    {"id": 19, "name": "Random Origin 10", "lat": 40.780999, "lng": -73.946376},
-    {"id": 20, "name": "Random Destination 10", "lat": 40.748841, "lng": -73.993437},
-]
-
-# Cloud Storage bucket name (you'll need to create this bucket)
+# Cloud Storage bucket name (you'll need to create this bucket); STORAGE_BACKEND=local
+# or memory stores objects elsewhere instead (see src/backends.py)
 BUCKET_NAME = "bellhop-ride-data"
 
-def get_place_by_id(sample_places, place_id):
-    """Get a place by its ID"""
-    for place in sample_places:
-        if place['id'] == place_id:
-            return place
-    return None
+# Local backend directory unless STORAGE_ROOT is set; kept apart from the other collectors,
+# whose ride_prices.csv has other columns
+LOCAL_STORAGE_ROOT = "collected/function"
 
-def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng):
-    """Make API call to Bellhop to get ride prices"""
+# Bellhop API endpoint (overridable to point at a local stand-in)
+BELLHOP_API_URL = os.environ.get("BELLHOP_API_URL", "https://api.bellhop.me/api/rich-intelligent-pricing")
+
+# Pause between consecutive API calls, in seconds
+PAIR_DELAY_SECONDS = float(os.environ.get("PAIR_DELAY_SECONDS", "1"))
+
+# Samples collected by this function
+COLLECTED_SAMPLES = ["Sample1", "Sample2"]
+
+# URL of this function; when set, the coordinator fans shards out as HTTP invocations,
+# otherwise it runs them in local worker processes
+COLLECTOR_URL = os.environ.get("COLLECTOR_URL")
+
+# How long the coordinator waits for a single shard invocation
+SHARD_TIMEOUT_SECONDS = int(os.environ.get("SHARD_TIMEOUT_SECONDS", "540"))
+
+# Raw response archive: "raw" writes one JSON object per call, "dedup" stores each
+# distinct body once under its hash plus a pointer per call (see src/archive.py)
+ARCHIVE_MODE = os.environ.get("ARCHIVE_MODE", "raw").lower()
+
+# Optional local columnar history (see src/columnar.py) that collected rows are appended to
+HISTORY_DIR = os.environ.get("HISTORY_DIR")
+
+# Where the local server's query API reads quotes from: a local CSV path,
+# gs://bucket/object or memory://object; unset means only rows collected by this process are served
+QUERY_SOURCE = os.environ.get("QUERY_SOURCE")
+
+# Callables notified with newly collected rows, route by route as they are parsed
+ROW_LISTENERS = []
+
+# Created on first use by get_storage_backend
+_storage_backend = None
+
+def notify_row_listeners(rows):
+    """Pass newly collected rows to every ROW_LISTENERS callable, logging failures"""
+    for listener in ROW_LISTENERS:
+        try:
+            listener(rows)
+        except Exception as e:
+            logger.error(f"Row listener failed: {e}")
+
+def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng, raw=False):
+    """Make API call to Bellhop to get ride prices (raw=True returns the undecoded body)"""
     headers = {
         "accept": "application/json",
         "X-API-KEY": api_key,
@@ -118,94 +94,65 @@ def get_prices(api_key, api_secret, pickup_lat, pickup_lng, dest_lat, dest_lng):
         }
     }
     
-    url = "https://api.bellhop.me/api/rich-intelligent-pricing"
+    url = BELLHOP_API_URL
     
+    started = time.perf_counter()
     try:
         response = requests.post(url, headers=headers, json=payload)
+        record_api_call(time.perf_counter() - started, response.status_code, len(response.content))
         response.raise_for_status()
-        return response.json()
+        if raw:
+            return response.content
+        with STAGE_LATENCY.time(stage="decode"):
+            return loads(response.content)
+    except requests.exceptions.HTTPError as e:
+        logger.error(f"Error fetching ride prices: {e}")
+        return None
     except requests.exceptions.RequestException as e:
+        record_api_call(time.perf_counter() - started, "error")
         logger.error(f"Error fetching ride prices: {e}")
         return None
 
+def get_storage_backend():
+    """Storage backend of this process: BUCKET_NAME in GCS unless STORAGE_BACKEND selects another"""
+    global _storage_backend
+    if _storage_backend is None:
+        _storage_backend = create_backend(bucket_name=BUCKET_NAME, default="gcs", default_root=LOCAL_STORAGE_ROOT)
+    return _storage_backend
+
 def save_results_to_json(data, sample_type, pair_id):
-    """Save API response to a JSON file in Google Cloud Storage"""
+    """Save API response to a JSON object in the storage backend"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"json/data_{sample_type}_pair{pair_id}_{timestamp}.json"
     
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(filename)
+    backend = get_storage_backend()
     
-    blob.upload_from_string(
-        json.dumps(data, indent=2),
-        content_type="application/json"
-    )
+    # Raw responses are archived exactly as received
+    content = data if isinstance(data, bytes) else json.dumps(data, indent=2)
+    with STAGE_LATENCY.time(stage="json_upload"):
+        backend.put(filename, content, content_type="application/json")
+    STAGE_BYTES.inc(len(content), stage="json_upload")
     
-    logger.info(f"JSON data saved to gs://{BUCKET_NAME}/{filename}")
-    return f"gs://{BUCKET_NAME}/{filename}"
+    logger.info(f"JSON data saved to {backend.uri(filename)}")
+    return backend.uri(filename)
 
 def parse_ride_data(data, sample_type, pickup_name, dest_name):
     """Parse API response into CSV-ready rows"""
-    # Get the current time
-    timestamp = datetime.now()
-    date_str = timestamp.strftime("%Y-%m-%d")
-    time_str = timestamp.strftime("%H:%M:%S")
-    
-    # Extract search ID
-    search_id = data.get("search_id", "")
-    
-    # Parse the results
-    results = data.get("results", [])
-    if not results or not results[0].get("prices"):
+    rows = build_csv_rows(data, sample_type, pickup_name, dest_name)
+    if not rows:
         logger.warning("No ride options to save")
         return []
     
-    # Prepare rows for CSV
-    rows = []
-    for price in results[0].get("prices", []):
-        provider = price.get("provider", "")
-        product = price.get("product", "")
-        service_level = price.get("service_level", "")
-        
-        # Price in dollars
-        price_min = price.get("price_min", 0) / 100 if price.get("price_min") is not None else 0
-        price_max = price.get("price_max", 0) / 100 if price.get("price_max") is not None else 0
-        
-        # Wait time in seconds
-        wait_min = price.get("est_pickup_wait_time", {}).get("min", 0)
-        wait_max = price.get("est_pickup_wait_time", {}).get("max", 0)
-        
-        # Trip details
-        trip_seconds = price.get("est_time_after_pickup_till_dropoff", 0)
-        distance_meters = price.get("distance_meters", 0)
-        surge = price.get("surge_multiplier", 1.0)
-        
-        # Create a row
-        row = {
-            "date": date_str,
-            "time": time_str,
-            "search_id": search_id,
-            "sample_type": sample_type,
-            "pickup": pickup_name,
-            "destination": dest_name,
-            "provider": provider,
-            "product": product,
-            "service_level": service_level,
-            "price_min_dollars": f"{price_min:.2f}",
-            "price_max_dollars": f"{price_max:.2f}",
-            "wait_min_seconds": wait_min,
-            "wait_max_seconds": wait_max if wait_max else "",
-            "trip_seconds": trip_seconds,
-            "distance_meters": distance_meters,
-            "surge_multiplier": surge
-        }
-        rows.append(row)
+    # This function's CSV names the prices in dollars and has no discounted columns
+    for row in rows:
+        row["price_min_dollars"] = row.pop("price_min")
+        row["price_max_dollars"] = row.pop("price_max")
+        del row["price_min_discounted"], row["price_max_discounted"]
     
     return rows
 
 def append_to_csv_in_storage(rows):
-    """Append rows to CSV file in Google Cloud Storage"""
+    """Append rows to the CSV object in the storage backend"""
     if not rows:
         return None
     
@@ -219,61 +166,39 @@ def append_to_csv_in_storage(rows):
     ]
     
     csv_filename = "ride_prices.csv"
+    backend = get_storage_backend()
     
-    # Initialize Storage client
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(csv_filename)
-    
-    # Check if file exists
-    file_exists = blob.exists()
-    
-    # Create CSV in memory
-    csv_content = ""
-    
-    if not file_exists:
-        # Create new file with header
-        csv_content += ",".join(fieldnames) + "\n"
-    else:
-        # Download existing content
-        try:
-            existing_content = blob.download_as_text()
-            csv_content = existing_content
-        except Exception as e:
-            logger.error(f"Error downloading existing CSV: {e}")
-            # If error, start fresh
-            csv_content = ",".join(fieldnames) + "\n"
-    
-    # Add new rows
-    for row in rows:
-        # Ensure values are properly escaped and ordered according to fieldnames
-        csv_row = [str(row.get(field, "")) for field in fieldnames]
-        csv_content += ",".join(csv_row) + "\n"
-    
-    # Upload back to storage
+    # Only the new rows are written; the existing CSV is never downloaded
     try:
-        blob.upload_from_string(csv_content, content_type="text/csv")
-        logger.info(f"CSV data appended to gs://{BUCKET_NAME}/{csv_filename}")
-        return f"gs://{BUCKET_NAME}/{csv_filename}"
+        csv_content = ""
+        if needs_csv_header(backend, csv_filename, fieldnames):
+            # Create new file with header
+            csv_content += ",".join(fieldnames) + "\n"
+        
+        # Add new rows
+        for row in rows:
+            # Ensure values are properly escaped and ordered according to fieldnames
+            csv_row = [str(row.get(field, "")) for field in fieldnames]
+            csv_content += ",".join(csv_row) + "\n"
+        
+        # Append to storage
+        with STAGE_LATENCY.time(stage="csv_upload"):
+            backend.append(csv_filename, csv_content, content_type="text/csv")
+        STAGE_BYTES.inc(len(csv_content), stage="csv_upload")
+        logger.info(f"CSV data appended to {backend.uri(csv_filename)}")
+        return backend.uri(csv_filename)
     except Exception as e:
         logger.error(f"Error appending to CSV: {e}")
         return None
 
-def process_pair(api_key, api_secret, sample_type, pair, places):
-    """Process a single origin-destination pair"""
-    origin_id = pair["origin_id"]
-    dest_id = pair["destination_id"]
-    
-    # Get origin and destination place details
-    origin = get_place_by_id(places, origin_id)
-    destination = get_place_by_id(places, dest_id)
-    
-    if not origin or not destination:
-        logger.error(f"Invalid place IDs: origin_id={origin_id}, dest_id={dest_id}")
-        return None
+def process_route(api_key, api_secret, route, archive=None):
+    """Process a single origin-destination route, archiving to `archive` if given"""
+    origin = route["origin"]
+    destination = route["destination"]
+    sample_type = route["sample_type"]
     
     # Log collection attempt
-    logger.info(f"Collecting {sample_type} - Pair {pair['id']}: {origin['name']} to {destination['name']}")
+    logger.info(f"Collecting {sample_type} - Pair {route['pair_id']}: {origin['name']} to {destination['name']}")
     
     # Get price data
     response = get_prices(
@@ -282,26 +207,121 @@ def process_pair(api_key, api_secret, sample_type, pair, places):
         origin["lat"],
         origin["lng"],
         destination["lat"],
-        destination["lng"]
+        destination["lng"],
+        raw=True
     )
     
     if not response:
-        logger.error(f"Failed to collect data for {sample_type} - Pair {pair['id']}")
+        logger.error(f"Failed to collect data for {sample_type} - Pair {route['pair_id']}")
         return None
     
     # Save results to JSON
-    save_results_to_json(response, sample_type, pair['id'])
+    if archive is not None:
+        archive.put(response, sample_type, route['pair_id'], route['route_id'])
+    else:
+        save_results_to_json(response, sample_type, route['pair_id'])
     
     # Parse and prepare for CSV
-    rows = parse_ride_data(response, sample_type, origin['name'], destination['name'])
+    with STAGE_LATENCY.time(stage="parse"):
+        rows = parse_ride_data(response, sample_type, origin['name'], destination['name'])
     
     return rows
 
+def collect_routes(api_key, api_secret, routes):
+    """Collect every route in order and return the parsed CSV rows"""
+    archive = None
+    if ARCHIVE_MODE == "dedup":
+        archive = ContentAddressedArchive(get_storage_backend())
+    
+    all_csv_rows = []
+    for i, route in enumerate(routes):
+        # Write the pointers of each finished sample, so a timeout doesn't orphan its archived bodies
+        if archive is not None and i > 0 and route["sample_type"] != routes[i - 1]["sample_type"]:
+            archive.flush()
+        rows = process_route(api_key, api_secret, route, archive)
+        if rows:
+            all_csv_rows.extend(rows)
+            notify_row_listeners(rows)
+        time.sleep(PAIR_DELAY_SECONDS)  # Small delay between calls
+    
+    if archive is not None:
+        archive.flush()
+    return all_csv_rows
+
+def collect_shard(api_key, api_secret, shard_index, shard_count):
+    """Collect the routes assigned to one shard of the registry"""
+    routes = partition_routes(load_routes(COLLECTED_SAMPLES), shard_index, shard_count)
+    logger.info(f"Collecting shard {shard_index}/{shard_count} with {len(routes)} routes")
+    return collect_routes(api_key, api_secret, routes)
+
+def invoke_shard(shard_index, shard_count):
+    """Run one shard as a separate HTTP invocation of this function"""
+    response = requests.post(
+        COLLECTOR_URL,
+        params={"shard": f"{shard_index}/{shard_count}"},
+        timeout=SHARD_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+    return response.json()["rows"]
+
+def merge_shard_rows(shard_results):
+    """
+    Assemble per-shard outputs into a single list of CSV rows
+    
+    Args:
+        shard_results (list): Row lists indexed by shard
+    
+    Returns:
+        list: All rows in collection-time order
+    """
+    merged = [row for rows in shard_results for row in rows]
+    merged.sort(key=lambda row: (row["date"], row["time"]))
+    return merged
+
+def fan_out_shards(api_key, api_secret, shard_count):
+    """
+    Collect the registry as `shard_count` shards running concurrently
+    
+    Shards are sent to COLLECTOR_URL as separate invocations when it is set,
+    otherwise they run in local worker processes. A failed shard is logged and
+    contributes no rows so the rest of the cycle is still stored.
+    
+    Returns:
+        list: Merged CSV rows from every shard
+    """
+    if COLLECTOR_URL:
+        executor = ThreadPoolExecutor(max_workers=shard_count)
+        futures = {executor.submit(invoke_shard, i, shard_count): i for i in range(shard_count)}
+    else:
+        executor = ProcessPoolExecutor(max_workers=shard_count)
+        futures = {
+            executor.submit(collect_shard, api_key, api_secret, i, shard_count): i
+            for i in range(shard_count)
+        }
+    
+    shard_results = [[] for _ in range(shard_count)]
+    with executor:
+        for future in as_completed(futures):
+            shard_index = futures[future]
+            try:
+                shard_results[shard_index] = future.result()
+                logger.info(f"Shard {shard_index}/{shard_count} returned {len(shard_results[shard_index])} rows")
+            except Exception as e:
+                logger.error(f"Shard {shard_index}/{shard_count} failed: {e}")
+    
+    return merge_shard_rows(shard_results)
+
 # Use the functions_framework decorator to specify HTTP trigger
 @functions_framework.http
 def collect_bellhop_data(request):
     """
     Cloud Function entry point triggered by HTTP request or Cloud Scheduler
+    
+    Query parameters:
+        shard: "i/n" collects only shard i of n and returns its rows as JSON
+            without touching the CSV, for use by a coordinator
+        shards: n runs as coordinator, fanning the registry out over n shards
+            and appending the merged rows to the CSV once
     """
     start_time = datetime.now()
     logger.info(f"Starting data collection cycle at {start_time}")
@@ -315,28 +335,43 @@ def collect_bellhop_data(request):
         logger.error(error_msg)
         return error_msg, 500
     
-    all_csv_rows = []
-    
-    # Process Sample 1 - Prestigious routes
-    for pair in SAMPLE1_PAIRS:
-        rows = process_pair(api_key, api_secret, "Sample1", pair, SAMPLE1_PLACES)
-        if rows:
-            all_csv_rows.extend(rows)
-        time.sleep(1)  # Small delay between calls
+    args = request.args if request is not None else {}
     
-    # Process Sample 2 - Random routes with similar distances
-    for pair in SAMPLE2_PAIRS:
-        rows = process_pair(api_key, api_secret, "Sample2", pair, SAMPLE2_PLACES)
-        if rows:
-            all_csv_rows.extend(rows)
-        time.sleep(1)  # Small delay between calls
+    try:
+        if args.get("shard"):
+            shard_index, shard_count = parse_shard_spec(args.get("shard"))
+        else:
+            shard_count = int(args.get("shards", 1))
+            if shard_count < 1:
+                raise ValueError("shards must be at least 1")
+    except ValueError as e:
+        return f"Error: {e}", 400
+    
+    if args.get("shard"):
+        # Shard worker: return rows for the coordinator to merge
+        rows = collect_shard(api_key, api_secret, shard_index, shard_count)
+        duration = (datetime.now() - start_time).total_seconds()
+        logger.info(f"Completed shard {shard_index}/{shard_count} in {duration:.2f} seconds")
+        return {"shard": args.get("shard"), "rows": rows}, 200
+    
+    if shard_count > 1:
+        all_csv_rows = fan_out_shards(api_key, api_secret, shard_count)
+        # Shards collect in other processes, so their rows are only seen here
+        if all_csv_rows:
+            notify_row_listeners(all_csv_rows)
+    else:
+        all_csv_rows = collect_routes(api_key, api_secret, load_routes(COLLECTED_SAMPLES))
     
     # Append all data to CSV
     if all_csv_rows:
         append_to_csv_in_storage(all_csv_rows)
+        if HISTORY_DIR:
+            ColumnarAppender(HISTORY_DIR).append(all_csv_rows)
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
+    CYCLE_LATENCY.observe(duration)
+    export_metrics()
     logger.info(f"Completed data collection cycle in {duration:.2f} seconds")
     
     return f"Successfully collected data for {len(all_csv_rows)} ride options", 200
@@ -346,13 +381,43 @@ if __name__ == "__main__":
     # This code block only runs when executing the file directly
     # It won't run when deployed to Cloud Functions
     from flask import Flask, request as flask_request
+    from src.query import CsvTail, QuoteIndex, register_query_routes
+    from src.api import BellhopAPI
+    from src.compare import QuoteCache, register_compare_route
+    from src.stream import QuoteBroadcaster, register_stream_route
     
     app = Flask(__name__)
     
+    # Serve read endpoints from an index fed by QUERY_SOURCE, or by this process's collections
+    quote_index = QuoteIndex()
+    quote_tail = None
+    if QUERY_SOURCE:
+        query_backend, query_name = backend_for_uri(QUERY_SOURCE)
+        quote_tail = CsvTail(quote_index, query_name, query_backend)
+    else:
+        ROW_LISTENERS.append(quote_index.add_rows)
+    if quote_tail is not None:
+        quote_tail.refresh(force=True)
+    register_query_routes(app, quote_index, quote_tail)
+    
+    # Stream quotes collected by this process as server-sent events
+    quote_broadcaster = QuoteBroadcaster()
+    ROW_LISTENERS.append(quote_broadcaster.publish)
+    register_stream_route(app, quote_broadcaster)
+    
+    # Bulk comparisons, answered from a shared cache where quotes are fresh enough
+    compare_client = BellhopAPI(os.environ.get("BELLHOP_API_KEY"), os.environ.get("BELLHOP_API_SECRET"))
+    register_compare_route(app, compare_client, QuoteCache())
+    
     @app.route("/", methods=["GET", "POST"])
     def index():
         return collect_bellhop_data(flask_request)
     
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        body = PrometheusExporter().render(REGISTRY)
+        return body, 200, {"Content-Type": "text/plain; version=0.0.4"}
+    
     if os.environ.get("PORT"):
         port = int(os.environ.get("PORT"))
     else:
@@ -0,0 +1,232 @@
+"""
+Lightweight metrics for the collectors
+
+Counters and histograms keyed by label values, with exporters that append
+snapshots as JSON lines or render the Prometheus text format.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _label_key(labels):
+    """Turn a label dict into a hashable, ordered key"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class Counter:
+    """Monotonically increasing count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add `amount` to the series identified by `labels`"""
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """Return (labels, value) pairs for every series"""
+        with self._lock:
+            return [(dict(key), value) for key, value in self.values.items()]
+
+class Histogram:
+    """Bucketed distribution of observations per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one observation in the series identified by `labels`"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """Return (labels, snapshot) pairs for every series"""
+        with self._lock:
+            return [
+                (dict(key), {"counts": list(series["counts"]), "sum": series["sum"], "count": series["count"]})
+                for key, series in self.values.items()
+            ]
+
+class MetricsRegistry:
+    """Named collection of metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, description, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, description, **kwargs)
+            return metric
+
+    def counter(self, name, description):
+        """Get or create a counter"""
+        return self._get_or_create(Counter, name, description)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        """Get or create a histogram"""
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def reset(self):
+        """Clear recorded values, keeping the metrics registered"""
+        with self._lock:
+            for metric in self.metrics.values():
+                with metric._lock:
+                    metric.values = {}
+
+class JsonLinesExporter:
+    """Appends a snapshot of every series to a file as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, registry):
+        """Append the current value of every series"""
+        timestamp = time.time()
+        lines = []
+        for metric in list(registry.metrics.values()):
+            for labels, value in metric.samples():
+                record = {"timestamp": timestamp, "name": metric.name, "type": metric.kind, "labels": labels}
+                if metric.kind == "histogram":
+                    record.update(value)
+                    record["buckets"] = list(metric.buckets)
+                else:
+                    record["value"] = value
+                lines.append(json.dumps(record))
+        if not lines:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write("\n".join(lines) + "\n")
+
+class PrometheusExporter:
+    """Renders the Prometheus text exposition format for scraping"""
+
+    def export(self, registry):
+        """Nothing to push; values are rendered when scraped"""
+
+    def render(self, registry):
+        """
+        Render every series in the Prometheus text format
+
+        Returns:
+            str: Exposition text
+        """
+        lines = []
+        for metric in list(registry.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.samples():
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    """Format labels as {name="value",...}"""
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+# Process-wide registry used by the collectors
+REGISTRY = MetricsRegistry()
+
+API_LATENCY = REGISTRY.histogram("bellhop_api_request_seconds", "Bellhop API call latency by HTTP status")
+API_REQUESTS = REGISTRY.counter("bellhop_api_requests_total", "Bellhop API calls by HTTP status")
+API_RETRIES = REGISTRY.counter("bellhop_api_retries_total", "Bellhop API retries by reason")
+API_HEDGES = REGISTRY.counter("bellhop_api_hedges_total", "Hedged Bellhop API calls by outcome (issued, won)")
+API_ATTEMPTS = REGISTRY.histogram(
+    "bellhop_api_attempts", "Attempts needed per Bellhop API call",
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10)
+)
+STAGE_LATENCY = REGISTRY.histogram("collector_stage_seconds", "Time spent per collection stage")
+STAGE_BYTES = REGISTRY.counter("collector_bytes_total", "Bytes transferred per collection stage")
+CYCLE_LATENCY = REGISTRY.histogram(
+    "collector_cycle_seconds", "Duration of a full collection cycle",
+    buckets=(30.0, 60.0, 120.0, 300.0, 600.0, 900.0, 1200.0, 1800.0, 3600.0)
+)
+
+def record_api_call(seconds, status, response_bytes=0):
+    """
+    Record one HTTP attempt against the Bellhop API
+
+    Args:
+        seconds (float): Attempt latency
+        status (int or str): HTTP status code, or "error" if no response arrived
+        response_bytes (int): Size of the response body
+    """
+    API_LATENCY.observe(seconds, status=status)
+    API_REQUESTS.inc(status=status)
+    if response_bytes:
+        STAGE_BYTES.inc(response_bytes, stage="fetch")
+
+def get_exporter():
+    """
+    Build the exporter selected by the METRICS_EXPORTER environment variable
+
+    "jsonl" appends to METRICS_FILE (default metrics.jsonl), "prometheus"
+    serves values on scrape; anything else disables exporting.
+
+    Returns:
+        object: Exporter with an export(registry) method, or None
+    """
+    exporter = os.environ.get("METRICS_EXPORTER", "").lower()
+    if exporter == "jsonl":
+        return JsonLinesExporter(os.environ.get("METRICS_FILE", "metrics.jsonl"))
+    if exporter == "prometheus":
+        return PrometheusExporter()
+    return None
+
+def export_metrics(registry=REGISTRY):
+    """Export the registry through the configured exporter, if any"""
+    exporter = get_exporter()
+    if exporter is not None:
+        exporter.export(registry)
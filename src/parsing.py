@@ -0,0 +1,125 @@
+"""
+JSON decoding helpers for Bellhop responses
+
+Uses orjson for whole-document decoding and ijson for incremental parsing
+when they are installed, falling back to the standard library otherwise.
+Responses are decoded whole unless they exceed STREAM_THRESHOLD_BYTES.
+"""
+import io
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Raw responses at least this large are parsed incrementally; smaller ones are
+# decoded whole, which costs far less CPU per price option
+STREAM_THRESHOLD_BYTES = int(os.environ.get("STREAM_THRESHOLD_BYTES", str(1 << 20)))
+
+def loads(raw):
+    """
+    Decode a JSON document
+
+    Args:
+        raw (bytes or str): JSON text
+
+    Returns:
+        object: Decoded value
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def dumps(data):
+    """
+    Encode a value as compact JSON text
+
+    Args:
+        data (object): Value to encode
+
+    Returns:
+        str: JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data)
+
+def should_stream(raw):
+    """Whether a raw response should be parsed with PriceStream rather than loads()"""
+    return hasattr(raw, "read") or len(raw) >= STREAM_THRESHOLD_BYTES
+
+def as_text(raw):
+    """Return raw JSON bytes as text without re-serializing"""
+    if isinstance(raw, bytes):
+        return raw.decode("utf-8")
+    return raw
+
+class PriceStream:
+    """
+    Iterate over the price options of a raw response as they are decoded
+
+    Yields (result_index, price) tuples. Only one price option is held in
+    memory at a time when ijson is available. Top-level scalars such as
+    search_id may appear after the results in the document, so they are
+    available as attributes once iteration has finished.
+    """
+
+    def __init__(self, raw):
+        """
+        Initialize the stream
+
+        Args:
+            raw (bytes, str or file): Raw JSON response
+        """
+        self.raw = raw
+        self.search_id = None
+        self.timestamp = None
+        self.result_count = 0
+
+    def __iter__(self):
+        if ijson is None:
+            return self._iter_decoded()
+        return self._iter_events()
+
+    def _iter_decoded(self):
+        """Fallback: decode the whole document, then walk it"""
+        raw = self.raw.read() if hasattr(self.raw, "read") else self.raw
+        data = loads(raw)
+        self.search_id = data.get("search_id")
+        self.timestamp = data.get("timestamp")
+        for result_index, result in enumerate(data.get("results", [])):
+            self.result_count += 1
+            for price in result.get("prices") or []:
+                yield result_index, price
+
+    def _iter_events(self):
+        """Build one price option at a time from parser events"""
+        source = self.raw
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+
+        builder = None
+        for prefix, event, value in ijson.parse(source, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == "results.item.prices.item" and event == "end_map":
+                    yield self.result_count - 1, builder.value
+                    builder = None
+            elif prefix == "results.item.prices.item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == "results.item" and event == "start_map":
+                self.result_count += 1
+            elif prefix == "search_id":
+                self.search_id = value
+            elif prefix == "timestamp":
+                self.timestamp = value
@@ -0,0 +1,419 @@
+"""
+Matched-pair location premium analysis
+
+Quotes of treatment routes (Sample1, prestigious places) are aligned with
+quotes of their matched control routes (Sample2, similar distances, or
+generated controls with matched_route_id) from the same collection cycle
+and for the same provider/product. The premium of each aligned pair is
+treatment price / control price - 1; per product, the premiums form a
+distribution summarized with a bootstrap confidence interval of the mean.
+
+Aligned premiums are kept in a state file together with how far the input
+was read, so re-runs only align rows collected since. The last cycle may
+still be incomplete, so its rows are kept in the state and aligned again
+with the next run's rows. Inputs are a
+ride_prices.csv file or a columnar history directory (src/columnar.py).
+
+Usage: python -m src.premium data/ride_prices.csv --state data/premium_state.npz
+"""
+import argparse
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.routes import load_routes
+
+# Quotes less than this many seconds apart belong to the same collection cycle
+CYCLE_GAP_SECONDS = 600
+
+# Resamples drawn per vectorized bootstrap block, times the sample size
+BOOTSTRAP_BLOCK_VALUES = 2_000_000
+
+# Column names used by older ride_prices.csv files
+COLUMN_ALIASES = {"price_min_dollars": "price_min", "price_max_dollars": "price_max"}
+
+# Row fields kept in the state for the still-open last cycle
+PENDING_FIELDS = ("date", "time", "pickup", "destination", "provider", "product",
+                  "price_min", "price_max", "price_min_dollars", "price_max_dollars")
+
+def match_routes(routes, treatment="Sample1", control="Sample2"):
+    """
+    Map control routes to their treatment routes
+
+    A control route with matched_route_id is matched to that route;
+    otherwise control pair N is matched to treatment pair N.
+
+    Args:
+        routes (list): Route registry
+        treatment (str): Treatment sample type
+        control (str): Control sample type
+
+    Returns:
+        tuple: ({(pickup, destination): (pair index, is_treatment)}, list of treatment route_ids)
+    """
+    treatment_routes = [route for route in routes if route["sample_type"] == treatment]
+    pair_index = {route["route_id"]: i for i, route in enumerate(treatment_routes)}
+    by_pair_id = {route["pair_id"]: route["route_id"] for route in treatment_routes}
+
+    lookup = {}
+    for route in treatment_routes:
+        lookup[(route["origin"]["name"], route["destination"]["name"])] = (pair_index[route["route_id"]], True)
+    for route in routes:
+        if route["sample_type"] != control:
+            continue
+        matched = route.get("matched_route_id") or by_pair_id.get(route["pair_id"])
+        if matched in pair_index:
+            lookup[(route["origin"]["name"], route["destination"]["name"])] = (pair_index[matched], False)
+    return lookup, [route["route_id"] for route in treatment_routes]
+
+class PremiumState:
+    """
+    Aligned premiums accumulated across runs
+
+    Attributes:
+        products (list): "provider|product" names; codes index into it
+        cycle (numpy.ndarray): Cycle start (first quote), epoch seconds
+        pair (numpy.ndarray): Treatment route index
+        product (numpy.ndarray): Product code
+        treatment_price (numpy.ndarray): Treatment price in dollars
+        control_price (numpy.ndarray): Control price in dollars
+        position (int): Bytes (CSV) or rows (columnar) of input already read
+        header (list): CSV header of the input
+        summaries (dict): Last summary per product, reused while its pairs are unchanged
+        pending (list): Matched rows of the last cycle, aligned again on the next run
+        provisional (int): Trailing aligned pairs that came from the pending rows
+    """
+
+    ARRAYS = ("cycle", "pair", "product", "treatment_price", "control_price")
+
+    def __init__(self):
+        self.products = []
+        self.cycle = np.empty(0, dtype=np.int64)
+        self.pair = np.empty(0, dtype=np.int32)
+        self.product = np.empty(0, dtype=np.int32)
+        self.treatment_price = np.empty(0)
+        self.control_price = np.empty(0)
+        self.position = 0
+        self.header = None
+        self.summaries = {}
+        self.pending = []
+        self.provisional = 0
+
+    def __len__(self):
+        return len(self.cycle)
+
+    @property
+    def premium(self):
+        """Relative premium of every aligned pair"""
+        return self.treatment_price / self.control_price - 1.0
+
+    def extend(self, cycle, pair, product, treatment_price, control_price):
+        """Append aligned observations"""
+        self.cycle = np.concatenate([self.cycle, cycle])
+        self.pair = np.concatenate([self.pair, pair.astype(np.int32)])
+        self.product = np.concatenate([self.product, product.astype(np.int32)])
+        self.treatment_price = np.concatenate([self.treatment_price, treatment_price])
+        self.control_price = np.concatenate([self.control_price, control_price])
+
+    def reopen_last_cycle(self):
+        """
+        Remove the provisional pairs of the last cycle
+
+        Returns:
+            list: Pending rows to align again with new rows
+        """
+        if self.provisional:
+            keep = len(self) - self.provisional
+            for code in np.unique(self.product[keep:]):
+                self.summaries.pop(self.products[code], None)
+            for name in self.ARRAYS:
+                setattr(self, name, getattr(self, name)[:keep])
+        pending, self.pending, self.provisional = self.pending, [], 0
+        return pending
+
+    def save(self, path):
+        """Write the state to an .npz file"""
+        meta = {
+            "products": self.products, "position": self.position, "header": self.header,
+            "summaries": self.summaries, "pending": self.pending, "provisional": self.provisional
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **{name: getattr(self, name) for name in self.ARRAYS})
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by save(), or return an empty one if there is none"""
+        state = cls()
+        if path is None or not os.path.isfile(path):
+            return state
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            for name in cls.ARRAYS:
+                setattr(state, name, data[name])
+        state.products = meta["products"]
+        state.position = meta["position"]
+        state.header = meta["header"]
+        state.summaries = meta.get("summaries", {})
+        state.pending = meta.get("pending", [])
+        state.provisional = meta.get("provisional", 0)
+        return state
+
+def cycle_starts(timestamps, gap_seconds=CYCLE_GAP_SECONDS):
+    """
+    Label timestamps with the start of their collection cycle
+
+    Sorted timestamps more than gap_seconds apart start a new cycle.
+
+    Args:
+        timestamps (numpy.ndarray): Epoch seconds
+
+    Returns:
+        numpy.ndarray: Cycle start per timestamp
+    """
+    unique = np.unique(timestamps)
+    is_start = np.diff(unique, prepend=unique[0] - gap_seconds - 1) > gap_seconds
+    starts = unique[is_start]
+    return starts[np.searchsorted(starts, timestamps, side="right") - 1]
+
+def align(rows, lookup, state, price_column="price_min", gap_seconds=CYCLE_GAP_SECONDS):
+    """
+    Align treatment and control quotes and add them to the state
+
+    Collectors append a cycle in several writes, so the last cycle of a run
+    may be incomplete. Its pairs are added provisionally and its rows kept
+    as state.pending; the next call removes those pairs and aligns the
+    pending rows together with its new rows. When the same product appears
+    more than once in a response, its lowest price is used.
+
+    Args:
+        rows (list): New ride_prices.csv rows
+        lookup (dict): From match_routes()
+        state (PremiumState): State to extend
+        price_column (str): "price_min" or "price_max"
+        gap_seconds (int): Gap separating collection cycles
+
+    Returns:
+        int: Aligned pairs added
+    """
+    before = len(state)
+    rows = state.reopen_last_cycle() + list(rows)
+    legacy_column = {alias: name for name, alias in COLUMN_ALIASES.items()}[price_column]
+    matched = []
+    for row in rows:
+        match = lookup.get((row["pickup"], row["destination"]))
+        value = row.get(price_column, row.get(legacy_column))
+        if match is not None and value not in ("", None):
+            matched.append((row, match, value))
+    if not matched:
+        return len(state) - before
+
+    stamps = np.array([f"{row['date']}T{row['time']}" for row, _, _ in matched], dtype="datetime64[s]")
+    cycles = cycle_starts(stamps.astype(np.int64), gap_seconds)
+    codes = {name: i for i, name in enumerate(state.products)}
+    product = np.array([codes.setdefault(f"{row['provider']}|{row['product']}", len(codes)) for row, _, _ in matched])
+    state.products = list(codes)
+    pair = np.array([match[0] for _, match, _ in matched])
+    is_treatment = np.array([match[1] for _, match, _ in matched])
+    price = np.array([float(value) for _, _, value in matched])
+
+    # One integer key per (cycle, pair, product)
+    cycle_values, cycle_index = np.unique(cycles, return_inverse=True)
+    n_pairs, n_products = int(pair.max()) + 1, len(codes)
+    keys = (cycle_index * n_pairs + pair) * n_products + product
+
+    def lowest_price(mask):
+        group_keys, inverse = np.unique(keys[mask], return_inverse=True)
+        lowest = np.full(len(group_keys), np.inf)
+        np.minimum.at(lowest, inverse, price[mask])
+        return group_keys, lowest
+
+    treatment_keys, treatment_price = lowest_price(is_treatment & (price > 0))
+    control_keys, control_price = lowest_price(~is_treatment & (price > 0))
+    common, treatment_index, control_index = np.intersect1d(treatment_keys, control_keys, return_indices=True)
+
+    state.extend(
+        cycle_values[common // (n_pairs * n_products)],
+        common // n_products % n_pairs,
+        common % n_products,
+        treatment_price[treatment_index],
+        control_price[control_index],
+    )
+
+    # Keys sort by cycle first, so the last cycle's pairs are the trailing ones
+    last_cycle = len(cycle_values) - 1
+    state.provisional = int(np.count_nonzero(common // (n_pairs * n_products) == last_cycle))
+    state.pending = [
+        {name: row[name] for name in PENDING_FIELDS if name in row}
+        for (row, _, _), index in zip(matched, cycle_index) if index == last_cycle
+    ]
+    return len(state) - before
+
+def read_new_rows(path, state):
+    """
+    Read rows appended to the input since the last run
+
+    Args:
+        path (str): ride_prices.csv file or columnar history directory
+        state (PremiumState): Position is read and advanced
+
+    Returns:
+        list: Row dicts
+    """
+    if os.path.isdir(path):
+        from src.columnar import ColumnarHistory
+        history = ColumnarHistory(path)
+        start = state.position if state.position <= len(history) else 0
+        rows = []
+        if start < len(history):
+            columns = {
+                name: history.string_column(name)[start:].tolist()
+                for name in ("pickup", "destination", "provider", "product")
+            }
+            stamps = history.column("timestamp")[start:].astype("datetime64[s]").astype(str).tolist()
+            columns["date"] = [stamp[:10] for stamp in stamps]
+            columns["time"] = [stamp[11:] for stamp in stamps]
+            for name in ("price_min", "price_max"):
+                columns[name] = (history.column(name)[start:] / 100).tolist()
+            rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        state.position = len(history)
+        return rows
+
+    size = os.path.getsize(path)
+    if size < state.position:
+        raise ValueError(f"{path} shrank since the last run; delete the state file to start over")
+    with open(path, 'rb') as f:
+        f.seek(state.position)
+        data = f.read()
+    complete = data.rfind(b"\n") + 1
+    state.position += complete
+    lines = io.StringIO(data[:complete].decode("utf-8"), newline='')
+    if state.header is None:
+        state.header = next(csv.reader(lines), None)
+    return list(csv.DictReader(lines, fieldnames=state.header)) if state.header else []
+
+def bootstrap_mean_ci(values, resamples=2000, confidence=0.95, seed=0):
+    """
+    Percentile bootstrap confidence interval of the mean
+
+    Resample means are computed in blocks of index matrices, so memory
+    stays bounded for large samples.
+
+    Returns:
+        tuple: (low, high)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return (float("nan"), float("nan"))
+    rng = np.random.default_rng(seed)
+    means = np.empty(resamples)
+    block = max(1, BOOTSTRAP_BLOCK_VALUES // len(values))
+    for start in range(0, resamples, block):
+        stop = min(start + block, resamples)
+        means[start:stop] = values[rng.integers(0, len(values), size=(stop - start, len(values)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def _summarize(args):
+    """Summary of one product's premiums (runs in a worker process)"""
+    name, premiums, differences, resamples, confidence, seed = args
+    low, high = bootstrap_mean_ci(premiums, resamples, confidence, seed)
+    return {
+        "product": name,
+        "pairs": int(len(premiums)),
+        "mean_premium": float(premiums.mean()),
+        "median_premium": float(np.median(premiums)),
+        "ci_low": low,
+        "ci_high": high,
+        "percentiles": {str(q): float(np.percentile(premiums, q)) for q in (10, 25, 75, 90)},
+        "mean_difference_dollars": float(differences.mean()),
+    }
+
+def summarize(state, resamples=2000, confidence=0.95, workers=None, min_pairs=2, seed=0):
+    """
+    Premium distribution per product
+
+    Bootstraps run in a process pool, one product per task. Products whose
+    aligned pairs did not change since the summary kept in the state reuse
+    it, so re-runs only bootstrap products with new cycles.
+
+    Args:
+        state (PremiumState): Aligned premiums
+        resamples (int): Bootstrap resamples
+        confidence (float): Confidence level of the interval
+        workers (int): Worker processes (default: CPU count; 1 runs inline)
+        min_pairs (int): Skip products with fewer aligned pairs
+        seed (int): Random seed
+
+    Returns:
+        list: Summary dicts sorted by mean premium, highest first
+    """
+    premiums, differences = state.premium, state.treatment_price - state.control_price
+    order = np.argsort(state.product, kind="stable")
+    boundaries = np.flatnonzero(np.diff(state.product[order])) + 1
+    settings = {"resamples": resamples, "confidence": confidence, "seed": seed}
+    summaries, tasks = [], []
+    for indexes in np.split(order, boundaries) if len(order) else []:
+        if len(indexes) < min_pairs:
+            continue
+        name = state.products[state.product[indexes[0]]]
+        cached = state.summaries.get(name)
+        if cached is not None and cached["pairs"] == len(indexes) and cached["settings"] == settings:
+            summaries.append(cached)
+        else:
+            tasks.append((name, premiums[indexes], differences[indexes], resamples, confidence, seed))
+
+    if workers == 1 or len(tasks) < 2:
+        computed = [_summarize(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(executor.map(_summarize, tasks))
+    for summary in computed:
+        summary["settings"] = settings
+        state.summaries[summary["product"]] = summary
+    summaries.extend(computed)
+    return sorted(summaries, key=lambda summary: summary["mean_premium"], reverse=True)
+
+def main():
+    """Update the aligned premiums and print the per-product summary"""
+    parser = argparse.ArgumentParser(description="Location premium of treatment over matched control routes")
+    parser.add_argument("input", help="ride_prices.csv or a columnar history directory")
+    parser.add_argument("--state", help="State file for incremental runs (default: recompute from scratch)")
+    parser.add_argument("--treatment", default="Sample1", help="Treatment sample type")
+    parser.add_argument("--control", default="Sample2", help="Control sample type")
+    parser.add_argument("--routes-file", help="Route registry file (default: ROUTES_FILE or built-in samples)")
+    parser.add_argument("--price", choices=["price_min", "price_max"], default="price_min", help="Price compared")
+    parser.add_argument("--cycle-gap", type=int, default=CYCLE_GAP_SECONDS, help="Seconds separating collection cycles")
+    parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level")
+    parser.add_argument("--workers", type=int, help="Bootstrap worker processes")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    lookup, _ = match_routes(load_routes(path=args.routes_file), args.treatment, args.control)
+    state = PremiumState.load(args.state)
+    added = align(read_new_rows(args.input, state), lookup, state, args.price, args.cycle_gap)
+    summaries = summarize(state, args.resamples, args.confidence, args.workers)
+    if args.state:
+        state.save(args.state)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    print(f"Aligned {added} new pairs, {len(state)} in total")
+    print(f"{'PRODUCT':<30} {'PAIRS':>7} {'MEAN':>8} {'MEDIAN':>8} {f'{args.confidence:.0%} CI':>20} {'MEAN $':>8}")
+    for summary in summaries:
+        ci = f"[{summary['ci_low']:+.1%}, {summary['ci_high']:+.1%}]"
+        print(
+            f"{summary['product']:<30} {summary['pairs']:>7} {summary['mean_premium']:>+8.1%} "
+            f"{summary['median_premium']:>+8.1%} {ci:>20} {summary['mean_difference_dollars']:>+8.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+In-memory route index and read API over collected quotes
+
+QuoteIndex keeps the latest cycle per route and a time-ordered history per
+(route, provider, product). It is fed incrementally, either with freshly
+collected rows or by tailing a ride_prices.csv object of a storage backend from
+the last byte read. register_query_routes adds the read endpoints to a Flask
+app, with ETags and pagination.
+"""
+import csv
+import io
+import logging
+import os
+import time
+import uuid
+import zlib
+import threading
+from bisect import bisect_left, bisect_right
+from flask import jsonify, request
+from src.backends import LocalBackend
+from src.routes import load_routes
+
+logger = logging.getLogger(__name__)
+
+# Column names used by older ride_prices.csv files
+COLUMN_ALIASES = {"price_min_dollars": "price_min", "price_max_dollars": "price_max"}
+
+# Pagination defaults for list endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def _number(value, cast=float):
+    """Parse a CSV value, returning None for empty strings"""
+    if value in ("", None):
+        return None
+    return cast(float(value))
+
+def route_names(routes=None):
+    """
+    Map (pickup name, destination name) to route_id
+
+    Args:
+        routes (list): Route registry (default: load_routes())
+    """
+    routes = load_routes() if routes is None else routes
+    return {(route["origin"]["name"], route["destination"]["name"]): route["route_id"] for route in routes}
+
+def to_quote(row, route_ids):
+    """
+    Normalize a ride_prices.csv row of either schema into a quote dict
+
+    Args:
+        row (dict): CSV row
+        route_ids (dict): Mapping from route_names()
+
+    Returns:
+        dict: Quote with route_id, ISO timestamp and numeric fields
+
+    Raises:
+        ValueError: If a numeric field can't be parsed
+        KeyError: If the row has no date or time
+    """
+    row = {COLUMN_ALIASES.get(name, name): value for name, value in row.items()}
+    pickup, destination = row.get("pickup", ""), row.get("destination", "")
+    return {
+        "route_id": route_ids.get((pickup, destination), f"{pickup} to {destination}"),
+        "timestamp": f"{row['date']}T{row['time']}",
+        "search_id": row.get("search_id", ""),
+        "sample_type": row.get("sample_type", ""),
+        "pickup": pickup,
+        "destination": destination,
+        "provider": row.get("provider", ""),
+        "product": row.get("product", ""),
+        "service_level": row.get("service_level", ""),
+        "price_min": _number(row.get("price_min")),
+        "price_max": _number(row.get("price_max")),
+        "wait_min_seconds": _number(row.get("wait_min_seconds"), int),
+        "wait_max_seconds": _number(row.get("wait_max_seconds"), int),
+        "trip_seconds": _number(row.get("trip_seconds"), int),
+        "distance_meters": _number(row.get("distance_meters"), int),
+        "surge_multiplier": _number(row.get("surge_multiplier")),
+    }
+
+def to_quotes(rows, route_ids):
+    """
+    Normalize rows with to_quote, skipping and logging rows that can't be parsed
+
+    Args:
+        rows (iterable): ride_prices.csv rows of either schema
+        route_ids (dict): Mapping from route_names()
+
+    Returns:
+        list: Quote dicts of the parseable rows
+    """
+    quotes = []
+    for row in rows:
+        try:
+            quotes.append(to_quote(row, route_ids))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Skipping unparseable row {row}: {e}")
+    return quotes
+
+class QuoteIndex:
+    """Thread-safe in-memory index of collected quotes"""
+
+    def __init__(self, routes=None):
+        """
+        Initialize an empty index
+
+        Args:
+            routes (list): Route registry used to name routes (default: load_routes())
+        """
+        self._route_ids = route_names(routes)
+        self.version = 0
+        # Distinguishes this index from earlier ones, e.g. before a server restart, whose versions also started at 0
+        self.instance = uuid.uuid4().hex[:12]
+        self._latest = {}
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Drop every indexed quote"""
+        with self._lock:
+            self._latest = {}
+            self._history = {}
+            self.version += 1
+
+    def add_rows(self, rows):
+        """
+        Add collected rows to the index
+
+        Args:
+            rows (iterable): ride_prices.csv rows of either schema
+
+        Returns:
+            int: Rows added; rows that can't be parsed are skipped
+        """
+        quotes = to_quotes(rows, self._route_ids)
+        if not quotes:
+            return 0
+        with self._lock:
+            for quote in quotes:
+                route_id, timestamp = quote["route_id"], quote["timestamp"]
+
+                latest = self._latest.get(route_id)
+                if latest is None or timestamp > latest["timestamp"]:
+                    self._latest[route_id] = {"timestamp": timestamp, "quotes": [quote]}
+                elif timestamp == latest["timestamp"]:
+                    latest["quotes"].append(quote)
+
+                route_series = self._history.setdefault(route_id, {})
+                timestamps, series_quotes = route_series.setdefault((quote["provider"], quote["product"]), ([], []))
+                position = bisect_right(timestamps, timestamp)
+                timestamps.insert(position, timestamp)
+                series_quotes.insert(position, quote)
+            self.version += 1
+        return len(quotes)
+
+    def routes(self):
+        """Latest collection time and quote count per route"""
+        with self._lock:
+            return [
+                {"route_id": route_id, "timestamp": latest["timestamp"], "quotes": len(latest["quotes"])}
+                for route_id, latest in sorted(self._latest.items())
+            ]
+
+    def latest(self, route_id=None):
+        """
+        Quotes of the latest cycle per route
+
+        Args:
+            route_id (str): Only this route (default: all routes)
+
+        Returns:
+            list: Quote dicts
+        """
+        with self._lock:
+            if route_id is not None:
+                latest = self._latest.get(route_id)
+                return list(latest["quotes"]) if latest else []
+            return [quote for _, latest in sorted(self._latest.items()) for quote in latest["quotes"]]
+
+    def history(self, route_id, provider=None, product=None, start=None, end=None):
+        """
+        Quotes of a route in time order
+
+        Args:
+            route_id (str): Route id
+            provider (str): Only this provider
+            product (str): Only this product
+            start (str): Inclusive ISO start time, e.g. "2025-03-11T00:00:00"
+            end (str): Exclusive ISO end time
+
+        Returns:
+            list: Quote dicts
+        """
+        with self._lock:
+            matches = []
+            for (series_provider, series_product), (timestamps, quotes) in self._history.get(route_id, {}).items():
+                if provider is not None and series_provider != provider:
+                    continue
+                if product is not None and series_product != product:
+                    continue
+                low = bisect_left(timestamps, start) if start else 0
+                high = bisect_left(timestamps, end) if end else len(timestamps)
+                matches.extend(quotes[low:high])
+        matches.sort(key=lambda quote: quote["timestamp"])
+        return matches
+
+    def cheapest(self, route_id=None):
+        """
+        Cheapest priced option of the latest cycle per route
+
+        Returns:
+            list: One quote dict per route
+        """
+        by_route = {}
+        for quote in self.latest(route_id):
+            if not quote["price_min"]:
+                continue
+            best = by_route.get(quote["route_id"])
+            if best is None or quote["price_min"] < best["price_min"]:
+                by_route[quote["route_id"]] = quote
+        return [by_route[route] for route in sorted(by_route)]
+
+class CsvTail:
+    """
+    Feeds an index from a growing ride_prices.csv
+
+    Remembers the byte offset of the last complete line indexed, so each
+    refresh parses only rows appended since. The offset only advances once
+    a chunk is indexed, so a failed refresh is retried. A file that shrank
+    was replaced; it is then read again from the start.
+    """
+
+    def __init__(self, index, path, backend=None, min_interval=30.0):
+        """
+        Initialize the tail
+
+        Args:
+            index (QuoteIndex): Index to feed
+            path (str): CSV object name in backend, or a local file path without one
+            backend: Storage backend holding the CSV (see src/backends.py)
+            min_interval (float): Minimum seconds between two refreshes
+        """
+        if backend is None:
+            directory, path = os.path.split(path)
+            backend = LocalBackend(directory or ".")
+        self.index = index
+        self.path = path
+        self.backend = backend
+        self.min_interval = min_interval
+        self.offset = 0
+        self.header = None
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def _size(self):
+        return self.backend.size(self.path) or 0
+
+    def _read_from(self, offset):
+        return self.backend.get(self.path, start=offset)
+
+    def refresh(self, force=False):
+        """
+        Index rows appended since the last refresh
+
+        Args:
+            force (bool): Ignore min_interval
+
+        Returns:
+            int: Rows added
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.min_interval:
+                return 0
+            self._last_refresh = now
+
+            size = self._size()
+            if size < self.offset:
+                self.offset, self.header = 0, None
+                self.index.clear()
+            if size == self.offset:
+                return 0
+
+            data = self._read_from(self.offset)
+            complete = data.rfind(b"\n") + 1
+            if not complete:
+                return 0
+            lines = io.StringIO(data[:complete].decode("utf-8"), newline='')
+            header = self.header or next(csv.reader(lines))
+            added = self.index.add_rows(csv.DictReader(lines, fieldnames=header))
+            self.offset += complete
+            self.header = header
+            return added
+
+def _page(items, args):
+    """Slice a list by the limit/offset query parameters"""
+    limit = min(int(args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    offset = int(args.get("offset", 0))
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset non-negative")
+    page = items[offset:offset + limit]
+    return {
+        "items": page,
+        "total": len(items),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < len(items) else None,
+    }
+
+def register_query_routes(app, index, tail=None):
+    """
+    Add read endpoints to a Flask app
+
+    GET /routes                  routes with their latest collection time
+    GET /quotes/latest           latest cycle per route (?route=)
+    GET /quotes/history          ?route= (required), &provider=, &product=, &start=, &end=
+    GET /quotes/cheapest         cheapest option per route (?route=)
+
+    List responses are paginated with ?limit= and ?offset=. Every response
+    carries an ETag derived from the index instance and version and the
+    query, so If-None-Match gets a 304 until new rows are indexed or the
+    server restarts. If the tail can't be refreshed, the error is logged
+    and the rows indexed so far are served.
+
+    Args:
+        app (flask.Flask): Application
+        index (QuoteIndex): Index to serve
+        tail (CsvTail): Refreshed before each request, if given
+    """
+    def respond(build):
+        if tail is not None:
+            try:
+                tail.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing quotes from {tail.path}: {e}")
+        etag = f'{index.instance}-{index.version}-{zlib.crc32(request.full_path.encode("utf-8")):x}'
+        if request.if_none_match.contains(etag):
+            return "", 304, {"ETag": f'"{etag}"'}
+        try:
+            body = build(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response = jsonify(body)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @app.route("/routes", methods=["GET"])
+    def list_routes():
+        return respond(lambda args: _page(index.routes(), args))
+
+    @app.route("/quotes/latest", methods=["GET"])
+    def latest_quotes():
+        return respond(lambda args: _page(index.latest(args.get("route")), args))
+
+    @app.route("/quotes/history", methods=["GET"])
+    def quote_history():
+        def build(args):
+            if not args.get("route"):
+                raise ValueError("route is required")
+            quotes = index.history(
+                args["route"], args.get("provider"), args.get("product"), args.get("start"), args.get("end")
+            )
+            return _page(quotes, args)
+        return respond(build)
+
+    @app.route("/quotes/cheapest", methods=["GET"])
+    def cheapest_quotes():
+        return respond(lambda args: _page(index.cheapest(args.get("route")), args))
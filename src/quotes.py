@@ -0,0 +1,209 @@
+"""
+Row builders for Bellhop pricing responses
+
+Turns an API response into the rows written by the collectors, so live
+collection and backfills of archived responses produce identical output.
+"""
+import logging
+import uuid
+from datetime import datetime
+from src.parsing import PriceStream, as_text, dumps, loads, should_stream
+
+logger = logging.getLogger(__name__)
+
+# Columns of ride_prices.csv written by the hourly collector
+CSV_FIELDNAMES = [
+    "date", "time", "search_id", "sample_type", "pickup", "destination",
+    "provider", "product", "service_level",
+    "price_min", "price_max", "price_min_discounted", "price_max_discounted",
+    "wait_min_seconds", "wait_max_seconds",
+    "trip_seconds", "distance_meters", "surge_multiplier"
+]
+
+def get_price_options(data):
+    """
+    Get the price options of the first result in a response
+
+    Args:
+        data (dict): API response
+
+    Returns:
+        list: Price option dicts, empty if the response has none
+    """
+    results = data.get("results", [])
+    if not results:
+        return []
+    return results[0].get("prices") or []
+
+def _dollars(price, key):
+    """Convert a cents field to dollars, treating missing values as 0"""
+    return price.get(key, 0) / 100 if price.get(key) is not None else 0
+
+def _csv_row(price, search_id, sample_type, pickup_name, dest_name, date_str, time_str):
+    """Build one ride_prices.csv row from a price option"""
+    wait_max = price.get("est_pickup_wait_time", {}).get("max", 0)
+    return {
+        "date": date_str,
+        "time": time_str,
+        "search_id": search_id,
+        "sample_type": sample_type,
+        "pickup": pickup_name,
+        "destination": dest_name,
+        "provider": price.get("provider", ""),
+        "product": price.get("product", ""),
+        "service_level": price.get("service_level", ""),
+        "price_min": f"{_dollars(price, 'price_min'):.2f}",
+        "price_max": f"{_dollars(price, 'price_max'):.2f}",
+        "price_min_discounted": f"{_dollars(price, 'price_min_discounted'):.2f}",
+        "price_max_discounted": f"{_dollars(price, 'price_max_discounted'):.2f}",
+        "wait_min_seconds": price.get("est_pickup_wait_time", {}).get("min", 0),
+        "wait_max_seconds": wait_max if wait_max else "",
+        "trip_seconds": price.get("est_time_after_pickup_till_dropoff", 0),
+        "distance_meters": price.get("distance_meters", 0),
+        "surge_multiplier": price.get("surge_multiplier", 1.0)
+    }
+
+def route_key(pickup_lat, pickup_lng, dest_lat, dest_lng):
+    """
+    Route identifier built from coordinates (about a meter of precision)
+
+    Used as route_id in BigQuery when a quote has no registry route.
+
+    Returns:
+        str: "lat,lng:lat,lng", or None if a coordinate is missing
+    """
+    if None in (pickup_lat, pickup_lng, dest_lat, dest_lng):
+        return None
+    return f"{pickup_lat:.5f},{pickup_lng:.5f}:{dest_lat:.5f},{dest_lng:.5f}"
+
+def _quote_row(price, result_index, request):
+    """Build one flattened BigQuery quotes row from a price option"""
+    wait = price.get("est_pickup_wait_time") or {}
+    return {
+        **request,
+        "result_index": result_index,
+        "provider": price.get("provider"),
+        "product": price.get("product"),
+        "service_level": price.get("service_level"),
+        "price_min_cents": price.get("price_min"),
+        "price_max_cents": price.get("price_max"),
+        "price_min_discounted_cents": price.get("price_min_discounted"),
+        "price_max_discounted_cents": price.get("price_max_discounted"),
+        "currency": price.get("currency"),
+        "wait_time_min": wait.get("min"),
+        "wait_time_max": wait.get("max"),
+        "trip_time_seconds": price.get("est_time_after_pickup_till_dropoff"),
+        "distance_meters": price.get("distance_meters"),
+        "surge_multiplier": price.get("surge_multiplier")
+    }
+
+def build_csv_rows(data, sample_type, pickup_name, dest_name, timestamp=None):
+    """
+    Build ride_prices.csv rows from an API response
+
+    Raw responses are decoded whole, or parsed incrementally one price
+    option at a time when larger than STREAM_THRESHOLD_BYTES.
+
+    Args:
+        data (dict, bytes or str): Decoded or raw API response
+        sample_type (str): Sample label, e.g. "Sample1"
+        pickup_name (str): Pickup place name
+        dest_name (str): Destination place name
+        timestamp (datetime): Collection time (default: now)
+
+    Returns:
+        list: Row dicts keyed by CSV_FIELDNAMES; empty if the document isn't a response object
+    """
+    timestamp = timestamp or datetime.now()
+    date_str = timestamp.strftime("%Y-%m-%d")
+    time_str = timestamp.strftime("%H:%M:%S")
+
+    if isinstance(data, (bytes, str)) and not should_stream(data):
+        data = loads(data)
+        if not isinstance(data, dict):
+            logger.warning(f"Expected a response object, got a JSON {type(data).__name__}; no rows built")
+            return []
+    if isinstance(data, dict):
+        search_id = data.get("search_id", "")
+        return [
+            _csv_row(price, search_id, sample_type, pickup_name, dest_name, date_str, time_str)
+            for price in get_price_options(data)
+        ]
+
+    # search_id may follow the results in the document, so fill it in afterwards
+    stream = PriceStream(data)
+    rows = [
+        _csv_row(price, "", sample_type, pickup_name, dest_name, date_str, time_str)
+        for result_index, price in stream if result_index == 0
+    ]
+    for row in rows:
+        row["search_id"] = stream.search_id or ""
+    return rows
+
+def build_bigquery_rows(data, pickup_lat, pickup_lng, dest_lat, dest_lng, timestamp=None, route_id=None,
+                        sample_type=None, request_id=None):
+    """
+    Build the BigQuery rows of an API response
+
+    Every price option becomes one quotes row; the response itself becomes
+    one raw_responses row, linked to its quotes by request_id. A raw
+    response is stored verbatim instead of being serialized again, and is
+    parsed incrementally only when larger than STREAM_THRESHOLD_BYTES.
+
+    Args:
+        data (dict, bytes or str): Decoded or raw API response
+        pickup_lat (float): Pickup latitude
+        pickup_lng (float): Pickup longitude
+        dest_lat (float): Destination latitude
+        dest_lng (float): Destination longitude
+        timestamp (datetime): Collection time (default: now)
+        route_id (str): Registry route id (default: route_key() of the coordinates)
+        sample_type (str): Sample label, e.g. "Sample1"
+        request_id (str): Identifier of the request (default: a random UUID)
+
+    Returns:
+        tuple: (list of quotes rows, raw_responses row); no quotes rows if the
+            document isn't a response object
+    """
+    raw_response = None
+    if isinstance(data, (bytes, str)) and not should_stream(data):
+        raw_response = as_text(data)
+        data = loads(data)
+    if not isinstance(data, dict) and raw_response is not None:
+        logger.warning(f"Expected a response object, got a JSON {type(data).__name__}; no quotes built")
+        search_id, prices = None, []
+    elif isinstance(data, dict):
+        search_id = data.get("search_id")
+        raw_response = raw_response or dumps(data)
+        prices = [
+            (result_index, price)
+            for result_index, result in enumerate(data.get("results", []))
+            for price in result.get("prices", [])
+        ]
+    else:
+        stream = PriceStream(data)
+        prices = list(stream)
+        search_id = stream.search_id
+        raw_response = as_text(data)
+
+    request = {
+        "request_timestamp": (timestamp or datetime.now()).isoformat(),
+        "request_id": request_id or uuid.uuid4().hex,
+        "search_id": search_id,
+        "route_id": route_id or route_key(pickup_lat, pickup_lng, dest_lat, dest_lng),
+        "sample_type": sample_type,
+        "pickup_lat": pickup_lat,
+        "pickup_lng": pickup_lng,
+        "destination_lat": dest_lat,
+        "destination_lng": dest_lng,
+    }
+    quote_rows = [_quote_row(price, result_index, request) for result_index, price in prices]
+    raw_row = {
+        "request_id": request["request_id"],
+        "request_timestamp": request["request_timestamp"],
+        "search_id": search_id,
+        "route_id": request["route_id"],
+        "raw_response": raw_response,
+        "raw_uri": None
+    }
+    return quote_rows, raw_row
@@ -0,0 +1,262 @@
+"""
+Overload protection for Bellhop API calls
+
+AdaptiveConcurrencyLimiter adjusts how many calls may be in flight with
+additive-increase/multiplicative-decrease (AIMD), and CircuitBreaker stops
+calls entirely after sustained failures so callers can defer their work.
+LatencyTracker keeps a window of recent latencies so callers can tell when
+a call is running unusually long.
+"""
+import threading
+import time
+from collections import deque
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit breaker is open"""
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit
+
+    Every success raises the limit by `increase / limit`, i.e. by about
+    `increase` per round of calls; a throttle signal (429, 5xx, timeout)
+    multiplies it by `decrease_factor`. Decreases are applied at most once per
+    `cooldown` seconds so a burst of failures from the same round only counts once.
+    """
+
+    def __init__(self, initial=1, minimum=1, maximum=8, increase=1.0, decrease_factor=0.5, cooldown=1.0):
+        """
+        Initialize the limiter
+
+        Args:
+            initial (float): Starting limit
+            minimum (float): Lowest limit
+            maximum (float): Highest limit
+            increase (float): Additive increase per round of successful calls
+            decrease_factor (float): Multiplier applied on throttle signals
+            cooldown (float): Minimum seconds between two decreases
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._limit = float(max(minimum, min(maximum, initial)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        """Current number of calls allowed in flight"""
+        with self._condition:
+            return max(1, int(self._limit))
+
+    @property
+    def in_flight(self):
+        """Number of calls currently holding a slot"""
+        with self._condition:
+            return self._in_flight
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a free slot
+
+        Args:
+            timeout (float): Seconds to wait (default: forever)
+
+        Returns:
+            bool: True if a slot was acquired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < max(1, int(self._limit)), timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        """Free a slot"""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        """Grow the limit after a successful call"""
+        with self._condition:
+            self._limit = min(self.maximum, self._limit + self.increase / self._limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        """Shrink the limit after a 429, 5xx or timeout"""
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._limit = max(self.minimum, self._limit * self.decrease_factor)
+                self._last_decrease = now
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    Closed: calls flow. After `failure_threshold` consecutive failures it opens
+    and refuses calls for `reset_timeout` seconds, then goes half-open and lets
+    a single trial call through; its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=120.0):
+        """
+        Initialize the breaker
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            reset_timeout (float): Seconds to stay open before a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state, moving from open to half-open once the timeout passes"""
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+    def seconds_until_retry(self):
+        """Seconds until an open circuit admits a trial call (0 if not open)"""
+        with self._lock:
+            self._refresh()
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self):
+        """
+        Check whether a call may proceed
+
+        Returns:
+            bool: False while open, or while a half-open trial is in flight
+        """
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def check(self):
+        """Raise CircuitOpenError if a call may not proceed"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit open, retry in {self.seconds_until_retry():.0f} seconds")
+
+    def record_success(self):
+        """Close the circuit and reset the failure count"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Count a failure, opening the circuit at the threshold or on a failed trial"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies"""
+
+    def __init__(self, window=200):
+        """
+        Initialize the tracker
+
+        Args:
+            window (int): Number of most recent latencies kept
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def record(self, seconds):
+        """Add one latency observation"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """
+        Nearest-rank percentile of the window
+
+        Args:
+            fraction (float): Percentile as a fraction, e.g. 0.95
+
+        Returns:
+            float: Latency in seconds, or None if nothing was recorded yet
+        """
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+        return ordered[index]
+
+def is_overload(status):
+    """
+    Check whether a call outcome signals an overloaded API
+
+    Args:
+        status (int or str): HTTP status code, or "error" if no response arrived
+
+    Returns:
+        bool: True for 429, 5xx and failed connections or timeouts
+    """
+    return status == "error" or status == 429 or status >= 500
+
+def report_outcome(status, limiter=None, breaker=None):
+    """
+    Feed a call outcome to a limiter and breaker
+
+    Overload signals shrink the limiter and count towards the breaker; any
+    other response, including 4xx client errors, shows the API is healthy.
+
+    Args:
+        status (int or str): HTTP status code, or "error" if no response arrived
+        limiter (AdaptiveConcurrencyLimiter): Optional limiter
+        breaker (CircuitBreaker): Optional breaker
+    """
+    if is_overload(status):
+        if limiter is not None:
+            limiter.on_throttle()
+        if breaker is not None:
+            breaker.record_failure()
+    else:
+        if limiter is not None:
+            limiter.on_success()
+        if breaker is not None:
+            breaker.record_success()
@@ -0,0 +1,229 @@
+"""
+Route registry for the Bellhop collectors
+
+Holds the sample origin-destination pairs and flattens them into a single list
+of routes that collectors can iterate over, partition into shards, or extend.
+"""
+import json
+import os
+
+# Sample 1: Prestigious Origin-Destination Pairs (Luxury residences/hotels to corporate HQs)
+SAMPLE1_PAIRS = [
+    {"id": 1, "origin_id": 1, "destination_id": 2},
+    {"id": 2, "origin_id": 3, "destination_id": 4},
+    {"id": 3, "origin_id": 5, "destination_id": 6},
+    {"id": 4, "origin_id": 7, "destination_id": 8},
+    {"id": 5, "origin_id": 9, "destination_id": 10},
+    {"id": 6, "origin_id": 11, "destination_id": 12},
+    {"id": 7, "origin_id": 13, "destination_id": 14},
+    {"id": 8, "origin_id": 15, "destination_id": 16},
+    {"id": 9, "origin_id": 17, "destination_id": 18},
+    {"id": 10, "origin_id": 19, "destination_id": 20},
+]
+
+SAMPLE1_PLACES = [
+    {"id": 1, "name": "15 Central Park West", "lat": 40.769000, "lng": -73.981400},
+    {"id": 2, "name": "Goldman Sachs HQ", "lat": 40.714700, "lng": -74.013600},
+    {"id": 3, "name": "Central Park Tower", "lat": 40.765900, "lng": -73.982000},
+    {"id": 4, "name": "JP Morgan HQ", "lat": 40.755600, "lng": -73.977500},
+    {"id": 5, "name": "432 Park Avenue", "lat": 40.761600, "lng": -73.971800},
+    {"id": 6, "name": "CitiGroup HQ", "lat": 40.720600, "lng": -74.012800},
+    {"id": 7, "name": "15 Hudson Yards", "lat": 40.753600, "lng": -74.002200},
+    {"id": 8, "name": "McKinsey (WTC)", "lat": 40.712800, "lng": -74.011900},
+    {"id": 9, "name": "One57 (157 W 57th St)", "lat": 40.765300, "lng": -73.979000},
+    {"id": 10, "name": "BCG (Hudson Yards)", "lat": 40.753600, "lng": -74.002200},
+    {"id": 11, "name": "220 Central Park South", "lat": 40.766700, "lng": -73.980900},
+    {"id": 12, "name": "Google NYC", "lat": 40.740800, "lng": -74.003300},
+    {"id": 13, "name": "Four Seasons Hotel New York", "lat": 40.762600, "lng": -73.969700},
+    {"id": 14, "name": "Skadden Arps", "lat": 40.751700, "lng": -73.997200},
+    {"id": 15, "name": "The Beekman (Thompson Hotel)", "lat": 40.711200, "lng": -74.006600},
+    {"id": 16, "name": "Morgan Stanley HQ", "lat": 40.758300, "lng": -73.968600},
+    {"id": 17, "name": "The St. Regis New York", "lat": 40.761600, "lng": -73.974400},
+    {"id": 18, "name": "AIG", "lat": 40.705600, "lng": -74.009100},
+    {"id": 19, "name": "Four Seasons Hotel New York Downtown", "lat": 40.712600, "lng": -74.009700},
+    {"id": 20, "name": "Bain & Company", "lat": 40.756200, "lng": -73.981100},
+]
+
+# Sample 2: Random Manhattan locations with nearly identical distances
+SAMPLE2_PAIRS = [
+    {"id": 1, "origin_id": 1, "destination_id": 2},
+    {"id": 2, "origin_id": 3, "destination_id": 4},
+    {"id": 3, "origin_id": 5, "destination_id": 6},
+    {"id": 4, "origin_id": 7, "destination_id": 8},
+    {"id": 5, "origin_id": 9, "destination_id": 10},
+    {"id": 6, "origin_id": 11, "destination_id": 12},
+    {"id": 7, "origin_id": 13, "destination_id": 14},
+    {"id": 8, "origin_id": 15, "destination_id": 16},
+    {"id": 9, "origin_id": 17, "destination_id": 18},
+    {"id": 10, "origin_id": 19, "destination_id": 20},
+]
+
+SAMPLE2_PLACES = [
+    {"id": 1, "name": "Random Origin 1", "lat": 40.794705, "lng": -73.971795},
+    {"id": 2, "name": "Random Destination 1", "lat": 40.739203, "lng": -74.000226},
+    {"id": 3, "name": "Random Origin 2", "lat": 40.721926, "lng": -74.003187},
+    {"id": 4, "name": "Random Destination 2", "lat": 40.711705, "lng": -74.007952},
+    {"id": 5, "name": "Random Origin 3", "lat": 40.744180, "lng": -73.998954},
+    {"id": 6, "name": "Random Destination 3", "lat": 40.782621, "lng": -73.954126},
+    {"id": 7, "name": "Random Origin 4", "lat": 40.710470, "lng": -74.007748},
+    {"id": 8, "name": "Random Destination 4", "lat": 40.750068, "lng": -73.991665},
+    {"id": 9, "name": "Random Origin 5", "lat": 40.771169, "lng": -73.957614},
+    {"id": 10, "name": "Random Destination 5", "lat": 40.786449, "lng": -73.976858},
+    {"id": 11, "name": "Random Origin 6", "lat": 40.716300, "lng": -74.004792},
+    {"id": 12, "name": "Random Destination 6", "lat": 40.747133, "lng": -74.000472},
+    {"id": 13, "name": "Random Origin 7", "lat": 40.706267, "lng": -74.012561},
+    {"id": 14, "name": "Random Destination 7", "lat": 40.726520, "lng": -73.996706},
+    {"id": 15, "name": "Random Origin 8", "lat": 40.782064, "lng": -73.956258},
+    {"id": 16, "name": "Random Destination 8", "lat": 40.737330, "lng": -73.998871},
+    {"id": 17, "name": "Random Origin 9", "lat": 40.804611, "lng": -73.954223},
+    {"id": 18, "name": "Random Destination 9", "lat": 40.749035, "lng": -73.989995},
+    {"id": 19, "name": "Random Origin 10", "lat": 40.780999, "lng": -73.946376},
+    {"id": 20, "name": "Random Destination 10", "lat": 40.748841, "lng": -73.993437},
+]
+
+# Sample 3: NYC Residential to Airport Routes
+SAMPLE3_PAIRS = [
+    {"id": 1, "origin_id": 1, "destination_id": 2},    # Columbus Ave to JFK
+    {"id": 2, "origin_id": 1, "destination_id": 3},    # Columbus Ave to Newark
+    {"id": 3, "origin_id": 1, "destination_id": 4},    # Columbus Ave to LaGuardia
+    {"id": 4, "origin_id": 5, "destination_id": 2},    # Central Park West to JFK
+    {"id": 5, "origin_id": 5, "destination_id": 3},    # Central Park West to Newark
+    {"id": 6, "origin_id": 5, "destination_id": 4},    # Central Park West to LaGuardia
+    {"id": 7, "origin_id": 2, "destination_id": 1},    # JFK to Columbus Ave
+    {"id": 8, "origin_id": 3, "destination_id": 1},    # Newark to Columbus Ave
+    {"id": 9, "origin_id": 4, "destination_id": 1},    # LaGuardia to Columbus Ave
+    {"id": 10, "origin_id": 2, "destination_id": 5},   # JFK to Central Park West
+    {"id": 11, "origin_id": 3, "destination_id": 5},   # Newark to Central Park West
+    {"id": 12, "origin_id": 4, "destination_id": 5},   # LaGuardia to Central Park West
+]
+
+SAMPLE3_PLACES = [
+    {"id": 1, "name": "795 Columbus Ave", "lat": 40.793682, "lng": -73.962427},
+    {"id": 2, "name": "JFK Airport", "lat": 40.641311, "lng": -73.778139},
+    {"id": 3, "name": "Newark Airport", "lat": 40.689531, "lng": -74.174462},
+    {"id": 4, "name": "LaGuardia Airport", "lat": 40.775997, "lng": -73.872457},
+    {"id": 5, "name": "15 Central Park West", "lat": 40.769000, "lng": -73.981400},
+]
+
+# Sample definitions keyed by sample type, in collection order
+SAMPLES = {
+    "Sample1": {"pairs": SAMPLE1_PAIRS, "places": SAMPLE1_PLACES},
+    "Sample2": {"pairs": SAMPLE2_PAIRS, "places": SAMPLE2_PLACES},
+    "Sample3": {"pairs": SAMPLE3_PAIRS, "places": SAMPLE3_PLACES},
+}
+
+# Optional JSON file that replaces the built-in samples as the registry
+ROUTES_FILE = os.environ.get("ROUTES_FILE")
+
+def get_place_by_id(sample_places, place_id):
+    """Get a place by its ID"""
+    for place in sample_places:
+        if place['id'] == place_id:
+            return place
+    return None
+
+def build_routes(sample_type, pairs, places):
+    """
+    Flatten origin-destination pairs into route records
+
+    Args:
+        sample_type (str): Sample label, e.g. "Sample1"
+        pairs (list): Pair dicts with id, origin_id and destination_id
+        places (list): Place dicts with id, name, lat and lng
+
+    Returns:
+        list: Route dicts with route_id, sample_type, pair_id, origin and destination
+    """
+    routes = []
+    for pair in pairs:
+        origin = get_place_by_id(places, pair["origin_id"])
+        destination = get_place_by_id(places, pair["destination_id"])
+        if not origin or not destination:
+            raise ValueError(
+                f"Invalid place IDs in {sample_type} pair {pair['id']}: "
+                f"origin_id={pair['origin_id']}, dest_id={pair['destination_id']}"
+            )
+        routes.append({
+            "route_id": f"{sample_type}-{pair['id']}",
+            "sample_type": sample_type,
+            "pair_id": pair["id"],
+            "origin": {"name": origin["name"], "lat": origin["lat"], "lng": origin["lng"]},
+            "destination": {"name": destination["name"], "lat": destination["lat"], "lng": destination["lng"]},
+        })
+    return routes
+
+def load_routes(sample_types=None, path=None):
+    """
+    Load the route registry
+
+    Routes come from the JSON file at `path` (or the ROUTES_FILE environment
+    variable) when it exists, otherwise from the built-in samples.
+
+    Args:
+        sample_types (list): Only keep routes of these sample types (default: all)
+        path (str): Optional registry file path
+
+    Returns:
+        list: Route dicts in collection order
+    """
+    path = path or ROUTES_FILE
+    if path and os.path.isfile(path):
+        with open(path) as f:
+            routes = json.load(f)
+    else:
+        routes = []
+        for sample_type, sample in SAMPLES.items():
+            routes.extend(build_routes(sample_type, sample["pairs"], sample["places"]))
+
+    if sample_types is not None:
+        routes = [route for route in routes if route["sample_type"] in sample_types]
+    return routes
+
+def save_routes(routes, path):
+    """
+    Write a route registry to a JSON file
+
+    Args:
+        routes (list): Route dicts
+        path (str): Destination file path
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(routes, f, indent=2)
+
+def parse_shard_spec(spec):
+    """
+    Parse a shard specification of the form "i/n"
+
+    Args:
+        spec (str): Shard index and count, zero-based, e.g. "0/4"
+
+    Returns:
+        tuple: (shard_index, shard_count)
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid shard spec '{spec}', expected 'i/n'")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard spec '{spec}', need 0 <= i < n")
+    return index, count
+
+def partition_routes(routes, shard_index, shard_count):
+    """
+    Select the routes belonging to one shard
+
+    Routes are dealt round-robin so every shard gets a similar mix of samples
+    and shard sizes differ by at most one.
+
+    Args:
+        routes (list): Full route registry
+        shard_index (int): Zero-based shard index
+        shard_count (int): Total number of shards
+
+    Returns:
+        list: Routes assigned to the shard
+    """
+    return routes[shard_index::shard_count]
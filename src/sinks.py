@@ -0,0 +1,208 @@
+"""
+Batched output sinks for collected ride rows
+
+Each sink buffers rows and writes them in bulk on flush, so large jobs make
+one write per batch instead of one per API response.
+"""
+import csv
+import io
+import logging
+import os
+from src.backends import LocalBackend
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the start of an existing CSV to compare its header
+HEADER_READ_BYTES = 64 * 1024
+
+def csv_text(rows, fieldnames, header=False):
+    """Render rows as CSV text, optionally preceded by the header line"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+def needs_csv_header(backend, name, fieldnames):
+    """
+    Check that rows with fieldnames may be appended to a CSV object
+
+    Args:
+        backend: Storage backend holding the CSV
+        name (str): CSV object name
+        fieldnames (list): CSV columns of the rows to append
+
+    Returns:
+        bool: True if the object is missing or empty and needs a header
+
+    Raises:
+        ValueError: If the object starts with a different header
+    """
+    size = backend.size(name)
+    if not size:
+        return True
+    first_line = backend.get(name, 0, min(size, HEADER_READ_BYTES)).decode("utf-8", "replace").splitlines()[0]
+    if next(csv.reader([first_line]), []) != list(fieldnames):
+        raise ValueError(f"{backend.uri(name)} has different columns ({first_line}); refusing to append")
+    return False
+
+class StorageCsvSink:
+    """Appends rows to a CSV object of a storage backend (see src/backends.py)"""
+
+    def __init__(self, backend, name, fieldnames, batch_size=5000):
+        """
+        Initialize the sink
+
+        Args:
+            backend: Storage backend holding the CSV
+            name (str): CSV object name, created with a header if missing; an existing
+                object must have the same header
+            fieldnames (list): CSV columns
+            batch_size (int): Buffered rows that trigger an automatic flush
+        """
+        self.backend = backend
+        self.name = name
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+        self._checked = False
+
+    def write(self, rows):
+        """Buffer rows, flushing once the batch is full"""
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Append all buffered rows to the object in one write
+
+        Raises:
+            ValueError: If the existing object has a different header
+        """
+        if not self.buffer:
+            return
+        header = not self._checked and needs_csv_header(self.backend, self.name, self.fieldnames)
+        self._checked = True
+        self.backend.append(self.name, csv_text(self.buffer, self.fieldnames, header), content_type="text/csv")
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """Flush remaining rows"""
+        self.flush()
+
+class LocalCsvSink(StorageCsvSink):
+    """Appends rows to a local CSV file"""
+
+    def __init__(self, path, fieldnames, batch_size=5000):
+        """
+        Initialize the sink
+
+        Args:
+            path (str): CSV file path, created with a header if missing
+            fieldnames (list): CSV columns
+            batch_size (int): Buffered rows that trigger an automatic flush
+        """
+        directory, name = os.path.split(path)
+        super().__init__(LocalBackend(directory or "."), name, fieldnames, batch_size)
+        self.path = path
+
+class ComposedCsvSink:
+    """
+    Writes rows to a CSV object as separately uploaded parts
+
+    Every flush uploads a part object next to the target; close composes the
+    parts into the target object, so the whole CSV is never re-downloaded.
+    Parts left by an interrupted run are picked up again on the next one.
+    Meant for the GCS backend, where appends are composes anyway.
+    """
+
+    def __init__(self, backend, name, fieldnames, batch_size=50000):
+        """
+        Initialize the sink
+
+        Args:
+            backend: Storage backend holding the CSV
+            name (str): Target CSV object name
+            fieldnames (list): CSV columns
+            batch_size (int): Buffered rows that trigger an automatic flush
+        """
+        self.backend = backend
+        self.name = name
+        self.parts_prefix = f"{name}.parts/"
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+        self.part_names = sorted(backend.list(self.parts_prefix))
+
+    def write(self, rows):
+        """Buffer rows, flushing once the batch is full"""
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Upload buffered rows as a new part object"""
+        if not self.buffer:
+            return
+        header = not self.part_names and not self.backend.exists(self.name)
+        part_name = f"{self.parts_prefix}part-{len(self.part_names):06d}.csv"
+        self.backend.put(part_name, csv_text(self.buffer, self.fieldnames, header), content_type="text/csv")
+        self.part_names.append(part_name)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """Flush remaining rows and compose all parts into the target object"""
+        self.flush()
+        if not self.part_names:
+            return
+
+        sources = [self.name] if self.backend.exists(self.name) else []
+        self.backend.compose(self.name, sources + self.part_names, content_type="text/csv")
+        for name in self.part_names:
+            self.backend.delete(name)
+        self.part_names = []
+        logger.info(f"CSV data composed into {self.backend.uri(self.name)}")
+
+class BigQuerySink:
+    """Streams rows into a BigQuery table in batches"""
+
+    def __init__(self, client, table_ref, batch_size=500):
+        """
+        Initialize the sink
+
+        Args:
+            client (bigquery.Client): BigQuery client
+            table_ref (str): Fully qualified table ID
+            batch_size (int): Rows per insert request
+        """
+        self.client = client
+        self.table_ref = table_ref
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+
+    def write(self, rows):
+        """Buffer rows, flushing once the batch is full"""
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert buffered rows, one request per batch"""
+        for start in range(0, len(self.buffer), self.batch_size):
+            batch = self.buffer[start:start + self.batch_size]
+            errors = self.client.insert_rows_json(self.table_ref, batch)
+            if errors:
+                raise RuntimeError(f"Errors inserting rows into {self.table_ref}: {errors[:5]}")
+            self.rows_written += len(batch)
+        self.buffer = []
+
+    def close(self):
+        """Flush remaining rows"""
+        self.flush()
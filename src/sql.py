@@ -0,0 +1,422 @@
+"""
+Embedded SQL analytics over the collected history
+
+Collected files are registered in an in-process DuckDB database, so the
+history can be queried offline with SQL instead of BigQuery. Sources are
+found by walking the given paths:
+
+    *.csv                          ride_prices.csv files (either schema)
+    *.json                         raw API responses (collector or manual_collect)
+    <dir>/objects + <dir>/pointers content-addressed archive (src/archive.py)
+    <dir>/meta.json                columnar history (src/columnar.py)
+
+Raw tables keep each source as stored; the *_quotes views flatten
+results[*].prices[*] into one row per ride option with a common schema,
+and the quotes view is their union. DuckDB scans CSV and JSON files in
+parallel across its worker threads. Files in GCS can be queried after
+downloading them, e.g. with `gsutil -m rsync -r gs://<bucket>/json data/json`.
+
+Usage: python -m src.sql query "SELECT provider, avg(price_min) FROM quotes GROUP BY 1"
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from src.routes import load_routes
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Column names used by older ride_prices.csv files
+COLUMN_ALIASES = {"price_min_dollars": "price_min", "price_max_dollars": "price_max"}
+
+# Default directory searched for sources
+DEFAULT_SOURCE = "data"
+
+# DuckDB type of one price option of a response
+PRICE_TYPE = (
+    "STRUCT(provider VARCHAR, product VARCHAR, service_level VARCHAR, currency VARCHAR, discount_type VARCHAR, "
+    "price_min BIGINT, price_max BIGINT, price_min_discounted BIGINT, price_max_discounted BIGINT, "
+    "est_pickup_wait_time STRUCT(\"min\" BIGINT, \"max\" BIGINT), est_time_after_pickup_till_dropoff BIGINT, "
+    "distance_meters BIGINT, surge_multiplier DOUBLE)"
+)
+
+# DuckDB type of the results array of a response
+RESULTS_TYPE = f"STRUCT(cohort VARCHAR, prices {PRICE_TYPE}[])[]"
+
+# Columns of the *_quotes views, in order
+QUOTE_COLUMNS = [
+    "timestamp", "source", "route_id", "sample_type", "pickup", "destination", "search_id", "result_index",
+    "provider", "product", "service_level",
+    "price_min", "price_max", "price_min_discounted", "price_max_discounted",
+    "wait_min_seconds", "wait_max_seconds", "trip_seconds", "distance_meters", "surge_multiplier",
+]
+
+def _literal(value):
+    """SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _list(paths):
+    """SQL list of file paths"""
+    return "[" + ", ".join(_literal(path) for path in paths) + "]"
+
+def find_sources(paths):
+    """
+    Classify the files under the given paths
+
+    Args:
+        paths (list): Files or directories
+
+    Returns:
+        dict: Lists of paths under "csv", "json", "archive" and "columnar"
+    """
+    sources = {"csv": [], "json": [], "archive": [], "columnar": []}
+    for path in paths:
+        if os.path.isfile(path):
+            kind = "csv" if path.endswith(".csv") else "json" if path.endswith(".json") else None
+            if kind:
+                sources[kind].append(path)
+            continue
+        for directory, subdirectories, files in os.walk(path):
+            if "meta.json" in files and any(name.endswith(".bin") for name in files):
+                sources["columnar"].append(directory)
+                subdirectories.clear()
+                continue
+            if "objects" in subdirectories and "pointers" in subdirectories:
+                sources["archive"].append(directory)
+                subdirectories.remove("objects")
+                subdirectories.remove("pointers")
+            for name in sorted(files):
+                if name.endswith(".csv"):
+                    sources["csv"].append(os.path.join(directory, name))
+                elif name.endswith(".json"):
+                    sources["json"].append(os.path.join(directory, name))
+    return sources
+
+def _csv_header(path):
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+def csv_select(paths, header):
+    """
+    SELECT normalizing ride_prices.csv files that share a header
+
+    Returns:
+        str: Query with the raw CSV columns cast to their types
+    """
+    columns = {COLUMN_ALIASES.get(name, name): name for name in header}
+
+    def text(name):
+        return f'"{columns[name]}"' if name in columns else "NULL::VARCHAR"
+
+    def number(name, kind):
+        return f'TRY_CAST("{columns[name]}" AS {kind})' if name in columns else f"NULL::{kind}"
+
+    return f"""
+        SELECT TRY_CAST("date" || ' ' || "time" AS TIMESTAMP) AS "timestamp", filename AS source,
+               {text("search_id")} AS search_id, {text("sample_type")} AS sample_type,
+               {text("pickup")} AS pickup, {text("destination")} AS destination,
+               {text("provider")} AS provider, {text("product")} AS product, {text("service_level")} AS service_level,
+               {number("price_min", "DOUBLE")} AS price_min, {number("price_max", "DOUBLE")} AS price_max,
+               {number("price_min_discounted", "DOUBLE")} AS price_min_discounted,
+               {number("price_max_discounted", "DOUBLE")} AS price_max_discounted,
+               {number("wait_min_seconds", "BIGINT")} AS wait_min_seconds,
+               {number("wait_max_seconds", "BIGINT")} AS wait_max_seconds,
+               {number("trip_seconds", "BIGINT")} AS trip_seconds,
+               {number("distance_meters", "BIGINT")} AS distance_meters,
+               {number("surge_multiplier", "DOUBLE")} AS surge_multiplier
+        FROM read_csv({_list(paths)}, header = true, all_varchar = true, filename = true)"""
+
+def _option_columns(price="price"):
+    """Quote columns taken from a flattened price option struct (cents to dollars)"""
+    return f"""
+               {price}.provider AS provider, {price}.product AS product, {price}.service_level AS service_level,
+               {price}.price_min / 100 AS price_min, {price}.price_max / 100 AS price_max,
+               {price}.price_min_discounted / 100 AS price_min_discounted,
+               {price}.price_max_discounted / 100 AS price_max_discounted,
+               struct_extract({price}.est_pickup_wait_time, 'min') AS wait_min_seconds,
+               struct_extract({price}.est_pickup_wait_time, 'max') AS wait_max_seconds,
+               {price}.est_time_after_pickup_till_dropoff AS trip_seconds,
+               {price}.distance_meters AS distance_meters, {price}.surge_multiplier AS surge_multiplier"""
+
+def _flatten(name, source, columns):
+    """
+    Views flattening results[*].prices[*] of a relation with a results column
+
+    Creates <name>_results (one row per result) and <name>_options (one
+    row per price option, as a `price` struct).
+    """
+    return [
+        f"""CREATE OR REPLACE VIEW {name}_results AS
+        SELECT {columns}, generate_subscripts(results, 1) - 1 AS result_index, unnest(results) AS result
+        FROM {source}""",
+        f"""CREATE OR REPLACE VIEW {name}_options AS
+        SELECT * EXCLUDE (result), result.cohort AS cohort, unnest(result.prices) AS price
+        FROM {name}_results""",
+    ]
+
+def view_statements(sources):
+    """
+    SQL registering the raw tables and views of the given sources
+
+    Args:
+        sources (dict): From find_sources(); columnar histories are loaded
+            separately by register_columnar()
+
+    Returns:
+        list: Statements to execute in order
+    """
+    statements = []
+    quote_views = []
+    basename = r"regexp_extract(filename, '[^/\\]+$')"
+
+    # Files sharing a header are scanned together; the schemas are unioned by name
+    groups = {}
+    for path in sources["csv"]:
+        groups.setdefault(tuple(_csv_header(path)), []).append(path)
+    selects = [csv_select(paths, header) for header, paths in groups.items() if header]
+    if selects:
+        statements.append("CREATE OR REPLACE VIEW ride_prices AS" + "\n        UNION ALL BY NAME".join(selects))
+        statements.append(f"""CREATE OR REPLACE VIEW csv_quotes AS
+        SELECT p."timestamp", p.source, coalesce(r.route_id, p.pickup || ' to ' || p.destination) AS route_id,
+               coalesce(p.sample_type, r.sample_type) AS sample_type, p.pickup, p.destination, p.search_id,
+               0 AS result_index, p.provider, p.product, p.service_level,
+               p.price_min, p.price_max, p.price_min_discounted, p.price_max_discounted,
+               p.wait_min_seconds, p.wait_max_seconds, p.trip_seconds, p.distance_meters, p.surge_multiplier
+        FROM ride_prices p
+        LEFT JOIN routes r ON r.origin_name = p.pickup AND r.destination_name = p.destination""")
+        quote_views.append("csv_quotes")
+
+    if sources["json"]:
+        columns = f"{{'search_id': 'VARCHAR', 'timestamp': 'VARCHAR', 'results': '{RESULTS_TYPE}'}}"
+        statements.append(f"""CREATE OR REPLACE VIEW responses AS
+        SELECT * FROM read_json({_list(sources["json"])}, format = 'auto', columns = {columns}, filename = true)""")
+        statements.extend(_flatten("response", "responses", 'filename, search_id, "timestamp" AS response_timestamp'))
+        # Collector files are data_<sample>_pair<n>_<ts>.json; manual_collect files are data_<Pickup>_to_<Dest>_<ts>.json
+        collector = r"'^data_(.+)_pair(\d+)_\d{8}_\d{6}\.json$'"
+        manual = r"'^data_(.+)_to_(.+)_\d{8}_\d{6}\.json$'"
+        statements.append(f"""CREATE OR REPLACE VIEW json_quotes AS
+        WITH named AS (
+            SELECT *, {basename} AS name FROM response_options
+        ), routed AS (
+            SELECT *,
+                   nullif(regexp_extract(name, {collector}, 1), '') AS collector_sample,
+                   nullif(regexp_extract(name, {collector}, 1), '') || '-' || regexp_extract(name, {collector}, 2)
+                       AS collector_route,
+                   nullif(replace(regexp_extract(name, {manual}, 1), '_', ' '), '') AS manual_pickup,
+                   nullif(replace(regexp_extract(name, {manual}, 2), '_', ' '), '') AS manual_destination
+            FROM named
+        )
+        SELECT coalesce(
+                   TRY_CAST(substr(o.response_timestamp, 1, 19) AS TIMESTAMP),
+                   try_strptime(regexp_extract(o.name, '(\\d{{8}}_\\d{{6}})\\.json$', 1), '%Y%m%d_%H%M%S')
+               ) AS "timestamp",
+               o.filename AS source,
+               coalesce(o.collector_route, r.route_id, o.manual_pickup || ' to ' || o.manual_destination) AS route_id,
+               coalesce(o.collector_sample, r.sample_type) AS sample_type,
+               coalesce(r.origin_name, o.manual_pickup) AS pickup,
+               coalesce(r.destination_name, o.manual_destination) AS destination,
+               o.search_id, o.result_index,{_option_columns("o.price")}
+        FROM routed o
+        LEFT JOIN routes r ON r.route_id = o.collector_route
+            OR (o.collector_route IS NULL AND r.origin_name = o.manual_pickup AND r.destination_name = o.manual_destination)""")
+        quote_views.append("json_quotes")
+
+    if sources["archive"]:
+        objects = [os.path.join(path, "objects", "*", "*.json") for path in sources["archive"]]
+        pointers = [os.path.join(path, "pointers", "*.jsonl") for path in sources["archive"]]
+        pointer_columns = (
+            "{'timestamp': 'VARCHAR', 'route_id': 'VARCHAR', 'sample_type': 'VARCHAR', 'pair_id': 'BIGINT', "
+            "'search_id': 'VARCHAR', 'response_timestamp': 'VARCHAR', 'hash': 'VARCHAR'}"
+        )
+        statements.append(f"""CREATE OR REPLACE VIEW archive_pointers AS
+        SELECT * FROM read_json({_list(pointers)}, format = 'newline_delimited', columns = {pointer_columns})""")
+        statements.append(f"""CREATE OR REPLACE VIEW archive_objects AS
+        SELECT regexp_extract(filename, '([0-9a-f]{{64}})\\.json$', 1) AS hash, results
+        FROM read_json({_list(objects)}, format = 'auto', columns = {{'results': '{RESULTS_TYPE}'}}, filename = true)""")
+        statements.extend(_flatten(
+            "archive",
+            "archive_pointers p JOIN archive_objects o USING (hash)",
+            'p."timestamp" AS collected_at, p.route_id, p.sample_type, p.search_id, hash',
+        ))
+        statements.append(f"""CREATE OR REPLACE VIEW archive_quotes AS
+        SELECT TRY_CAST(o.collected_at AS TIMESTAMP) AS "timestamp", 'archive:' || o.hash AS source,
+               o.route_id, o.sample_type, r.origin_name AS pickup, r.destination_name AS destination,
+               o.search_id, o.result_index,{_option_columns("o.price")}
+        FROM archive_options o
+        LEFT JOIN routes r ON r.route_id = o.route_id""")
+        quote_views.append("archive_quotes")
+
+    if sources["columnar"]:
+        statements.append("""CREATE OR REPLACE VIEW columnar_quotes AS
+        SELECT h."timestamp", h.source, coalesce(r.route_id, h.pickup || ' to ' || h.destination) AS route_id,
+               h.sample_type, h.pickup, h.destination, h.search_id, 0 AS result_index,
+               h.provider, h.product, h.service_level,
+               h.price_min / 100 AS price_min, h.price_max / 100 AS price_max,
+               h.price_min_discounted / 100 AS price_min_discounted, h.price_max_discounted / 100 AS price_max_discounted,
+               nullif(h.wait_min_seconds, -1) AS wait_min_seconds, nullif(h.wait_max_seconds, -1) AS wait_max_seconds,
+               nullif(h.trip_seconds, -1) AS trip_seconds, nullif(h.distance_meters, -1) AS distance_meters,
+               h.surge_multiplier
+        FROM history h
+        LEFT JOIN routes r ON r.origin_name = h.pickup AND r.destination_name = h.destination""")
+        quote_views.append("columnar_quotes")
+
+    if quote_views:
+        columns = ", ".join(f'"{column}"' for column in QUOTE_COLUMNS)
+        statements.append(
+            "CREATE OR REPLACE VIEW quotes AS\n        "
+            + "\n        UNION ALL\n        ".join(f"SELECT {columns} FROM {view}" for view in quote_views)
+        )
+    return statements
+
+def register_routes(connection, routes=None):
+    """Load the route registry into a routes table"""
+    routes = load_routes() if routes is None else routes
+    connection.execute("""CREATE OR REPLACE TABLE routes (
+        route_id VARCHAR, sample_type VARCHAR, pair_id BIGINT, matched_route_id VARCHAR,
+        origin_name VARCHAR, origin_lat DOUBLE, origin_lng DOUBLE,
+        destination_name VARCHAR, destination_lat DOUBLE, destination_lng DOUBLE)""")
+    if routes:
+        connection.executemany("INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (
+                route["route_id"], route["sample_type"], route.get("pair_id"), route.get("matched_route_id"),
+                route["origin"]["name"], route["origin"]["lat"], route["origin"]["lng"],
+                route["destination"]["name"], route["destination"]["lat"], route["destination"]["lng"],
+            )
+            for route in routes
+        ])
+
+def register_columnar(connection, paths):
+    """
+    Load columnar histories into a history table
+
+    The memory-mapped columns are handed to DuckDB as NumPy arrays and
+    copied into its own compressed storage.
+    """
+    import numpy as np
+    from src.columnar import SCHEMA, ColumnarHistory
+    connection.execute("DROP TABLE IF EXISTS history")
+    for index, path in enumerate(paths):
+        history = ColumnarHistory(path)
+        columns = {"source": np.full(len(history), path, dtype=object)}
+        for name, kind in SCHEMA.items():
+            if name == "timestamp":
+                columns[name] = np.asarray(history.column(name)).astype("datetime64[s]")
+            elif kind == "string":
+                columns[name] = history.string_column(name).astype(object)
+            else:
+                columns[name] = np.asarray(history.column(name))
+        # DuckDB resolves the `columns` dict of arrays by name (a replacement scan)
+        if index:
+            connection.execute("INSERT INTO history SELECT * FROM columns")
+        else:
+            connection.execute("CREATE TABLE history AS SELECT * FROM columns")
+
+def connect(paths=(DEFAULT_SOURCE,), database=":memory:", threads=None, routes=None):
+    """
+    Open a DuckDB connection with the history registered
+
+    Args:
+        paths (list): Files or directories to search for sources
+        database (str): DuckDB database file (default: in memory)
+        threads (int): DuckDB worker threads (default: one per core)
+        routes (list): Route registry (default: load_routes())
+
+    Returns:
+        tuple: (duckdb.DuckDBPyConnection, sources dict from find_sources())
+
+    Raises:
+        ImportError: If DuckDB is not installed
+    """
+    if duckdb is None:
+        raise ImportError("SQL analytics requires duckdb (pip install duckdb)")
+    connection = duckdb.connect(database)
+    if threads:
+        connection.execute(f"SET threads = {int(threads)}")
+    sources = find_sources(paths)
+    register_routes(connection, routes)
+    if sources["columnar"]:
+        register_columnar(connection, sources["columnar"])
+    for statement in view_statements(sources):
+        connection.execute(statement)
+    return connection, sources
+
+def format_rows(columns, rows, output_format="table"):
+    """
+    Render a result set
+
+    Args:
+        columns (list): Column names
+        rows (list): Row tuples
+        output_format (str): "table", "csv" or "json"
+
+    Returns:
+        str: Rendered result
+    """
+    if output_format == "json":
+        return json.dumps([dict(zip(columns, row)) for row in rows], indent=2, default=str)
+    if output_format == "csv":
+        lines = [",".join(columns)]
+        lines += [",".join("" if value is None else str(value) for value in row) for row in rows]
+        return "\n".join(lines)
+    cells = [["" if value is None else str(value) for value in row] for row in rows]
+    widths = [max([len(column)] + [len(row[i]) for row in cells]) for i, column in enumerate(columns)]
+    lines = ["  ".join(column.upper().ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+def main():
+    """Run SQL against the collected history"""
+    parser = argparse.ArgumentParser(description="SQL over the collected history (DuckDB)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query", help="Run one SQL statement")
+    query_parser.add_argument("sql", help="SQL to run, or @file.sql")
+    subparsers.add_parser("tables", help="List the registered tables and views")
+    subparsers.add_parser("shell", help="Read statements from standard input, one per line")
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--source", action="append", help=f"File or directory to register (default: {DEFAULT_SOURCE})")
+        subparser.add_argument("--database", default=":memory:", help="DuckDB database file")
+        subparser.add_argument("--threads", type=int, help="DuckDB worker threads")
+        subparser.add_argument("--format", choices=["table", "csv", "json"], default="table", help="Output format")
+        subparser.add_argument("--routes-file", help="Route registry file (default: ROUTES_FILE or built-in samples)")
+    args = parser.parse_args()
+
+    try:
+        connection, sources = connect(
+            args.source or [DEFAULT_SOURCE], args.database, args.threads, load_routes(path=args.routes_file)
+        )
+    except ImportError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    def run(sql):
+        try:
+            result = connection.execute(sql)
+        except duckdb.Error as e:
+            print(f"Error: {e}")
+            return False
+        if result.description:
+            print(format_rows([column[0] for column in result.description], result.fetchall(), args.format))
+        return True
+
+    if args.command == "tables":
+        found = ", ".join(f"{len(paths)} {kind}" for kind, paths in sources.items() if paths) or "no sources"
+        print(f"Registered {found}")
+        run("SELECT table_name, table_type FROM information_schema.tables ORDER BY table_type, table_name")
+    elif args.command == "query":
+        sql = args.sql
+        if sql.startswith("@"):
+            with open(sql[1:]) as f:
+                sql = f.read()
+        if not run(sql):
+            sys.exit(1)
+    else:
+        for line in sys.stdin:
+            if line.strip():
+                run(line)
+
+if __name__ == "__main__":
+    main()
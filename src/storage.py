@@ -1,31 +1,548 @@
 """
 BigQuery storage module for ride price data
+
+Quotes are stored flattened, one row per price option, in a table
+partitioned by day on request_timestamp and clustered by route_id, provider
+and product. Queries that filter on a date range and a route read only
+those partitions and blocks instead of every response ever collected.
+
+Raw responses are kept out of the quotes table: they go to a separate
+raw_responses table, or to GCS with only a gs:// pointer in that table.
+Both tables share request_id.
+
+Hourly and daily aggregate tables (quotes_hourly, quotes_daily) hold counts,
+sums and extremes per route and product. Every save MERGEs the periods it
+touched, recomputed from those day partitions only, so dashboards read a
+few small rows instead of averaging the quotes table.
+
+Usage:
+    python -m src.storage setup [--require-partition-filter]
+    python -m src.storage migrate [--legacy-table price_comparisons] [--start 2025-03-01] [--end 2025-04-01] [--dry-run]
+    python -m src.storage estimate [--days 7] [--route-id Sample1-1]
+    python -m src.storage aggregate --start 2025-03-01 --end 2025-04-01
+    python -m src.storage read [--granularity daily] [--start 2025-03-01] [--route-id Sample1-1] [--combine]
 """
-import json
-import datetime
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
+from src.backends import create_backend
+from src.quotes import build_bigquery_rows, route_key
+from src.routes import load_routes
+
+# Dataset and tables
+DATASET_ID = os.environ.get("BIGQUERY_DATASET", "ride_pricing")
+QUOTES_TABLE_ID = "quotes"
+RAW_TABLE_ID = "raw_responses"
+
+# Unpartitioned table with nested ride_options written before the quotes table
+LEGACY_TABLE_ID = "price_comparisons"
+
+# Bucket for raw responses; unset keeps them in the raw_responses table
+RAW_BUCKET = os.environ.get("BIGQUERY_RAW_BUCKET")
+
+# Quotes are partitioned by day on this column and clustered on these
+PARTITION_FIELD = "request_timestamp"
+CLUSTERING_FIELDS = ["route_id", "provider", "product"]
+
+QUOTES_SCHEMA = [
+    bigquery.SchemaField("request_timestamp", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("request_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("search_id", "STRING"),
+    bigquery.SchemaField("route_id", "STRING"),
+    bigquery.SchemaField("sample_type", "STRING"),
+    bigquery.SchemaField("pickup_lat", "FLOAT"),
+    bigquery.SchemaField("pickup_lng", "FLOAT"),
+    bigquery.SchemaField("destination_lat", "FLOAT"),
+    bigquery.SchemaField("destination_lng", "FLOAT"),
+    bigquery.SchemaField("result_index", "INTEGER"),
+    bigquery.SchemaField("provider", "STRING"),
+    bigquery.SchemaField("product", "STRING"),
+    bigquery.SchemaField("service_level", "STRING"),
+    bigquery.SchemaField("price_min_cents", "INTEGER"),
+    bigquery.SchemaField("price_max_cents", "INTEGER"),
+    bigquery.SchemaField("price_min_discounted_cents", "INTEGER"),
+    bigquery.SchemaField("price_max_discounted_cents", "INTEGER"),
+    bigquery.SchemaField("currency", "STRING"),
+    bigquery.SchemaField("wait_time_min", "INTEGER"),
+    bigquery.SchemaField("wait_time_max", "INTEGER"),
+    bigquery.SchemaField("trip_time_seconds", "INTEGER"),
+    bigquery.SchemaField("distance_meters", "INTEGER"),
+    bigquery.SchemaField("surge_multiplier", "FLOAT")
+]
+
+RAW_SCHEMA = [
+    bigquery.SchemaField("request_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("request_timestamp", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("search_id", "STRING"),
+    bigquery.SchemaField("route_id", "STRING"),
+    bigquery.SchemaField("raw_response", "STRING"),
+    bigquery.SchemaField("raw_uri", "STRING")
+]
+
+QUOTE_COLUMNS = [field.name for field in QUOTES_SCHEMA]
+RAW_COLUMNS = [field.name for field in RAW_SCHEMA]
+
+# Legacy responses with a deterministic request_id and the registry route
+# they were collected for; a re-run derives the same request_id, so rows
+# that were already migrated are skipped
+LEGACY_SELECT = """
+WITH legacy AS (
+    SELECT l.*,
+           TO_HEX(MD5(FORMAT('%t|%t|%t|%t|%t|%t', l.request_timestamp, l.search_id,
+                             l.pickup_lat, l.pickup_lng, l.destination_lat, l.destination_lng))) AS request_id,
+           FORMAT('%.5f,%.5f:%.5f,%.5f', l.pickup_lat, l.pickup_lng,
+                  l.destination_lat, l.destination_lng) AS route_key
+    FROM `{legacy}` AS l
+    WHERE l.request_timestamp >= @start_time AND l.request_timestamp < @end_time
+),
+routed AS (
+    SELECT legacy.*, COALESCE(route.route_id, legacy.route_key) AS route_id, route.sample_type
+    FROM legacy
+    LEFT JOIN UNNEST(@routes) AS route ON route.route_key = legacy.route_key
+),
+migrated AS (
+    SELECT DISTINCT request_id FROM `{target}`
+    WHERE request_timestamp >= @start_time AND request_timestamp < @end_time
+)
+"""
+
+MIGRATE_QUOTES_SQL = """
+INSERT INTO `{target}` ({columns})
+""" + LEGACY_SELECT + """
+SELECT routed.request_timestamp, routed.request_id, routed.search_id, routed.route_id, routed.sample_type,
+       routed.pickup_lat, routed.pickup_lng, routed.destination_lat, routed.destination_lng,
+       CAST(NULL AS INT64) AS result_index,
+       ride.provider, ride.product, ride.service_level,
+       ride.price_min_cents, ride.price_max_cents,
+       CAST(NULL AS INT64) AS price_min_discounted_cents, CAST(NULL AS INT64) AS price_max_discounted_cents,
+       ride.currency, ride.wait_time_min, ride.wait_time_max,
+       ride.trip_time_seconds, ride.distance_meters, ride.surge_multiplier
+FROM routed
+CROSS JOIN UNNEST(routed.ride_options) AS ride
+WHERE routed.request_id NOT IN (SELECT request_id FROM migrated)
+"""
+
+MIGRATE_RAW_SQL = """
+INSERT INTO `{target}` ({columns})
+""" + LEGACY_SELECT + """
+SELECT routed.request_id, routed.request_timestamp, routed.search_id, routed.route_id,
+       routed.raw_response, CAST(NULL AS STRING) AS raw_uri
+FROM routed
+WHERE routed.request_id NOT IN (SELECT request_id FROM migrated)
+"""
+
+# A routine query: average prices per product of one route over recent days
+ESTIMATE_QUOTES_SQL = """
+SELECT provider, product, AVG(price_min_cents) AS price_min_cents
+FROM `{table}`
+WHERE request_timestamp >= @since AND route_id = @route_id
+GROUP BY provider, product
+"""
+
+ESTIMATE_LEGACY_SQL = """
+SELECT ride.provider, ride.product, AVG(ride.price_min_cents) AS price_min_cents
+FROM `{table}`, UNNEST(ride_options) AS ride
+WHERE request_timestamp >= @since
+  AND FORMAT('%.5f,%.5f:%.5f,%.5f', pickup_lat, pickup_lng, destination_lat, destination_lng) = @route_key
+GROUP BY provider, product
+"""
+
+# Pre-aggregated quotes per route and product: granularity -> (TIMESTAMP_TRUNC unit, partitioning)
+AGGREGATES = {
+    "hourly": ("HOUR", "DAY"),
+    "daily": ("DAY", "MONTH"),
+}
+
+# Quote columns summed and counted per period, so averages over any range are exact
+AGGREGATE_MEASURES = ["price_min_cents", "price_max_cents", "surge_multiplier", "wait_time_min", "trip_time_seconds"]
+
+# Quote columns whose extreme value is kept per period
+AGGREGATE_EXTREMES = [("price_min_cents", "MIN"), ("price_max_cents", "MAX"), ("surge_multiplier", "MAX")]
+
+AGGREGATE_KEYS = ["period_start", "route_id", "provider", "product"]
+
+_QUOTE_TYPES = {field.name: field.field_type for field in QUOTES_SCHEMA}
+
+AGGREGATE_SCHEMA = [
+    bigquery.SchemaField("period_start", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("route_id", "STRING"),
+    bigquery.SchemaField("sample_type", "STRING"),
+    bigquery.SchemaField("provider", "STRING"),
+    bigquery.SchemaField("product", "STRING"),
+    bigquery.SchemaField("quotes", "INTEGER"),
+    *[
+        field
+        for measure in AGGREGATE_MEASURES
+        for field in (bigquery.SchemaField(f"{measure}_sum", _QUOTE_TYPES[measure]),
+                      bigquery.SchemaField(f"{measure}_count", "INTEGER"))
+    ],
+    *[bigquery.SchemaField(f"{measure}_{function.lower()}", _QUOTE_TYPES[measure])
+      for measure, function in AGGREGATE_EXTREMES],
+    bigquery.SchemaField("updated_at", "TIMESTAMP")
+]
+
+AGGREGATE_COLUMNS = [field.name for field in AGGREGATE_SCHEMA]
+
+# Recompute the touched periods from the quotes table and upsert them; the
+# day filter limits the scan to the partitions that received new rows
+MERGE_AGGREGATES_SQL = """
+MERGE `{target}` AS agg
+USING (
+    SELECT TIMESTAMP_TRUNC(request_timestamp, {unit}) AS period_start, route_id,
+           ANY_VALUE(sample_type) AS sample_type, provider, product,
+           COUNT(*) AS quotes,
+           {measures},
+           CURRENT_TIMESTAMP() AS updated_at
+    FROM `{quotes}`
+    WHERE TIMESTAMP_TRUNC(request_timestamp, DAY) IN UNNEST(@days)
+      AND TIMESTAMP_TRUNC(request_timestamp, {unit}) IN UNNEST(@periods)
+    GROUP BY period_start, route_id, provider, product
+) AS fresh
+ON agg.period_start = fresh.period_start
+   AND agg.route_id IS NOT DISTINCT FROM fresh.route_id
+   AND agg.provider IS NOT DISTINCT FROM fresh.provider
+   AND agg.product IS NOT DISTINCT FROM fresh.product
+WHEN MATCHED THEN
+    UPDATE SET {updates}
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT ({columns}) VALUES ({values})
+WHEN NOT MATCHED BY SOURCE AND agg.period_start IN UNNEST(@periods) THEN
+    DELETE
+"""
+
+def routes_by_key(routes):
+    """
+    Index registry routes by the route_key() of their coordinates
+
+    Args:
+        routes (list): Route dicts from load_routes
+
+    Returns:
+        dict: route_key -> route
+    """
+    return {
+        route_key(route["origin"]["lat"], route["origin"]["lng"],
+                  route["destination"]["lat"], route["destination"]["lng"]): route
+        for route in routes
+    }
+
+def _routes_parameter(routes):
+    """Array-of-struct query parameter mapping route_key to route_id and sample_type"""
+    return bigquery.ArrayQueryParameter("routes", "STRUCT", [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("route_key", "STRING", key),
+            bigquery.ScalarQueryParameter("route_id", "STRING", route["route_id"]),
+            bigquery.ScalarQueryParameter("sample_type", "STRING", route["sample_type"])
+        )
+        for key, route in routes_by_key(routes).items()
+    ])
+
+def create_quotes_table(client, table_ref, require_partition_filter=False):
+    """
+    Create the partitioned, clustered quotes table if it doesn't exist
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        table_ref (str): Fully qualified table ID
+        require_partition_filter (bool): Reject queries that don't filter on request_timestamp
+
+    Returns:
+        bigquery.Table: Created or existing table
+    """
+    table = bigquery.Table(table_ref, schema=QUOTES_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY, field=PARTITION_FIELD
+    )
+    table.clustering_fields = CLUSTERING_FIELDS
+    table.require_partition_filter = require_partition_filter
+    return client.create_table(table, exists_ok=True)
+
+def create_raw_table(client, table_ref):
+    """
+    Create the raw_responses table, partitioned by day, if it doesn't exist
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        table_ref (str): Fully qualified table ID
+
+    Returns:
+        bigquery.Table: Created or existing table
+    """
+    table = bigquery.Table(table_ref, schema=RAW_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY, field=PARTITION_FIELD
+    )
+    table.clustering_fields = ["route_id"]
+    return client.create_table(table, exists_ok=True)
+
+def migrate_legacy_table(client, legacy_ref, quotes_ref, raw_ref, routes=None, start=None, end=None,
+                         dry_run=False):
+    """
+    Copy responses from the legacy price_comparisons table
+
+    Nested ride_options become flattened quotes rows and raw_response moves
+    to the raw table. Coordinates are matched to registry routes; others get
+    a coordinate route_key() as route_id. The migration is idempotent, so a
+    large table can be moved one date range at a time.
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        legacy_ref (str): Fully qualified legacy table ID
+        quotes_ref (str): Fully qualified quotes table ID
+        raw_ref (str): Fully qualified raw_responses table ID
+        routes (list): Registry routes (default: load_routes())
+        start (datetime): Earliest request_timestamp to copy (default: all)
+        end (datetime): Copy requests before this time (default: now)
+        dry_run (bool): Only estimate the bytes each statement would process
+
+    Returns:
+        dict: "quotes" and "raw" -> rows inserted, or bytes processed on a dry run
+    """
+    if routes is None:
+        routes = load_routes()
+    job_config = bigquery.QueryJobConfig(
+        dry_run=dry_run,
+        use_query_cache=False,
+        query_parameters=[
+            bigquery.ScalarQueryParameter("start_time", "TIMESTAMP", start or datetime(1970, 1, 1, tzinfo=timezone.utc)),
+            bigquery.ScalarQueryParameter("end_time", "TIMESTAMP", end or datetime.now(timezone.utc)),
+            _routes_parameter(routes)
+        ]
+    )
+
+    results = {}
+    statements = (
+        ("raw", MIGRATE_RAW_SQL, raw_ref, RAW_COLUMNS),
+        ("quotes", MIGRATE_QUOTES_SQL, quotes_ref, QUOTE_COLUMNS),
+    )
+    for name, template, target, columns in statements:
+        sql = template.format(legacy=legacy_ref, target=target, columns=", ".join(columns))
+        job = client.query(sql, job_config=job_config)
+        if dry_run:
+            results[name] = job.total_bytes_processed
+        else:
+            job.result()
+            results[name] = job.num_dml_affected_rows
+    return results
+
+def estimate_scan_bytes(client, quotes_ref, legacy_ref, route, days=7):
+    """
+    Dry-run a routine per-route query against the quotes and legacy tables
+
+    Dry runs account for partition pruning but not for clustering, so the
+    quotes figure is an upper bound; the billed bytes are usually lower.
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        quotes_ref (str): Fully qualified quotes table ID
+        legacy_ref (str): Fully qualified legacy table ID, or None
+        route (dict): Registry route to query
+        days (int): Days of history the query covers
+
+    Returns:
+        dict: "quotes" and "legacy" -> bytes processed
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    key = route_key(route["origin"]["lat"], route["origin"]["lng"],
+                    route["destination"]["lat"], route["destination"]["lng"])
+    queries = {"quotes": (ESTIMATE_QUOTES_SQL, quotes_ref)}
+    if legacy_ref:
+        queries["legacy"] = (ESTIMATE_LEGACY_SQL, legacy_ref)
+
+    results = {}
+    for name, (template, table_ref) in queries.items():
+        job_config = bigquery.QueryJobConfig(
+            dry_run=True,
+            use_query_cache=False,
+            query_parameters=[
+                bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+                bigquery.ScalarQueryParameter("route_id", "STRING", route["route_id"]),
+                bigquery.ScalarQueryParameter("route_key", "STRING", key)
+            ]
+        )
+        results[name] = client.query(template.format(table=table_ref), job_config=job_config).total_bytes_processed
+    return results
+
+def create_aggregate_table(client, table_ref, granularity):
+    """
+    Create an hourly or daily aggregate table if it doesn't exist
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        table_ref (str): Fully qualified table ID
+        granularity (str): "hourly" or "daily"
+
+    Returns:
+        bigquery.Table: Created or existing table
+    """
+    _, partitioning = AGGREGATES[granularity]
+    table = bigquery.Table(table_ref, schema=AGGREGATE_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=getattr(bigquery.TimePartitioningType, partitioning), field="period_start"
+    )
+    table.clustering_fields = CLUSTERING_FIELDS
+    return client.create_table(table, exists_ok=True)
+
+def _as_utc(value):
+    """Datetime or ISO string as an aware UTC datetime; naive values are taken as UTC like BigQuery does"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def period_starts(timestamps, granularity):
+    """
+    Distinct aggregate periods containing the given times
+
+    Args:
+        timestamps (iterable): Datetimes or ISO strings
+        granularity (str): "hourly" or "daily"
+
+    Returns:
+        list: Sorted period start datetimes (UTC)
+    """
+    unit, _ = AGGREGATES[granularity]
+    periods = set()
+    for timestamp in timestamps:
+        period = _as_utc(timestamp).replace(minute=0, second=0, microsecond=0)
+        if unit == "DAY":
+            period = period.replace(hour=0)
+        periods.add(period)
+    return sorted(periods)
+
+def merge_aggregates(client, quotes_ref, aggregate_ref, granularity, timestamps):
+    """
+    Bring the aggregate rows of the periods containing timestamps up to date
+
+    Every touched period is recomputed from the quotes of its day partitions
+    and merged into the aggregate table, so the update is exact, idempotent,
+    and never scans more than the days that were written to.
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        quotes_ref (str): Fully qualified quotes table ID
+        aggregate_ref (str): Fully qualified aggregate table ID
+        granularity (str): "hourly" or "daily"
+        timestamps (iterable): request_timestamp values of the new quotes
+
+    Returns:
+        int: Aggregate rows inserted, updated or deleted
+    """
+    periods = period_starts(timestamps, granularity)
+    if not periods:
+        return 0
+    unit, _ = AGGREGATES[granularity]
+    measures = [
+        expression
+        for measure in AGGREGATE_MEASURES
+        for expression in (f"SUM({measure}) AS {measure}_sum", f"COUNT({measure}) AS {measure}_count")
+    ] + [f"{function}({measure}) AS {measure}_{function.lower()}" for measure, function in AGGREGATE_EXTREMES]
+    values = [column for column in AGGREGATE_COLUMNS if column not in AGGREGATE_KEYS]
+    sql = MERGE_AGGREGATES_SQL.format(
+        target=aggregate_ref,
+        quotes=quotes_ref,
+        unit=unit,
+        measures=",\n           ".join(measures),
+        updates=", ".join(f"{column} = fresh.{column}" for column in values),
+        columns=", ".join(AGGREGATE_COLUMNS),
+        values=", ".join(f"fresh.{column}" for column in AGGREGATE_COLUMNS)
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("days", "TIMESTAMP", period_starts(periods, "daily")),
+        bigquery.ArrayQueryParameter("periods", "TIMESTAMP", periods)
+    ])
+    job = client.query(sql, job_config=job_config)
+    job.result()
+    return job.num_dml_affected_rows or 0
+
+def read_aggregates(client, aggregate_ref, start=None, end=None, route_id=None, provider=None, product=None,
+                    combine=False):
+    """
+    Read averages and extremes from an aggregate table
+
+    Args:
+        client (bigquery.Client): BigQuery client
+        aggregate_ref (str): Fully qualified aggregate table ID
+        start (datetime): Earliest period start to include
+        end (datetime): Include periods starting before this time
+        route_id (str): Only this route
+        provider (str): Only this provider
+        product (str): Only this product
+        combine (bool): One row per route and product over the whole range, instead of one per period
+
+    Returns:
+        list: Dicts with the group keys, quotes, avg_<measure> and the kept extremes
+    """
+    keys = AGGREGATE_KEYS[1:] if combine else AGGREGATE_KEYS
+    selects = keys + ["ANY_VALUE(sample_type) AS sample_type", "SUM(quotes) AS quotes"]
+    selects += [f"SAFE_DIVIDE(SUM({measure}_sum), SUM({measure}_count)) AS avg_{measure}"
+                for measure in AGGREGATE_MEASURES]
+    selects += [f"{function}({measure}_{function.lower()}) AS {function.lower()}_{measure}"
+                for measure, function in AGGREGATE_EXTREMES]
+
+    filters, parameters = [], []
+    for column, operator, name, value, field_type in (
+        ("period_start", ">=", "start_time", start, "TIMESTAMP"),
+        ("period_start", "<", "end_time", end, "TIMESTAMP"),
+        ("route_id", "=", "route_id", route_id, "STRING"),
+        ("provider", "=", "provider", provider, "STRING"),
+        ("product", "=", "product", product, "STRING"),
+    ):
+        if value is not None:
+            filters.append(f"{column} {operator} @{name}")
+            parameters.append(bigquery.ScalarQueryParameter(name, field_type, value))
+
+    sql = f"SELECT {', '.join(selects)} FROM `{aggregate_ref}`"
+    if filters:
+        sql += f" WHERE {' AND '.join(filters)}"
+    sql += f" GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}"
+    rows = client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=parameters)).result()
+    return [dict(row.items()) for row in rows]
 
 class BigQueryStorage:
     """BigQuery storage for ride price data"""
-    
-    def __init__(self, dataset_id="ride_pricing", table_id="price_comparisons"):
+
+    def __init__(self, dataset_id=DATASET_ID, table_id=QUOTES_TABLE_ID, raw_table_id=RAW_TABLE_ID,
+                 raw_bucket=RAW_BUCKET, require_partition_filter=False, routes=None, aggregate=True):
         """
         Initialize BigQuery storage
-        
+
         Args:
             dataset_id (str): BigQuery dataset ID
-            table_id (str): BigQuery table ID
+            table_id (str): Quotes table ID
+            raw_table_id (str): Raw responses table ID
+            raw_bucket (str): GCS bucket for raw responses; None stores them in the raw table
+            require_partition_filter (bool): Create the quotes table requiring a request_timestamp filter
+            routes (list): Registry routes used to tag quotes with route_id (default: load_routes())
+            aggregate (bool): Track saved quotes so flush_aggregates() can refresh the hourly
+                and daily aggregate tables
         """
         self.client = bigquery.Client()
         self.dataset_id = dataset_id
         self.table_id = table_id
+        self.raw_table_id = raw_table_id
         self.table_ref = f"{self.client.project}.{dataset_id}.{table_id}"
-        
-        # Ensure dataset and table exist
+        self.raw_table_ref = f"{self.client.project}.{dataset_id}.{raw_table_id}"
+        self.raw_bucket = raw_bucket
+        self.require_partition_filter = require_partition_filter
+        self.routes = routes_by_key(load_routes() if routes is None else routes)
+        self.aggregate = aggregate
+        self.aggregate_refs = {
+            granularity: f"{self.client.project}.{dataset_id}.{table_id}_{granularity}"
+            for granularity in AGGREGATES
+        }
+        self._raw_backend = None
+        self._pending_hours = set()
+
+        # Ensure dataset and tables exist
         self._setup()
-    
+
     def _setup(self):
-        """Set up BigQuery dataset and table if they don't exist"""
+        """Set up BigQuery dataset and tables if they don't exist"""
         try:
             # Try to get dataset (creates if it doesn't exist)
             try:
@@ -35,100 +552,238 @@ class BigQueryStorage:
                 dataset.location = "US"
                 self.client.create_dataset(dataset, exists_ok=True)
                 print(f"Created dataset: {self.dataset_id}")
-            
-            # Try to get table (creates if it doesn't exist)
+
+            # Try to get tables (creates if they don't exist)
             try:
                 self.client.get_table(self.table_ref)
             except Exception:
-                schema = [
-                    bigquery.SchemaField("request_timestamp", "TIMESTAMP"),
-                    bigquery.SchemaField("pickup_lat", "FLOAT"),
-                    bigquery.SchemaField("pickup_lng", "FLOAT"),
-                    bigquery.SchemaField("destination_lat", "FLOAT"),
-                    bigquery.SchemaField("destination_lng", "FLOAT"),
-                    bigquery.SchemaField("search_id", "STRING"),
-                    bigquery.SchemaField("raw_response", "STRING"),
-                    bigquery.SchemaField("ride_options", "RECORD", mode="REPEATED", fields=[
-                        bigquery.SchemaField("provider", "STRING"),
-                        bigquery.SchemaField("product", "STRING"),
-                        bigquery.SchemaField("service_level", "STRING"),
-                        bigquery.SchemaField("price_min_cents", "INTEGER"),
-                        bigquery.SchemaField("price_max_cents", "INTEGER"),
-                        bigquery.SchemaField("currency", "STRING"),
-                        bigquery.SchemaField("wait_time_min", "INTEGER"),
-                        bigquery.SchemaField("wait_time_max", "INTEGER"),
-                        bigquery.SchemaField("trip_time_seconds", "INTEGER"),
-                        bigquery.SchemaField("distance_meters", "INTEGER"),
-                        bigquery.SchemaField("surge_multiplier", "FLOAT")
-                    ])
-                ]
-                
-                table = bigquery.Table(self.table_ref, schema=schema)
-                self.client.create_table(table, exists_ok=True)
+                create_quotes_table(self.client, self.table_ref, self.require_partition_filter)
                 print(f"Created table: {self.table_ref}")
-                
+            try:
+                self.client.get_table(self.raw_table_ref)
+            except Exception:
+                create_raw_table(self.client, self.raw_table_ref)
+                print(f"Created table: {self.raw_table_ref}")
+            for granularity, table_ref in self.aggregate_refs.items():
+                try:
+                    self.client.get_table(table_ref)
+                except Exception:
+                    create_aggregate_table(self.client, table_ref, granularity)
+                    print(f"Created table: {table_ref}")
+
         except Exception as e:
             print(f"Error setting up BigQuery: {e}")
-    
-    def save(self, response_data, pickup_lat, pickup_lng, dest_lat, dest_lng):
+
+    def _store_raw(self, raw_row):
+        """Upload the raw response to GCS and point raw_uri at it"""
+        if self._raw_backend is None:
+            self._raw_backend = create_backend("gcs", bucket_name=self.raw_bucket)
+        timestamp = datetime.fromisoformat(raw_row["request_timestamp"])
+        name = f"raw/{timestamp:%Y/%m/%d}/{raw_row['request_id']}.json"
+        self._raw_backend.put(name, raw_row["raw_response"], content_type='application/json')
+        raw_row["raw_uri"] = self._raw_backend.uri(name)
+        raw_row["raw_response"] = None
+
+    def build_rows(self, response_data, pickup_lat, pickup_lng, dest_lat, dest_lng, route_id=None, sample_type=None,
+                   timestamp=None):
+        """
+        Build quotes and raw rows, tagged with the registry route of the coordinates
+
+        Returns:
+            tuple: (list of quotes rows, raw_responses row)
+        """
+        if route_id is None:
+            route = self.routes.get(route_key(pickup_lat, pickup_lng, dest_lat, dest_lng))
+            if route:
+                route_id = route["route_id"]
+                sample_type = sample_type or route["sample_type"]
+        return build_bigquery_rows(
+            response_data, pickup_lat, pickup_lng, dest_lat, dest_lng,
+            timestamp=timestamp, route_id=route_id, sample_type=sample_type
+        )
+
+    def save(self, response_data, pickup_lat, pickup_lng, dest_lat, dest_lng, route_id=None, sample_type=None):
         """
         Save ride price data to BigQuery
-        
+
+        The aggregate tables are not touched; call flush_aggregates() once
+        per collection cycle to merge everything saved since.
+
         Args:
-            response_data (dict): API response data
+            response_data (dict or bytes): API response, decoded or raw; raw
+                bytes are stored as raw_response without re-serializing
             pickup_lat (float): Pickup latitude
             pickup_lng (float): Pickup longitude
             dest_lat (float): Destination latitude
             dest_lng (float): Destination longitude
-        
+            route_id (str): Registry route id (default: looked up from the coordinates)
+            sample_type (str): Sample label, e.g. "Sample1"
+
         Returns:
             bool: True if successful, False otherwise
         """
-        if not response_data or "results" not in response_data:
+        if not response_data or (isinstance(response_data, dict) and "results" not in response_data):
             print("Invalid response data")
             return False
-        
+
         try:
-            # Extract ride options
-            ride_options = []
-            for result in response_data.get("results", []):
-                for price in result.get("prices", []):
-                    option = {
-                        "provider": price.get("provider"),
-                        "product": price.get("product"),
-                        "service_level": price.get("service_level"),
-                        "price_min_cents": price.get("price_min"),
-                        "price_max_cents": price.get("price_max"),
-                        "currency": price.get("currency"),
-                        "wait_time_min": price.get("est_pickup_wait_time", {}).get("min"),
-                        "wait_time_max": price.get("est_pickup_wait_time", {}).get("max"),
-                        "trip_time_seconds": price.get("est_time_after_pickup_till_dropoff"),
-                        "distance_meters": price.get("distance_meters"),
-                        "surge_multiplier": price.get("surge_multiplier")
-                    }
-                    ride_options.append(option)
-            
-            # Prepare row for insertion
-            row = {
-                "request_timestamp": datetime.datetime.now().isoformat(),
-                "pickup_lat": pickup_lat,
-                "pickup_lng": pickup_lng,
-                "destination_lat": dest_lat,
-                "destination_lng": dest_lng,
-                "search_id": response_data.get("search_id"),
-                "raw_response": json.dumps(response_data),
-                "ride_options": ride_options
-            }
-            
-            # Insert into BigQuery
-            errors = self.client.insert_rows_json(self.table_ref, [row])
-            
+            quote_rows, raw_row = self.build_rows(
+                response_data, pickup_lat, pickup_lng, dest_lat, dest_lng, route_id, sample_type
+            )
+            if self.raw_bucket:
+                self._store_raw(raw_row)
+
+            # Insert into BigQuery, raw first so every quote has its response
+            errors = self.client.insert_rows_json(self.raw_table_ref, [raw_row])
+            if not errors and quote_rows:
+                errors = self.client.insert_rows_json(self.table_ref, quote_rows)
+
             if errors:
-                print(f"Errors inserting row: {errors}")
+                print(f"Errors inserting rows: {errors}")
                 return False
-            
+
+            if self.aggregate and quote_rows:
+                self._pending_hours.update(period_starts((row["request_timestamp"] for row in quote_rows), "hourly"))
+
             return True
-            
+
         except Exception as e:
             print(f"Error saving to BigQuery: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def flush_aggregates(self):
+        """
+        Merge the quotes saved since the last flush into the hourly and daily aggregate tables
+
+        Runs one MERGE per aggregate table however many saves there were.
+
+        Returns:
+            dict: granularity -> aggregate rows changed
+        """
+        hours, self._pending_hours = sorted(self._pending_hours), set()
+        if not hours:
+            return {}
+        return {
+            granularity: merge_aggregates(self.client, self.table_ref, table_ref, granularity, hours)
+            for granularity, table_ref in self.aggregate_refs.items()
+        }
+
+    def rebuild_aggregates(self, start, end):
+        """
+        Recompute the aggregate rows of every period from start up to (excluding) end
+
+        Args:
+            start (datetime): First time to cover
+            end (datetime): End of the range
+
+        Returns:
+            dict: granularity -> aggregate rows changed
+        """
+        hour = _as_utc(start).replace(minute=0, second=0, microsecond=0)
+        end = _as_utc(end)
+        hours = []
+        while hour < end:
+            hours.append(hour)
+            hour += timedelta(hours=1)
+        return {
+            granularity: merge_aggregates(self.client, self.table_ref, table_ref, granularity, hours)
+            for granularity, table_ref in self.aggregate_refs.items()
+        }
+
+    def read_aggregates(self, granularity="daily", start=None, end=None, route_id=None, provider=None, product=None,
+                        combine=False):
+        """
+        Read pre-aggregated prices; see read_aggregates()
+
+        Args:
+            granularity (str): "hourly" or "daily"
+
+        Returns:
+            list: One dict per period (or per route and product with combine)
+        """
+        return read_aggregates(self.client, self.aggregate_refs[granularity], start, end,
+                               route_id, provider, product, combine)
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD command line date as UTC midnight"""
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+def main():
+    """Create, migrate to, size, or aggregate the partitioned quotes table"""
+    parser = argparse.ArgumentParser(description='Manage the partitioned BigQuery quotes table')
+    parser.add_argument('--dataset', default=DATASET_ID, help='BigQuery dataset ID')
+    parser.add_argument('--table', default=QUOTES_TABLE_ID, help='Quotes table ID')
+    parser.add_argument('--raw-table', default=RAW_TABLE_ID, help='Raw responses table ID')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    setup_parser = subparsers.add_parser('setup', help='Create the dataset and tables')
+    setup_parser.add_argument('--require-partition-filter', action='store_true',
+                              help='Reject quotes queries without a request_timestamp filter')
+
+    migrate_parser = subparsers.add_parser('migrate', help='Copy the legacy price_comparisons table')
+    migrate_parser.add_argument('--legacy-table', default=LEGACY_TABLE_ID, help='Legacy table ID')
+    migrate_parser.add_argument('--start', type=parse_date, help='First day to copy (YYYY-MM-DD)')
+    migrate_parser.add_argument('--end', type=parse_date, help='Copy days before this one (YYYY-MM-DD)')
+    migrate_parser.add_argument('--dry-run', action='store_true', help='Only report the bytes each statement would scan')
+
+    estimate_parser = subparsers.add_parser('estimate', help='Compare bytes scanned by a routine query')
+    estimate_parser.add_argument('--legacy-table', default=LEGACY_TABLE_ID, help='Legacy table ID to compare against')
+    estimate_parser.add_argument('--days', type=int, default=7, help='Days of history the query covers')
+    estimate_parser.add_argument('--route-id', default='Sample1-1', help='Route the query filters on')
+
+    aggregate_parser = subparsers.add_parser('aggregate', help='Rebuild the aggregate tables for a date range')
+    aggregate_parser.add_argument('--start', type=parse_date, required=True, help='First day to rebuild (YYYY-MM-DD)')
+    aggregate_parser.add_argument('--end', type=parse_date, required=True, help='Rebuild days before this one (YYYY-MM-DD)')
+
+    read_parser = subparsers.add_parser('read', help='Print pre-aggregated prices')
+    read_parser.add_argument('--granularity', choices=list(AGGREGATES), default='daily', help='Aggregate table to read')
+    read_parser.add_argument('--start', type=parse_date, help='First day to include (YYYY-MM-DD)')
+    read_parser.add_argument('--end', type=parse_date, help='Include days before this one (YYYY-MM-DD)')
+    read_parser.add_argument('--route-id', help='Only this route')
+    read_parser.add_argument('--provider', help='Only this provider')
+    read_parser.add_argument('--product', help='Only this product')
+    read_parser.add_argument('--combine', action='store_true', help='One row per route and product over the whole range')
+    args = parser.parse_args()
+
+    try:
+        storage = BigQueryStorage(args.dataset, args.table, args.raw_table,
+                                  require_partition_filter=getattr(args, 'require_partition_filter', False))
+        legacy_ref = f"{storage.client.project}.{args.dataset}.{getattr(args, 'legacy_table', LEGACY_TABLE_ID)}"
+
+        if args.command == 'setup':
+            print(f"Quotes table: {storage.table_ref}")
+            print(f"Raw responses table: {storage.raw_table_ref}")
+
+        elif args.command == 'migrate':
+            results = migrate_legacy_table(storage.client, legacy_ref, storage.table_ref, storage.raw_table_ref,
+                                           start=args.start, end=args.end, dry_run=args.dry_run)
+            unit = "bytes processed" if args.dry_run else "rows inserted"
+            for name, value in results.items():
+                print(f"{name}: {value or 0:,} {unit}")
+
+        elif args.command == 'estimate':
+            route = next((route for route in storage.routes.values() if route["route_id"] == args.route_id), None)
+            if route is None:
+                raise ValueError(f"Unknown route: {args.route_id}")
+            results = estimate_scan_bytes(storage.client, storage.table_ref, legacy_ref, route, args.days)
+            for name, value in results.items():
+                print(f"{name}: {value or 0:,} bytes")
+            if results.get("quotes") and results.get("legacy"):
+                print(f"Reduction: {results['legacy'] / results['quotes']:.0f}x")
+
+        elif args.command == 'aggregate':
+            for granularity, changed in storage.rebuild_aggregates(args.start, args.end).items():
+                print(f"{granularity}: {changed:,} rows changed")
+
+        elif args.command == 'read':
+            rows = storage.read_aggregates(args.granularity, args.start, args.end, args.route_id,
+                                           args.provider, args.product, args.combine)
+            for row in rows:
+                print(", ".join(f"{key}={value}" for key, value in row.items()))
+            print(f"{len(rows)} rows")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Server-sent events stream of newly collected quotes
+
+QuoteBroadcaster numbers every published quote, keeps the most recent ones
+in a bounded replay buffer, and fans them out to subscriber queues. Event ids
+are "<instance>-<number>", so ids from another process are never mistaken
+for this one's. register_stream_route exposes it as GET /quotes/stream;
+clients reconnecting with Last-Event-ID get what they missed from the buffer,
+or a reset event when it no longer holds all of it.
+"""
+import json
+import queue
+import threading
+import uuid
+from collections import deque
+from flask import Response, request, stream_with_context
+from src.query import route_names, to_quotes
+
+def _filter_values(args, name):
+    """Values of a query parameter that may be repeated or comma-separated"""
+    return {value for values in args.getlist(name) for value in values.split(",") if value}
+
+def _matches(quote, filters):
+    """Check a quote against route/provider/product filters (sets of allowed values)"""
+    return all(not allowed or quote[field] in allowed for field, allowed in filters.items())
+
+def parse_event_id(event_id):
+    """
+    Split an event id into its broadcaster instance and quote number
+
+    Args:
+        event_id (str): Event id of the form "<instance>-<number>"
+
+    Returns:
+        tuple: (instance, number)
+
+    Raises:
+        ValueError: If the id is not of that form
+    """
+    instance, _, number = event_id.rpartition("-")
+    if not instance:
+        raise ValueError(f"Malformed event id: {event_id}")
+    return instance, int(number)
+
+class QuoteBroadcaster:
+    """Publishes quotes to subscribers with a bounded replay buffer"""
+
+    def __init__(self, replay_size=5000, queue_size=1000, routes=None):
+        """
+        Initialize the broadcaster
+
+        Args:
+            replay_size (int): Most recent quotes kept for reconnecting clients
+            queue_size (int): Quotes buffered per subscriber; a subscriber that
+                falls further behind is disconnected and must reconnect
+            routes (list): Route registry used to name routes (default: load_routes())
+        """
+        self.queue_size = queue_size
+        # Prefixes event ids so that a restarted process never reuses them
+        self.instance = uuid.uuid4().hex[:12]
+        self._route_ids = route_names(routes)
+        self._replay = deque(maxlen=replay_size)
+        self._subscribers = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self):
+        """Number of connected subscribers"""
+        with self._lock:
+            return len(self._subscribers)
+
+    def event_id(self, number):
+        """Event id of the quote with this number"""
+        return f"{self.instance}-{number}"
+
+    def publish(self, rows):
+        """
+        Publish collected rows to every subscriber whose filters they match
+
+        Args:
+            rows (iterable): ride_prices.csv rows of either schema
+
+        Returns:
+            int: Quotes published; rows that can't be parsed are skipped
+        """
+        quotes = to_quotes(rows, self._route_ids)
+        with self._lock:
+            events = []
+            for quote in quotes:
+                events.append((self._next_id, quote))
+                self._next_id += 1
+            self._replay.extend(events)
+            subscribers = list(self._subscribers.items())
+        for subscriber, filters in subscribers:
+            for event in events:
+                if not _matches(event[1], filters):
+                    continue
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    # Too slow: drop it; the client reconnects and resumes from the replay buffer
+                    self.unsubscribe(subscriber)
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    subscriber.put_nowait(None)
+                    break
+        return len(quotes)
+
+    def subscribe(self, last_event_id=None, filters=None):
+        """
+        Register a subscriber
+
+        Quotes published from now on go to the returned queue. Quotes after
+        last_event_id that were published before are returned separately, so
+        they are replayed lazily instead of filling the queue.
+
+        Args:
+            last_event_id (tuple): (instance, number) from parse_event_id;
+                buffered quotes after it are replayed
+            filters (dict): Allowed values per quote field; other quotes are skipped
+
+        Returns:
+            tuple: (queue.Queue receiving (number, quote) tuples, or None when
+                dropped; iterator of the matching (number, quote) tuples to replay).
+                If quotes after last_event_id have left the buffer, or the id is
+                from another instance, the iterator instead yields a single
+                (number, None) reset: quotes up to number can't be replayed.
+        """
+        filters = filters or {}
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[subscriber] = filters
+            next_id = self._next_id
+            buffered = list(self._replay) if last_event_id is not None else []
+        if last_event_id is None:
+            return subscriber, iter(())
+        instance, number = last_event_id
+        if instance != self.instance:
+            return subscriber, iter([(next_id - 1, None)])
+        if number == next_id - 1:
+            return subscriber, iter(())
+        oldest_id = buffered[0][0] if buffered else next_id
+        if number >= next_id or oldest_id > number + 1:
+            return subscriber, iter([(next_id - 1, None)])
+        replay = (event for event in buffered if event[0] > number and _matches(event[1], filters))
+        return subscriber, replay
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+def format_event(event_id, quote):
+    """Format one quote as a server-sent event"""
+    return f"id: {event_id}\nevent: quote\ndata: {json.dumps(quote)}\n\n"
+
+def format_reset(event_id, last_event_id):
+    """Format the event telling a client that quotes after last_event_id up to event_id are lost"""
+    return f"id: {event_id}\nevent: reset\ndata: {json.dumps({'last_event_id': last_event_id})}\n\n"
+
+def register_stream_route(app, broadcaster, keepalive_seconds=15.0):
+    """
+    Add GET /quotes/stream to a Flask app
+
+    Query parameters route, provider and product filter the stream and may
+    be repeated or comma-separated. Last-Event-ID (header, or the
+    last_event_id parameter) replays buffered quotes after that id; if some
+    of them are no longer buffered, or the id was issued by another
+    broadcaster instance, a reset event is sent instead and the stream
+    continues with new quotes.
+
+    Args:
+        app (flask.Flask): Application
+        broadcaster (QuoteBroadcaster): Source of quotes
+        keepalive_seconds (float): Interval of comment lines that keep idle
+            connections open
+    """
+    @app.route("/quotes/stream", methods=["GET"])
+    def quote_stream():
+        filters = {
+            "route_id": _filter_values(request.args, "route"),
+            "provider": _filter_values(request.args, "provider"),
+            "product": _filter_values(request.args, "product"),
+        }
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        try:
+            parsed_id = parse_event_id(last_event_id) if last_event_id else None
+        except ValueError:
+            return "Error: Last-Event-ID must be an event id of the form <instance>-<number>", 400
+
+        subscriber, replay = broadcaster.subscribe(parsed_id, filters)
+
+        def events():
+            try:
+                yield "retry: 1000\n\n"
+                for number, quote in replay:
+                    if quote is None:
+                        yield format_reset(broadcaster.event_id(number), last_event_id)
+                    else:
+                        yield format_event(broadcaster.event_id(number), quote)
+                while True:
+                    try:
+                        event = subscriber.get(timeout=keepalive_seconds)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    if event is None:
+                        return
+                    number, quote = event
+                    yield format_event(broadcaster.event_id(number), quote)
+            finally:
+                broadcaster.unsubscribe(subscriber)
+
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
@@ -0,0 +1,395 @@
+"""
+Vectorized unit-price analytics over the typed quote history
+
+A QuoteTable holds the history as NumPy columns, with every string column
+dictionary-encoded. Metrics (price per km, per minute, surge-normalized
+fares) are whole-column arithmetic, and group-bys combine the integer codes
+of the grouping dimensions into one key aggregated with np.bincount, so a
+query is a few linear passes over the columns with no Python per row.
+
+Tables are read from a ride_prices.csv file, an encoded history (.npz from
+src/history.py) or a columnar history directory (src/columnar.py).
+
+Usage: python -m src.unitprice data/history.npz --metric per_km --by route,service_level
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from src.history import (
+    CATEGORICAL_COLUMNS, EncodedHistory, _dictionary_encode, decode_columns, encode_columns, read_csv_columns,
+)
+
+# Metric name -> description; prices are in dollars
+METRICS = {
+    "price": "Price",
+    "per_km": "Price per km of trip distance",
+    "per_minute": "Price per minute of trip time",
+    "base_fare": "Price divided by the surge multiplier",
+    "base_per_km": "Surge-normalized price per km",
+    "base_per_minute": "Surge-normalized price per minute",
+}
+
+# Grouping dimensions besides the categorical columns
+DERIVED_DIMENSIONS = ["route", "hour_of_week", "weekday", "hour"]
+
+# Providers compared by spreads(), as (first, second)
+SPREAD_PROVIDERS = ("UBER", "LYFT")
+
+# Combined group keys up to this many values are aggregated with np.bincount
+DENSE_KEY_LIMIT = 1 << 24
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+class QuoteTable:
+    """
+    Quote history as typed NumPy columns
+
+    Attributes:
+        dictionaries (dict): Sorted distinct strings per categorical column
+        codes (dict): Dictionary codes per categorical column
+        timestamp (numpy.ndarray): Epoch seconds (collection-local time)
+        prices (dict): Integer cents per price column
+        trip_seconds (numpy.ndarray): Trip time, MISSING if unknown
+        distance_meters (numpy.ndarray): Trip distance, MISSING if unknown
+        surge (numpy.ndarray): Surge multipliers
+    """
+
+    def __init__(self, dictionaries, codes, timestamp, prices, trip_seconds, distance_meters, surge):
+        self.dictionaries = dictionaries
+        self.codes = codes
+        self.timestamp = timestamp
+        self.prices = prices
+        self.trip_seconds = trip_seconds
+        self.distance_meters = distance_meters
+        self.surge = surge
+        self._dimensions = {}
+        self._metrics = {}
+        self._keys = None
+
+    def __len__(self):
+        return len(self.surge)
+
+    @classmethod
+    def from_encoded(cls, encoded):
+        """Build a table from an EncodedHistory"""
+        columns = decode_columns(encoded)
+        return cls(
+            encoded.dictionaries, encoded.codes, columns["timestamp"].astype(np.int64),
+            {name: columns[name] for name in ("price_min", "price_max")},
+            columns["trip_seconds"], columns["distance_meters"], columns["surge_multiplier"],
+        )
+
+    @classmethod
+    def from_columnar(cls, history):
+        """Build a table from a ColumnarHistory (string columns are dictionary-encoded once)"""
+        dictionaries, codes = {}, {}
+        for name in CATEGORICAL_COLUMNS:
+            if name in history.schema:
+                dictionaries[name], codes[name] = _dictionary_encode(history.string_column(name))
+        return cls(
+            dictionaries, codes, np.asarray(history.column("timestamp")),
+            {name: np.asarray(history.column(name)) for name in ("price_min", "price_max")},
+            np.asarray(history.column("trip_seconds")), np.asarray(history.column("distance_meters")),
+            np.asarray(history.column("surge_multiplier")),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a table from a CSV file, an encoded history (.npz) or a columnar history directory
+
+        Raises:
+            FileNotFoundError: If the path does not exist
+        """
+        if os.path.isdir(path):
+            from src.columnar import ColumnarHistory
+            return cls.from_columnar(ColumnarHistory(path))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No quote history at {path}")
+        if path.endswith(".npz"):
+            return cls.from_encoded(EncodedHistory.load(path))
+        return cls.from_encoded(encode_columns(read_csv_columns(path)))
+
+    def dimension(self, name):
+        """
+        Integer codes and labels of a grouping dimension
+
+        Codes are computed once per table and cached.
+
+        Args:
+            name (str): A categorical column or one of DERIVED_DIMENSIONS
+
+        Returns:
+            tuple: (codes in [0, len(labels)), numpy array of labels)
+
+        Raises:
+            ValueError: If the dimension is unknown
+        """
+        if name in self._dimensions:
+            return self._dimensions[name]
+        if name == "route":
+            pickups, destinations = self.dictionaries["pickup"].tolist(), self.dictionaries["destination"].tolist()
+            codes = self.codes["pickup"].astype(np.int32) * len(destinations) + self.codes["destination"]
+            labels = [f"{pickup} to {destination}" for pickup in pickups for destination in destinations]
+        elif name in ("hour_of_week", "weekday", "hour"):
+            # Epoch day 0 was a Thursday; shift so hour 0 of the week is Monday 00:00
+            hour_of_week = ((self.timestamp // 3600 + 72) % 168).astype(np.int16)
+            if name == "hour":
+                codes, labels = hour_of_week % 24, [f"{hour:02d}" for hour in range(24)]
+            elif name == "weekday":
+                codes, labels = hour_of_week // 24, WEEKDAYS
+            else:
+                codes, labels = hour_of_week, [f"{WEEKDAYS[hour // 24]} {hour % 24:02d}" for hour in range(168)]
+        elif name in self.codes:
+            codes, labels = self.codes[name], self.dictionaries[name]
+        else:
+            raise ValueError(f"Unknown dimension {name!r}; use one of {sorted(self.codes) + DERIVED_DIMENSIONS}")
+        self._dimensions[name] = (codes, np.asarray(labels, dtype=str))
+        return self._dimensions[name]
+
+    def group_keys(self, by):
+        """
+        Combine grouping dimensions into one key per row
+
+        The keys of the last grouping are cached, so repeated queries over
+        the same dimensions skip this pass.
+
+        Returns:
+            tuple: (int64 keys, list of label arrays, number of possible keys)
+        """
+        by = tuple(by)
+        if self._keys is not None and self._keys[0] == by:
+            return self._keys[1:]
+        if len(by) == 1:
+            codes, names = self.dimension(by[0])
+            return codes, [names], len(names)
+        key = np.zeros(len(self), dtype=np.int64)
+        labels = []
+        size = 1
+        for name in by:
+            codes, names = self.dimension(name)
+            key *= len(names)
+            key += codes
+            labels.append(names)
+            size *= len(names)
+        self._keys = (by, key, labels, size)
+        return key, labels, size
+
+def metric_values(table, metric, price_column="price_min"):
+    """
+    Per-row values of a metric
+
+    Rows without a price, distance or trip time (as the metric needs) are
+    invalid and hold 0. Values are computed once per table and cached.
+
+    Args:
+        table (QuoteTable): History
+        metric (str): Key of METRICS
+        price_column (str): "price_min" or "price_max"
+
+    Returns:
+        tuple: (float64 values, bool validity mask)
+
+    Raises:
+        ValueError: If the metric is unknown
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}; use one of {sorted(METRICS)}")
+    if (metric, price_column) in table._metrics:
+        return table._metrics[(metric, price_column)]
+    cents = table.prices[price_column]
+    valid = cents > 0
+    denominator = None
+    if metric.startswith("base"):
+        valid &= table.surge > 0
+        denominator = table.surge
+    if metric.endswith("per_km"):
+        valid &= table.distance_meters > 0
+        units = table.distance_meters * 0.001
+        denominator = units if denominator is None else denominator * units
+    elif metric.endswith("per_minute"):
+        valid &= table.trip_seconds > 0
+        units = table.trip_seconds * (1 / 60)
+        denominator = units if denominator is None else denominator * units
+    values = np.zeros(len(table))
+    np.multiply(cents, 0.01, out=values, where=valid)
+    if denominator is not None:
+        np.divide(values, denominator, out=values, where=valid)
+    table._metrics[(metric, price_column)] = (values, valid)
+    return values, valid
+
+def _aggregate(key, size, values, valid):
+    """
+    Counts, sums and sums of squares of the valid values per key
+
+    With dense keys, invalid rows are counted in an extra bin that is
+    dropped, which is cheaper than filtering the columns.
+
+    Returns:
+        tuple: (keys, counts, sums, squares) of the groups with valid values
+    """
+    if size <= DENSE_KEY_LIMIT:
+        key = np.where(valid, key, size)
+        counts = np.bincount(key, minlength=size + 1)[:size]
+        groups = np.flatnonzero(counts)
+        sums = np.bincount(key, weights=values, minlength=size + 1)[groups]
+        squares = np.bincount(key, weights=values * values, minlength=size + 1)[groups]
+        return groups, counts[groups], sums, squares
+    key, values = key[valid], values[valid]
+    groups, key = np.unique(key, return_inverse=True)
+    return groups, np.bincount(key), np.bincount(key, weights=values), np.bincount(key, weights=values * values)
+
+def _labels(groups, labels):
+    """Decode combined keys into one label array per dimension"""
+    decoded = []
+    remaining = np.asarray(groups, dtype=np.int64)
+    for names in reversed(labels):
+        decoded.append(names[remaining % len(names)])
+        remaining = remaining // len(names)
+    return decoded[::-1]
+
+def group_stats(table, metric="per_km", by=("route",), price_column="price_min", min_count=1):
+    """
+    Mean and standard deviation of a metric per group, as arrays
+
+    Args:
+        table (QuoteTable): History
+        metric (str): Key of METRICS
+        by (list): Grouping dimensions (see QuoteTable.dimension)
+        price_column (str): "price_min" or "price_max"
+        min_count (int): Groups with fewer valid rows are left out
+
+    Returns:
+        dict: A label array per dimension, plus "count", "mean" and "std" arrays
+    """
+    values, valid = metric_values(table, metric, price_column)
+    key, labels, size = table.group_keys(by)
+    groups, counts, sums, squares = _aggregate(key, size, values, valid)
+    kept = counts >= max(min_count, 1)
+    groups, counts, sums, squares = groups[kept], counts[kept], sums[kept], squares[kept]
+    means = sums / counts
+    stats = dict(zip(by, _labels(groups, labels)))
+    stats.update(count=counts, mean=means, std=np.sqrt(np.maximum(squares / counts - means * means, 0.0)))
+    return stats
+
+def _records(columns):
+    """Turn a dict of equal-length arrays into a list of row dicts, floats rounded"""
+    names = list(columns)
+    values = [
+        np.round(column, 4).tolist() if column.dtype.kind == "f" else column.tolist()
+        for column in columns.values()
+    ]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+def summarize(table, metric="per_km", by=("route",), price_column="price_min", min_count=1):
+    """
+    Mean and standard deviation of a metric per group
+
+    Same arguments as group_stats().
+
+    Returns:
+        list: Dicts with the group's dimension values, count, mean and std
+    """
+    return _records(group_stats(table, metric, by, price_column, min_count))
+
+def spread_stats(table, metric="price", by=("route",), tier="service_level", price_column="price_min",
+                 providers=SPREAD_PROVIDERS, min_count=1):
+    """
+    Difference between two providers' mean metric per product tier and group, as arrays
+
+    Both providers are aggregated in one pass, keyed by group and provider.
+
+    Args:
+        table (QuoteTable): History
+        metric (str): Key of METRICS
+        by (list): Grouping dimensions; the tier is added after them
+        tier (str): Dimension defining comparable products across providers
+        price_column (str): "price_min" or "price_max"
+        providers (tuple): (first, second) providers; spread = first - second
+        min_count (int): Rows each provider needs in a group
+
+    Returns:
+        dict: A label array per dimension, each provider's count and mean,
+            "spread" (first - second) and "ratio" (first / second)
+    """
+    first, second = providers
+    by = [*by, tier]
+    provider_names = table.dictionaries["provider"].tolist()
+    if first not in provider_names or second not in provider_names:
+        return {name: np.empty(0, dtype=str) for name in by}
+    values, valid = metric_values(table, metric, price_column)
+    provider_codes = table.codes["provider"]
+    is_second = provider_codes == provider_names.index(second)
+    valid = valid & (is_second | (provider_codes == provider_names.index(first)))
+    key, labels, size = table.group_keys(by)
+    groups, counts, sums, _ = _aggregate(key * 2 + is_second, size * 2, values, valid)
+    kept = counts >= max(min_count, 1)
+    groups, counts, means = groups[kept], counts[kept], sums[kept] / counts[kept]
+    side = groups % 2
+    shared, first_index, second_index = np.intersect1d(
+        groups[side == 0] // 2, groups[side == 1] // 2, assume_unique=True, return_indices=True
+    )
+    first_counts, first_means = counts[side == 0][first_index], means[side == 0][first_index]
+    second_counts, second_means = counts[side == 1][second_index], means[side == 1][second_index]
+    stats = dict(zip(by, _labels(shared, labels)))
+    stats.update({
+        f"{first.lower()}_count": first_counts, f"{first.lower()}_mean": first_means,
+        f"{second.lower()}_count": second_counts, f"{second.lower()}_mean": second_means,
+        "spread": first_means - second_means,
+        "ratio": first_means / second_means,
+    })
+    return stats
+
+def spreads(table, metric="price", by=("route",), tier="service_level", price_column="price_min",
+            providers=SPREAD_PROVIDERS, min_count=1):
+    """
+    Difference between two providers' mean metric per product tier and group
+
+    Same arguments as spread_stats().
+
+    Returns:
+        list: Dicts with the group and tier, each provider's count and mean,
+            spread (first - second) and ratio (first / second)
+    """
+    return _records(spread_stats(table, metric, by, tier, price_column, providers, min_count))
+
+def main():
+    """Print a unit-price summary or provider spreads"""
+    parser = argparse.ArgumentParser(description="Unit-price analytics over the quote history")
+    parser.add_argument("input", help="ride_prices.csv, an encoded history .npz or a columnar history directory")
+    parser.add_argument("--metric", choices=sorted(METRICS), default="per_km", help="Metric to aggregate")
+    parser.add_argument("--by", default="route", help="Comma-separated dimensions, e.g. route,hour_of_week,service_level")
+    parser.add_argument("--price", choices=["price_min", "price_max"], default="price_min", help="Price column")
+    parser.add_argument("--spreads", action="store_true", help="Uber minus Lyft per service level instead")
+    parser.add_argument("--min-count", type=int, default=1, help="Fewest rows per group")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    by = [name.strip() for name in args.by.split(",") if name.strip()]
+    try:
+        table = QuoteTable.load(args.input)
+        if args.spreads:
+            rows = spreads(table, args.metric, [name for name in by if name != "service_level"], price_column=args.price,
+                           min_count=args.min_count)
+        else:
+            rows = summarize(table, args.metric, by, args.price, args.min_count)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        print("No groups")
+        return
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.upper().ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+if __name__ == "__main__":
+    main()
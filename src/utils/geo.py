@@ -0,0 +1,188 @@
+"""
+Vectorized geodesic helpers
+
+Distances are great-circle (haversine) or equirectangular approximations
+on a spherical Earth, in meters; bearings are initial bearings in degrees
+clockwise from north. Every function broadcasts over NumPy arrays, and
+pairwise matrices are built in row chunks so temporaries stay small even
+for tens of thousands of points.
+"""
+import numpy as np
+
+# Mean Earth radius in meters
+EARTH_RADIUS_METERS = 6371008.8
+
+# Rows of a pairwise matrix computed per chunk
+DEFAULT_CHUNK_SIZE = 256
+
+def as_coordinates(places):
+    """
+    Convert places to latitude and longitude arrays
+
+    Args:
+        places: List of dicts with "lat"/"lng" (e.g. LOCATIONS values or route
+            registry places), or an array-like of shape (n, 2) as (lat, lng)
+
+    Returns:
+        tuple: (lat, lng) float64 arrays in degrees
+    """
+    if len(places) and isinstance(places[0], dict):
+        return (
+            np.fromiter((place["lat"] for place in places), dtype=np.float64, count=len(places)),
+            np.fromiter((place["lng"] for place in places), dtype=np.float64, count=len(places)),
+        )
+    points = np.asarray(places, dtype=np.float64).reshape(-1, 2)
+    return points[:, 0], points[:, 1]
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance
+
+    Args:
+        lat1, lng1, lat2, lng2 (float or numpy.ndarray): Degrees; arrays broadcast
+
+    Returns:
+        numpy.ndarray: Meters
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def equirectangular(lat1, lng1, lat2, lng2):
+    """
+    Equirectangular approximation of the distance
+
+    Within a city it is within a fraction of a percent of haversine and
+    several times cheaper.
+
+    Returns:
+        numpy.ndarray: Meters
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    x = (lng2 - lng1) * np.cos((lat1 + lat2) / 2)
+    return EARTH_RADIUS_METERS * np.hypot(x, lat2 - lat1)
+
+def bearing(lat1, lng1, lat2, lng2):
+    """
+    Initial bearing from the first point to the second
+
+    Returns:
+        numpy.ndarray: Degrees in [0, 360), clockwise from north
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    dlng = lng2 - lng1
+    y = np.sin(dlng) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlng)
+    return np.degrees(np.arctan2(y, x)) % 360.0
+
+def bearing_difference(a, b):
+    """Smallest absolute angle between two bearings, in degrees [0, 180]"""
+    return np.abs((np.asarray(a) - np.asarray(b) + 180.0) % 360.0 - 180.0)
+
+def destination_point(lat, lng, bearing_degrees, distance):
+    """
+    Point reached by travelling a distance along an initial bearing
+
+    Args:
+        lat, lng (float or numpy.ndarray): Start in degrees
+        bearing_degrees (float or numpy.ndarray): Degrees clockwise from north
+        distance (float or numpy.ndarray): Meters
+
+    Returns:
+        tuple: (lat, lng) in degrees
+    """
+    lat, lng, theta = np.radians(lat), np.radians(lng), np.radians(bearing_degrees)
+    delta = np.asarray(distance, dtype=np.float64) / EARTH_RADIUS_METERS
+    lat2 = np.arcsin(np.sin(lat) * np.cos(delta) + np.cos(lat) * np.sin(delta) * np.cos(theta))
+    lng2 = lng + np.arctan2(np.sin(theta) * np.sin(delta) * np.cos(lat), np.cos(delta) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lng2) + 540.0) % 360.0 - 180.0
+
+def _unit_vectors(lat, lng):
+    """Unit vectors on the sphere for latitudes and longitudes in radians, shape (n, 3)"""
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=1)
+
+def pairwise_distances(points, others=None, method="haversine", chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float32, out=None):
+    """
+    Distance matrix between two sets of points
+
+    Haversine distances come from the chord between unit vectors, so each
+    block of rows is one matrix product plus an arcsine. Equirectangular
+    distances project every point onto one plane at the mean latitude,
+    which is only meant for points within a city or region. Blocks keep
+    temporaries to chunk_size x m values.
+
+    Args:
+        points: Places accepted by as_coordinates(), n of them
+        others: Second set of m places (default: points, giving n x n)
+        method (str): "haversine" or "equirectangular"
+        chunk_size (int): Rows per block
+        dtype: Matrix dtype; float32 halves memory and is accurate to well
+            under a meter at city scale
+        out (numpy.ndarray): Preallocated (n, m) matrix to fill, e.g. a
+            numpy.memmap for matrices larger than memory
+
+    Returns:
+        numpy.ndarray: (n, m) matrix of meters
+    """
+    if method not in ("haversine", "equirectangular"):
+        raise ValueError(f"Unknown distance method {method!r}")
+    lat1, lng1 = (np.radians(values) for values in as_coordinates(points))
+    lat2, lng2 = (lat1, lng1) if others is None else (np.radians(values) for values in as_coordinates(others))
+    if out is None:
+        out = np.empty((len(lat1), len(lat2)), dtype=dtype)
+    elif out.shape != (len(lat1), len(lat2)):
+        raise ValueError(f"out has shape {out.shape}, expected {(len(lat1), len(lat2))}")
+
+    if method == "haversine":
+        vectors1, vectors2 = _unit_vectors(lat1, lng1), _unit_vectors(lat2, lng2)
+        for start in range(0, len(lat1), chunk_size):
+            stop = min(start + chunk_size, len(lat1))
+            # Half the chord length: sqrt((2 - 2 u.v) / 4)
+            half_chord = vectors1[start:stop] @ vectors2.T
+            np.subtract(1.0, half_chord, out=half_chord)
+            np.multiply(half_chord, 0.5, out=half_chord)
+            np.clip(half_chord, 0.0, 1.0, out=half_chord)
+            np.sqrt(half_chord, out=half_chord)
+            np.arcsin(half_chord, out=half_chord)
+            np.multiply(half_chord, 2 * EARTH_RADIUS_METERS, out=out[start:stop], casting="unsafe")
+    else:
+        # Project both sets onto one plane scaled at their mean latitude
+        scale = np.cos(np.mean(np.concatenate([lat1, lat2]))) if len(lat1) and len(lat2) else 1.0
+        planar1 = EARTH_RADIUS_METERS * np.stack([lng1 * scale, lat1], axis=1)
+        planar2 = EARTH_RADIUS_METERS * np.stack([lng2 * scale, lat2], axis=1)
+        norms1, norms2 = np.einsum("ij,ij->i", planar1, planar1), np.einsum("ij,ij->i", planar2, planar2)
+        for start in range(0, len(lat1), chunk_size):
+            stop = min(start + chunk_size, len(lat1))
+            squared = planar1[start:stop] @ planar2.T
+            np.multiply(squared, -2.0, out=squared)
+            squared += norms1[start:stop, None]
+            squared += norms2[None, :]
+            np.maximum(squared, 0.0, out=squared)
+            np.sqrt(squared, out=out[start:stop], casting="unsafe")
+    return out
+
+def route_distances(routes, method="haversine"):
+    """
+    Straight-line length of registry routes
+
+    Useful to join against the driving distance_meters of responses, e.g.
+    to compute detour ratios.
+
+    Args:
+        routes (list): Routes from src.routes.load_routes()
+        method (str): "haversine" or "equirectangular"
+
+    Returns:
+        numpy.ndarray: Meters per route
+    """
+    origin_lat, origin_lng = as_coordinates([route["origin"] for route in routes])
+    dest_lat, dest_lng = as_coordinates([route["destination"] for route in routes])
+    distance = haversine if method == "haversine" else equirectangular
+    return distance(origin_lat, origin_lng, dest_lat, dest_lng)
+
+def route_bearings(routes):
+    """Initial bearing of registry routes, in degrees"""
+    origin_lat, origin_lng = as_coordinates([route["origin"] for route in routes])
+    dest_lat, dest_lng = as_coordinates([route["destination"] for route in routes])
+    return bearing(origin_lat, origin_lng, dest_lat, dest_lng)
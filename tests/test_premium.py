@@ -0,0 +1,82 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.premium import PremiumState, align, match_routes, read_new_rows
+
+ROUTES = [
+    {"route_id": f"{sample}-{pair}", "sample_type": sample, "pair_id": pair,
+     "origin": {"name": f"{sample} origin {pair}"}, "destination": {"name": f"{sample} destination {pair}"}}
+    for sample in ("Sample1", "Sample2") for pair in (1, 2)
+]
+
+FIELDNAMES = ["date", "time", "sample_type", "pickup", "destination", "provider", "product", "price_min", "price_max"]
+
+def cycle_rows(sample, hour, minute=0):
+    """Rows of one sample's writes in the collection cycle starting at hour"""
+    rows = []
+    for pair in (1, 2):
+        for product, price in (("UberX", 20.0), ("Comfort", 30.0)):
+            price += pair + (5.0 if sample == "Sample1" else 0.0) + hour / 10
+            rows.append({
+                "date": "2025-03-10", "time": f"{hour:02d}:{minute + pair:02d}:00", "sample_type": sample,
+                "pickup": f"{sample} origin {pair}", "destination": f"{sample} destination {pair}",
+                "provider": "Uber", "product": product, "price_min": f"{price:.2f}", "price_max": f"{price:.2f}",
+            })
+    return rows
+
+class IncrementalAlignTest(unittest.TestCase):
+    """Runs between the writes of one cycle must align the same pairs as a single run"""
+
+    def setUp(self):
+        self.lookup, _ = match_routes(ROUTES)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ride_prices.csv")
+        self.state_path = os.path.join(self.directory.name, "premium_state.npz")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def append(self, rows):
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def run_incremental(self):
+        state = PremiumState.load(self.state_path)
+        align(read_new_rows(self.path, state), self.lookup, state)
+        state.save(self.state_path)
+        return state
+
+    def assert_same_pairs(self, incremental, scratch):
+        self.assertEqual(len(incremental), len(scratch))
+        for name in PremiumState.ARRAYS:
+            np.testing.assert_array_equal(getattr(incremental, name), getattr(scratch, name))
+
+    def test_run_between_samples_of_a_cycle(self):
+        writes = [cycle_rows("Sample1", 10), cycle_rows("Sample2", 10, 5),
+                  cycle_rows("Sample1", 11), cycle_rows("Sample2", 11, 5)]
+        for rows in writes:
+            self.append(rows)
+            incremental = self.run_incremental()
+
+        scratch = PremiumState()
+        align(read_new_rows(self.path, scratch), self.lookup, scratch)
+        self.assertEqual(len(scratch), 8)
+        self.assert_same_pairs(incremental, scratch)
+
+    def test_rerun_without_new_rows_keeps_pairs(self):
+        self.append(cycle_rows("Sample1", 10) + cycle_rows("Sample2", 10, 5))
+        first = self.run_incremental()
+        second = self.run_incremental()
+        self.assertEqual(len(first), 4)
+        self.assert_same_pairs(second, first)
+
+if __name__ == "__main__":
+    unittest.main()